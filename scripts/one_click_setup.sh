@@ -7,6 +7,7 @@ PRICE_SOURCE="${PRICE_SOURCE:-akshare}"
 REQUEST_SLEEP="${REQUEST_SLEEP:-0.6}"
 MAX_RETRIES="${MAX_RETRIES:-5}"
 RETRY_BACKOFF="${RETRY_BACKOFF:-2}"
+FETCH_WORKERS="${FETCH_WORKERS:-1}"
 MODE="${MODE:-full}"
 END_DATE="${END_DATE:-}"
 RUN_BACKGROUND="${RUN_BACKGROUND:-1}"
@@ -36,11 +37,12 @@ export PRICE_SOURCE
 export REQUEST_SLEEP
 export MAX_RETRIES
 export RETRY_BACKOFF
+export FETCH_WORKERS
 
 python -m src.main init
 
 if [ "$MODE" = "full" ]; then
-  CMD="python -m src.main full"
+  CMD="python -m src.main full && python -m src.main compact"
 else
   if [ -n "$END_DATE" ]; then
     CMD="python -m src.main update --end-date $END_DATE"
@@ -0,0 +1,158 @@
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+
+from .schema import parse_dates
+
+ADJ_FACTOR_KEYS = ["ts_code", "trade_date"]
+DERIVED_ADJUSTS = ("qfq", "hfq")
+ADJUSTED_COLUMNS = ["open", "high", "low", "close", "pre_close"]
+TICK = 0.005
+
+FactorBase = dict[str, tuple[pd.Timestamp, float]]
+
+
+def latest_factors(factors: pd.DataFrame) -> FactorBase:
+    if factors.empty:
+        return {}
+    data = factors.sort_values(ADJ_FACTOR_KEYS)
+    last = data.groupby(data["ts_code"].astype(str)).tail(1)
+    return {
+        str(row.ts_code): (pd.Timestamp(row.trade_date), float(row.adj_factor))
+        for row in last.itertuples(index=False)
+    }
+
+
+def earliest_factors(factors: pd.DataFrame) -> dict[str, pd.Timestamp]:
+    if factors.empty:
+        return {}
+    first = factors.groupby(factors["ts_code"].astype(str))["trade_date"].min()
+    return {str(code): pd.Timestamp(day) for code, day in first.items()}
+
+
+def factor_events(bars: pd.DataFrame, base: FactorBase) -> pd.DataFrame:
+    columns = ["ts_code", "trade_date", "adj_factor"]
+    if bars.empty or not {"close", "change"} <= set(bars.columns):
+        return pd.DataFrame(columns=columns)
+    data = bars
+    if "adjust" in data.columns:
+        data = data[data["adjust"].astype(str) == "none"]
+    data = pd.DataFrame(
+        {
+            "ts_code": data["ts_code"].astype(str),
+            "trade_date": parse_dates(data["trade_date"]),
+            "close": pd.to_numeric(data["close"], errors="coerce").round(2),
+            "change": pd.to_numeric(data["change"], errors="coerce"),
+        }
+    )
+    data = data.dropna(subset=["trade_date", "close"])
+    data = data.sort_values(["ts_code", "trade_date"], ignore_index=True)
+    if data.empty:
+        return pd.DataFrame(columns=columns)
+    codes = data["ts_code"]
+    pre_close = (data["close"] - data["change"]).round(2)
+    prev_close = data.groupby("ts_code")["close"].shift(1)
+    known = {code: base[code] for code in codes.unique() if code in base}
+    base_date = pd.to_datetime(codes.map({c: v[0] for c, v in known.items()}))
+    base_factor = codes.map({c: v[1] for c, v in known.items()}).astype("float64")
+    fresh = base_date.isna() | (data["trade_date"] > base_date)
+    event = (
+        fresh
+        & prev_close.notna()
+        & pre_close.gt(0)
+        & (prev_close - pre_close).abs().ge(TICK)
+    )
+    ratio = (prev_close / pre_close).where(event, 1.0)
+    factor = ratio.groupby(codes).cumprod() * base_factor.fillna(1.0)
+    first = ~codes.duplicated() & base_factor.isna()
+    keep = event | first
+    return pd.DataFrame(
+        {
+            "ts_code": codes[keep],
+            "trade_date": data["trade_date"][keep],
+            "adj_factor": factor[keep],
+        }
+    ).reset_index(drop=True)
+
+
+def apply_factors(raw: pd.DataFrame, factors: pd.DataFrame, how: str) -> pd.DataFrame:
+    if how not in DERIVED_ADJUSTS:
+        raise ValueError(f"unknown adjust {how!r}")
+    data = raw.reset_index(drop=True)
+    data["adjust"] = how
+    if data.empty:
+        return data
+    left = pd.DataFrame(
+        {
+            "_row": np.arange(len(data)),
+            "_code": data["ts_code"].astype(str),
+            "trade_date": data["trade_date"],
+        }
+    ).sort_values("trade_date")
+    fac = pd.DataFrame(
+        {
+            "_code": factors["ts_code"].astype(str),
+            "trade_date": factors["trade_date"],
+            "adj_factor": factors["adj_factor"].astype("float64"),
+        }
+    ).sort_values("trade_date")
+    merged = pd.merge_asof(left, fac, on="trade_date", by="_code", direction="backward")
+    scale = merged["adj_factor"].fillna(1.0)
+    if how == "qfq":
+        latest = fac.groupby("_code")["adj_factor"].last()
+        scale = scale / merged["_code"].map(latest).fillna(1.0)
+    scale = scale.to_numpy()[np.argsort(merged["_row"].to_numpy())]
+    for col in ADJUSTED_COLUMNS:
+        if col in data.columns:
+            values = pd.to_numeric(data[col], errors="coerce").to_numpy("float64")
+            data[col] = (values * scale).astype(data[col].dtype, copy=False)
+    if {"change", "close", "pre_close"} <= set(data.columns):
+        data["change"] = (data["close"] - data["pre_close"]).astype(data["change"].dtype)
+    return data
+
+
+class AdjustedPriceWriter:
+    def __init__(
+        self,
+        prices,
+        factors,
+        base: FactorBase,
+        first: dict[str, pd.Timestamp] | None = None,
+    ) -> None:
+        self.prices = prices
+        self.factors = factors
+        self.base = base
+        self.first = first or {}
+        self.backfilled: set[str] = set()
+        self.date_col = prices.date_col
+
+    @property
+    def pending_rows(self) -> int:
+        return self.prices.pending_rows
+
+    def add(self, df: pd.DataFrame, history: pd.DataFrame | None = None) -> None:
+        if df is None or df.empty:
+            return
+        self.prices.add(df)
+        if self.first:
+            codes = df["ts_code"].astype(str)
+            starts = parse_dates(df[self.date_col]).groupby(codes).min()
+            for code, start in starts.items():
+                if code in self.first and start < self.first[code]:
+                    self.backfilled.add(code)
+        bars = df if history is None else pd.concat([history, df], ignore_index=True)
+        events = factor_events(bars, self.base)
+        if not events.empty:
+            self.factors.add(events)
+            self.base.update(latest_factors(events))
+
+    def should_flush(self) -> bool:
+        return self.prices.should_flush() or self.factors.should_flush()
+
+    def flush(self) -> int:
+        self.factors.flush()
+        return self.prices.flush()
+
+    def close(self) -> int:
+        return self.flush()
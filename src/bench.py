@@ -0,0 +1,196 @@
+from __future__ import annotations
+
+import argparse
+from datetime import datetime
+import json
+import os
+from pathlib import Path
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import pyarrow.parquet as pq
+
+from . import metrics
+
+SCENARIOS = ("full", "update", "storage")
+DEFAULT_SIZES = (100, 1000, 5000)
+
+
+def _count_rows(root: Path) -> int:
+    return sum(pq.read_metadata(path).num_rows for path in root.rglob("*.parquet"))
+
+
+def _peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _run_full(cfg, args) -> dict:
+    from .pipeline import full_download, init_storage
+
+    init_storage(cfg)
+    started = time.perf_counter()
+    full_download(cfg, args.start_date, args.end_date)
+    return {"seconds": time.perf_counter() - started}
+
+
+def _run_update(cfg, args) -> dict:
+    from .pipeline import full_download, incremental_update, init_storage
+
+    init_storage(cfg)
+    full_download(cfg, args.start_date, args.end_date)
+    metrics.REGISTRY.reset()
+    started = time.perf_counter()
+    incremental_update(cfg, args.update_end_date)
+    return {"seconds": time.perf_counter() - started}
+
+
+def _run_storage(cfg, args) -> dict:
+    from . import fake_source
+    from .data_source import _code_to_ts, _normalize_price_df
+    from .pipeline import _price_writer, compact_price, init_storage
+
+    init_storage(cfg)
+    sh, sz = fake_source._universe()
+    with metrics.timer("generate"):
+        frames = [
+            _normalize_price_df(fake_source._bars(code), _code_to_ts(code), "none")
+            for code in sh + sz
+        ]
+    metrics.REGISTRY.reset()
+    started = time.perf_counter()
+    writer = _price_writer(cfg)
+    with metrics.timer("write"):
+        for frame in frames:
+            writer.add(frame)
+            if writer.should_flush():
+                writer.flush()
+        writer.close()
+    with metrics.timer("compact"):
+        compact_price(cfg)
+    return {"seconds": time.perf_counter() - started}
+
+
+def run_child(args) -> dict:
+    from .config import AppConfig
+
+    cfg = AppConfig()
+    runner = {"full": _run_full, "update": _run_update, "storage": _run_storage}
+    result = runner[args.scenario](cfg, args)
+    rows = _count_rows(cfg.parquet_dir) if cfg.parquet_dir.exists() else 0
+    seconds = result["seconds"]
+    return {
+        "scenario": args.scenario,
+        "codes": args.codes,
+        "seconds": round(seconds, 3),
+        "rows": rows,
+        "codes_per_s": round(args.codes / seconds, 2) if seconds else None,
+        "rows_per_s": round(rows / seconds, 1) if seconds else None,
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+        "stages": metrics.REGISTRY.stage_totals(),
+        "counters": metrics.REGISTRY.snapshot()["counters"],
+    }
+
+
+def _child_env(args, codes: int, data_dir: Path) -> dict[str, str]:
+    env = dict(os.environ)
+    env.update(
+        {
+            "DATA_SOURCE": "fake",
+            "PRICE_SOURCE": "fake",
+            "DATA_DIR": str(data_dir),
+            "FAKE_CODES": str(codes),
+            "FAKE_LATENCY": str(args.latency),
+            "FAKE_ERROR_RATE": str(args.error_rate),
+            "REQUEST_SLEEP": "0",
+            "CACHE_MODE": "off",
+            "LOG_LEVEL": "WARNING",
+            "MAX_RETRIES": env.get("MAX_RETRIES", "3"),
+            "RETRY_BACKOFF": env.get("RETRY_BACKOFF", "0"),
+        }
+    )
+    return env
+
+
+def run_suite(args) -> dict:
+    results = []
+    for scenario in args.scenarios:
+        for codes in args.sizes:
+            data_dir = Path(tempfile.mkdtemp(prefix=f"bench-{scenario}-{codes}-"))
+            cmd = [
+                sys.executable,
+                "-m",
+                "src.bench",
+                "--child",
+                "--scenario",
+                scenario,
+                "--codes",
+                str(codes),
+                "--start-date",
+                args.start_date,
+                "--end-date",
+                args.end_date,
+                "--update-end-date",
+                args.update_end_date,
+            ]
+            try:
+                proc = subprocess.run(
+                    cmd,
+                    env=_child_env(args, codes, data_dir),
+                    capture_output=True,
+                    text=True,
+                    check=True,
+                )
+                result = json.loads(proc.stdout.strip().splitlines()[-1])
+            except subprocess.CalledProcessError as exc:
+                result = {
+                    "scenario": scenario,
+                    "codes": codes,
+                    "error": exc.stderr.strip().splitlines()[-1:] or ["failed"],
+                }
+            finally:
+                shutil.rmtree(data_dir, ignore_errors=True)
+            results.append(result)
+            print(json.dumps(result, ensure_ascii=False), file=sys.stderr)
+    return {
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "latency": args.latency,
+        "error_rate": args.error_rate,
+        "results": results,
+    }
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--sizes", nargs="+", type=int, default=list(DEFAULT_SIZES))
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--start-date", default="20240101")
+    parser.add_argument("--end-date", default="20241231")
+    parser.add_argument("--update-end-date", default="20250110")
+    parser.add_argument("--out", default=None)
+    parser.add_argument("--child", action="store_true")
+    parser.add_argument("--scenario", choices=SCENARIOS)
+    parser.add_argument("--codes", type=int)
+    return parser
+
+
+def main() -> None:
+    args = build_parser().parse_args()
+    if args.child:
+        print(json.dumps(run_child(args), ensure_ascii=False))
+        return
+    report = run_suite(args)
+    out = Path(args.out or f"bench_results/bench-{datetime.now():%Y%m%d-%H%M%S}.json")
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, ensure_ascii=False, indent=2))
+    print(out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from .config import AppConfig
+
+DEFAULT_TTLS = {
+    "stock_zh_a_hist": 6 * 3600,
+    "get_market": 6 * 3600,
+    "stock_zh_a_spot_em": 3600,
+    "list_market_current": 3600,
+    "stock_financial_report_sina": 24 * 3600,
+    "stock_financial_analysis_indicator": 24 * 3600,
+    "stock_info_sh_name_code": 24 * 3600,
+    "stock_info_sz_name_code": 24 * 3600,
+    "all_code": 24 * 3600,
+    "tool_trade_date_hist_sina": 7 * 24 * 3600,
+    "trade_calendar": 7 * 24 * 3600,
+}
+DEFAULT_TTL = 6 * 3600
+RANGE_KWARGS = {"start_date", "end_date"}
+DATE_COLUMNS = ("日期", "date", "trade_date")
+
+
+class CacheMissError(LookupError):
+    pass
+
+
+def _digest(payload: object) -> str:
+    text = json.dumps(payload, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _clip(df: pd.DataFrame, start: str | None, end: str | None) -> pd.DataFrame:
+    column = next((c for c in DATE_COLUMNS if c in df.columns), None)
+    if column is None:
+        return df
+    dates = pd.to_datetime(df[column].astype(str), errors="coerce")
+    mask = dates.notna()
+    if start:
+        mask &= dates >= pd.to_datetime(start)
+    if end:
+        mask &= dates <= pd.to_datetime(end)
+    return df.loc[mask]
+
+
+class ResponseCache:
+    def __init__(
+        self, root: Path, max_bytes: int, ttls: dict[str, float] | None = None
+    ) -> None:
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttls = {**DEFAULT_TTLS, **(ttls or {})}
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.root / "index.db", check_same_thread=False)
+        self._conn.execute("pragma journal_mode=wal")
+        self._conn.execute(
+            "create table if not exists entries (key text primary key, "
+            "identity text not null, endpoint text not null, path text not null, "
+            "size integer not null, created_at real not null, accessed_at real not null)"
+        )
+        self._conn.execute(
+            "create index if not exists entries_identity on entries(identity, created_at)"
+        )
+        self._conn.commit()
+
+    def keys(self, endpoint: str, args: tuple, kwargs: dict) -> tuple[str, str]:
+        key = _digest([endpoint, list(args), kwargs])
+        narrowed = {k: v for k, v in kwargs.items() if k not in RANGE_KWARGS}
+        return key, _digest([endpoint, list(args), narrowed])
+
+    def _ttl(self, endpoint: str) -> float:
+        return self.ttls.get(endpoint, DEFAULT_TTL)
+
+    def _read(self, path: str) -> pd.DataFrame | None:
+        try:
+            return pd.read_parquet(self.root / path)
+        except (FileNotFoundError, OSError):
+            return None
+
+    def get(self, endpoint: str, key: str) -> pd.DataFrame | None:
+        with self._lock:
+            row = self._conn.execute(
+                "select path, created_at from entries where key = ?", (key,)
+            ).fetchone()
+        if row is None or time.time() - row[1] > self._ttl(endpoint):
+            return None
+        df = self._read(row[0])
+        if df is not None:
+            self._touch([key])
+        return df
+
+    def replay(
+        self, key: str, identity: str, window: dict[str, str] | None = None
+    ) -> pd.DataFrame:
+        with self._lock:
+            row = self._conn.execute(
+                "select path from entries where key = ?", (key,)
+            ).fetchone()
+            rows = (
+                [(key, row[0])]
+                if row
+                else self._conn.execute(
+                    "select key, path from entries where identity = ? "
+                    "order by created_at",
+                    (identity,),
+                ).fetchall()
+            )
+        frames = [df for df in (self._read(path) for _, path in rows) if df is not None]
+        if not row and window:
+            start, end = window.get("start_date"), window.get("end_date")
+            frames = [df for df in (_clip(df, start, end) for df in frames) if not df.empty]
+        if not frames:
+            raise CacheMissError(key)
+        self._touch([k for k, _ in rows])
+        if len(frames) == 1:
+            return frames[0]
+        data = pd.concat(frames, ignore_index=True)
+        return data.drop_duplicates(keep="last").reset_index(drop=True)
+
+    def put(self, endpoint: str, key: str, identity: str, df: pd.DataFrame) -> None:
+        rel = Path(endpoint) / key[:2] / f"{key}.parquet"
+        path = self.root / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            df.to_parquet(tmp, index=False, compression="zstd")
+        except Exception:
+            tmp.unlink(missing_ok=True)
+            return
+        os.replace(tmp, path)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "insert or replace into entries values(?, ?, ?, ?, ?, ?, ?)",
+                (key, identity, endpoint, str(rel), path.stat().st_size, now, now),
+            )
+            self._conn.commit()
+        self.evict()
+
+    def _touch(self, keys: list[str]) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "update entries set accessed_at = ? where key = ?",
+                [(now, key) for key in keys],
+            )
+            self._conn.commit()
+
+    def evict(self) -> int:
+        with self._lock:
+            total = self._conn.execute(
+                "select coalesce(sum(size), 0) from entries"
+            ).fetchone()[0]
+            if total <= self.max_bytes:
+                return 0
+            target = int(self.max_bytes * 0.9)
+            removed = []
+            for key, path, size in self._conn.execute(
+                "select key, path, size from entries order by accessed_at"
+            ).fetchall():
+                if total <= target:
+                    break
+                (self.root / path).unlink(missing_ok=True)
+                removed.append((key,))
+                total -= size
+            self._conn.executemany("delete from entries where key = ?", removed)
+            self._conn.commit()
+        return len(removed)
+
+
+_caches: dict[Path, ResponseCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(cfg: AppConfig) -> ResponseCache | None:
+    if cfg.cache_mode == "off":
+        return None
+    with _caches_lock:
+        cache = _caches.get(cfg.cache_dir)
+        if cache is None:
+            cache = ResponseCache(cfg.cache_dir, cfg.cache_max_bytes, cfg.cache_ttls)
+            _caches[cfg.cache_dir] = cache
+        return cache
@@ -0,0 +1,170 @@
+from __future__ import annotations
+
+from datetime import datetime
+import hashlib
+import logging
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from . import metrics
+from .config import AppConfig
+from .reader import load_financials, read_financial_file
+from .schema import FINANCIAL_KEYS, FINANCIAL_WIDE, conform
+from .storage import (
+    add_revisions,
+    get_row_hashes,
+    next_revision,
+    set_row_hashes,
+    upsert_parquet_by_year,
+)
+
+logger = logging.getLogger(__name__)
+
+REVISION_KEYS = ["ts_code", "end_date", "revision"]
+HASH_COLUMN = "_row_hash"
+
+
+def revisions_dataset(dataset: str) -> str:
+    return f"{dataset}_revisions"
+
+
+def _token(value) -> str:
+    if isinstance(value, (bool, np.bool_)):
+        return str(value)
+    if isinstance(value, (int, float, np.number)):
+        return repr(float(value))
+    text = str(value).strip()
+    try:
+        return repr(float(text))
+    except ValueError:
+        return text
+
+
+def row_hashes(data: pd.DataFrame) -> pd.Series:
+    columns = sorted(c for c in data.columns if c not in FINANCIAL_KEYS)
+    hashes = []
+    for values in data[columns].itertuples(index=False, name=None):
+        parts = [f"{c}={_token(v)}" for c, v in zip(columns, values) if not pd.isna(v)]
+        digest = hashlib.blake2b("\x1f".join(parts).encode("utf-8"), digest_size=16)
+        hashes.append(digest.hexdigest())
+    return pd.Series(hashes, index=data.index, dtype="object")
+
+
+def prepare_financial(df: pd.DataFrame) -> pd.DataFrame:
+    if df is None or df.empty or "end_date" not in df.columns:
+        return df
+    data = conform(df, FINANCIAL_WIDE).dropna(subset=["end_date"])
+    data = data.drop_duplicates(subset=FINANCIAL_KEYS, keep="last")
+    data[HASH_COLUMN] = row_hashes(data)
+    return data
+
+
+def _row_keys(data: pd.DataFrame) -> list[tuple[str, str]]:
+    return list(
+        zip(data["ts_code"].astype(str), data["end_date"].dt.strftime("%Y%m%d"))
+    )
+
+
+def _seed_hashes(
+    cfg: AppConfig, target_dir: Path, dataset: str
+) -> dict[tuple[str, str], str]:
+    known: dict[tuple[str, str], str] = {}
+    for path in sorted(target_dir.glob("[0-9][0-9][0-9][0-9].parquet")):
+        data = read_financial_file(cfg, dataset, path)
+        data = data.dropna(subset=["end_date"])
+        known.update(zip(_row_keys(data), row_hashes(data)))
+    return known
+
+
+class ChangeFilteringWriter:
+    def __init__(self, cfg: AppConfig, conn, writer, dataset: str) -> None:
+        self.cfg = cfg
+        self.conn = conn
+        self.writer = writer
+        self.dataset = dataset
+        self.date_col = writer.date_col
+        self.known = get_row_hashes(conn, dataset)
+        self._hashes: list[tuple[str, str, str, str]] = []
+        self._revised: dict[tuple[str, str], tuple[str, str]] = {}
+        if not self.known and any(writer.base_dir.glob("*.parquet")):
+            self.known = _seed_hashes(cfg, writer.base_dir, dataset)
+            now = datetime.now().isoformat(timespec="seconds")
+            set_row_hashes(
+                conn,
+                dataset,
+                [(code, end, digest, now) for (code, end), digest in self.known.items()],
+            )
+
+    @property
+    def pending_rows(self) -> int:
+        return self.writer.pending_rows
+
+    def add(self, df: pd.DataFrame) -> None:
+        if df is None or df.empty or "end_date" not in df.columns:
+            return
+        if HASH_COLUMN not in df.columns:
+            df = prepare_financial(df)
+        if df.empty:
+            return
+        data = df.drop(columns=[HASH_COLUMN])
+        now = datetime.now().isoformat(timespec="seconds")
+        changed = np.zeros(len(data), dtype=bool)
+        revised = 0
+        for idx, (key, digest) in enumerate(zip(_row_keys(data), df[HASH_COLUMN])):
+            old = self.known.get(key)
+            if old == digest:
+                continue
+            changed[idx] = True
+            if old is not None:
+                revised += 1
+                first = self._revised.get(key, (old, digest))[0]
+                self._revised[key] = (first, digest)
+            self.known[key] = digest
+            self._hashes.append((*key, digest, now))
+        metrics.inc("rows_unchanged_total", int((~changed).sum()), dataset=self.dataset)
+        metrics.inc("rows_revised_total", revised, dataset=self.dataset)
+        if changed.any():
+            self.writer.add(data[changed])
+
+    def should_flush(self) -> bool:
+        return self.writer.should_flush()
+
+    def _archive_revisions(self) -> None:
+        now = datetime.now().isoformat(timespec="seconds")
+        revisions = {
+            key: next_revision(self.conn, self.dataset, *key) for key in self._revised
+        }
+        records = [
+            (*key, revisions[key], old_hash, new_hash, now)
+            for key, (old_hash, new_hash) in self._revised.items()
+        ]
+        add_revisions(self.conn, self.dataset, records, commit=False)
+        codes = sorted({code for code, _ in self._revised})
+        periods = sorted({end for _, end in self._revised})
+        previous = load_financials(self.cfg, self.dataset, codes=codes, periods=periods)
+        if previous.empty:
+            return
+        keys = pd.Series(_row_keys(previous), index=previous.index)
+        previous = previous[keys.isin(list(self._revised))].copy()
+        previous["revision"] = [revisions[key] for key in _row_keys(previous)]
+        previous["revised_at"] = now
+        name = revisions_dataset(self.dataset)
+        target = self.cfg.dataset_dir(name)
+        target.mkdir(parents=True, exist_ok=True)
+        upsert_parquet_by_year(previous, target, "end_date", REVISION_KEYS, name)
+        logger.info("%s: archived %d restated rows", self.dataset, len(previous))
+
+    def flush(self) -> int:
+        if self._revised:
+            self._archive_revisions()
+        written = self.writer.flush()
+        if self._hashes:
+            set_row_hashes(self.conn, self.dataset, self._hashes, commit=False)
+        self._hashes = []
+        self._revised = {}
+        return written
+
+    def close(self) -> int:
+        return self.flush()
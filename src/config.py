@@ -1,27 +1,140 @@
 from __future__ import annotations
 
+import hashlib
 import os
 from pathlib import Path
 
 
+def _parse_mapping(text: str) -> dict[str, float]:
+    values: dict[str, float] = {}
+    for item in text.split(","):
+        if "=" not in item:
+            continue
+        name, value = item.split("=", 1)
+        values[name.strip()] = float(value)
+    return values
+
+
+def _parse_list(text: str) -> list[str]:
+    return [item.strip().lower() for item in text.split(",") if item.strip()]
+
+
+def _shared_dir(data_dir: Path) -> Path:
+    shm = Path("/dev/shm")
+    if not shm.is_dir():
+        return data_dir / "serve"
+    digest = hashlib.sha1(str(data_dir.resolve()).encode("utf-8")).hexdigest()[:12]
+    return shm / f"astock-{digest}"
+
+
 class AppConfig:
     def __init__(self) -> None:
         self.base_dir = Path(__file__).resolve().parents[1]
-        self.data_dir = self.base_dir / "data"
-        self.parquet_dir = self.data_dir / "parquet"
-        self.price_dir = self.parquet_dir / "price_daily"
-        self.balance_dir = self.parquet_dir / "balance_sheet"
-        self.income_dir = self.parquet_dir / "income_statement"
-        self.cashflow_dir = self.parquet_dir / "cashflow_statement"
-        self.indicator_dir = self.parquet_dir / "fina_indicator"
-        self.sqlite_path = self.data_dir / "meta.db"
+        self.root_dir = Path(os.getenv("DATA_DIR", str(self.base_dir / "data")))
+        self.shard: tuple[int, int] | None = None
+        self._set_paths(self.root_dir)
         self.default_start_date = "20210210"
         self.default_end_date = "20260210"
         self.data_source = os.getenv("DATA_SOURCE", "akshare").lower()
         self.price_source = os.getenv("PRICE_SOURCE", self.data_source).lower()
+        self.data_sources = _parse_list(os.getenv("DATA_SOURCES", self.data_source))
+        self.price_sources = _parse_list(os.getenv("PRICE_SOURCES", self.price_source))
+        self.breaker_failures = max(1, int(os.getenv("BREAKER_FAILURES", "5")))
+        self.breaker_reset = float(os.getenv("BREAKER_RESET_SECONDS", "60"))
+        self.failover_retries = max(1, int(os.getenv("FAILOVER_RETRIES", "1")))
+        self.hedge_requests = os.getenv("HEDGE_REQUESTS", "0") == "1"
+        self.hedge_quantile = float(os.getenv("HEDGE_QUANTILE", "0.95"))
+        self.hedge_min_samples = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
         self.request_sleep = float(os.getenv("REQUEST_SLEEP", "0.3"))
         self.max_retries = int(os.getenv("MAX_RETRIES", "3"))
         self.retry_backoff = float(os.getenv("RETRY_BACKOFF", "1.5"))
+        self.fetch_workers = max(1, int(os.getenv("FETCH_WORKERS", "1")))
+        self.fetch_queue = max(
+            1, int(os.getenv("FETCH_QUEUE", str(self.fetch_workers * 2)))
+        )
+        self.write_queue = max(1, int(os.getenv("WRITE_QUEUE", "64")))
+        self.normalize_workers = max(0, int(os.getenv("NORMALIZE_WORKERS", "0")))
+        default_rate = 1.0 / self.request_sleep if self.request_sleep > 0 else 0.0
+        self.request_rate = float(os.getenv("REQUEST_RATE", str(default_rate)))
+        self.request_burst = max(1, int(os.getenv("REQUEST_BURST", "1")))
+        self.endpoint_rates = _parse_mapping(os.getenv("REQUEST_RATES", ""))
+        self.checkpoint_every = max(1, int(os.getenv("CHECKPOINT_EVERY", "200")))
+        self.report_recheck_days = max(1, int(os.getenv("REPORT_RECHECK_DAYS", "3")))
+        self.snapshot_after = os.getenv("SNAPSHOT_AFTER", "15:30")
+        self.factor_update = os.getenv("FACTOR_UPDATE", "1") == "1"
+        self.factor_workers = max(
+            1, int(os.getenv("FACTOR_WORKERS", str(os.cpu_count() or 1)))
+        )
+        self.factor_chunk_codes = max(1, int(os.getenv("FACTOR_CHUNK_CODES", "200")))
+        self.daemon_run_at = os.getenv("DAEMON_RUN_AT", "15:45")
+        self.daemon_poll = float(os.getenv("DAEMON_POLL_SECONDS", "300"))
+        self.daemon_retry = float(os.getenv("DAEMON_RETRY_SECONDS", "600"))
+        self.serve_years = max(0, int(os.getenv("SERVE_YEARS", "2")))
+        self.serve_poll = float(os.getenv("SERVE_POLL_SECONDS", "10"))
+        self.cache_mode = os.getenv("CACHE_MODE", "on").lower()
+        self.cache_max_bytes = int(
+            float(os.getenv("CACHE_MAX_MB", "4096")) * 1024 * 1024
+        )
+        self.cache_ttls = _parse_mapping(os.getenv("CACHE_TTLS", ""))
+        self.reader_cache_bytes = int(
+            float(os.getenv("READER_CACHE_MB", "512")) * 1024 * 1024
+        )
+        self.pit_refresh_days = int(os.getenv("PIT_REFRESH_DAYS", "120"))
+        self.progress_interval = float(os.getenv("PROGRESS_INTERVAL", "30"))
+        self.write_buffer_rows = int(os.getenv("WRITE_BUFFER_ROWS", "500000"))
+        self.write_buffer_bytes = int(
+            float(os.getenv("WRITE_BUFFER_MB", "256")) * 1024 * 1024
+        )
+        self.stream_chunk_rows = max(1, int(os.getenv("STREAM_CHUNK_ROWS", "100000")))
+
+    def _set_paths(self, data_dir: Path) -> None:
+        self.data_dir = data_dir
+        self.parquet_dir = self.data_dir / "parquet"
+        self.price_dir = self.parquet_dir / "price_daily"
+        self.balance_dir = self.parquet_dir / "balance_sheet"
+        self.income_dir = self.parquet_dir / "income_statement"
+        self.cashflow_dir = self.parquet_dir / "cashflow_statement"
+        self.indicator_dir = self.parquet_dir / "fina_indicator"
+        self.adj_factor_dir = self.parquet_dir / "adj_factor"
+        self.sqlite_path = self.data_dir / "meta.db"
+        self.cache_dir = self.data_dir / "cache"
+        self.panel_dir = self.data_dir / "panel"
+        self.metrics_dir = Path(os.getenv("METRICS_DIR", str(self.data_dir / "metrics")))
+        self.daemon_socket = Path(
+            os.getenv("DAEMON_SOCKET", str(self.data_dir / "daemon.sock"))
+        )
+        self.serve_socket = Path(
+            os.getenv("SERVE_SOCKET", str(self.data_dir / "serve.sock"))
+        )
+        self.serve_dir = Path(os.getenv("SERVE_DIR", str(_shared_dir(self.data_dir))))
+
+    @property
+    def shards_dir(self) -> Path:
+        return self.root_dir / "shards"
+
+    def use_shard(self, index: int, count: int) -> None:
+        if count < 1 or not 0 <= index < count:
+            raise ValueError(f"invalid shard {index}/{count}")
+        self.shard = (index, count)
+        self._set_paths(self.shards_dir / f"{index}-of-{count}")
+
+    def use_data_dir(self, data_dir: Path) -> None:
+        self.shard = None
+        self._set_paths(Path(data_dir))
+
+    def dataset_dir(self, dataset: str) -> Path:
+        dirs = {
+            "price_daily": self.price_dir,
+            "balance_sheet": self.balance_dir,
+            "income_statement": self.income_dir,
+            "cashflow_statement": self.cashflow_dir,
+            "fina_indicator": self.indicator_dir,
+            "adj_factor": self.adj_factor_dir,
+        }
+        return dirs.get(dataset, self.parquet_dir / dataset)
+
+    def rate_for(self, endpoint: str) -> float:
+        return self.endpoint_rates.get(endpoint, self.request_rate)
 
     def ensure_dirs(self) -> None:
         self.price_dir.mkdir(parents=True, exist_ok=True)
@@ -29,3 +142,4 @@ class AppConfig:
         self.income_dir.mkdir(parents=True, exist_ok=True)
         self.cashflow_dir.mkdir(parents=True, exist_ok=True)
         self.indicator_dir.mkdir(parents=True, exist_ok=True)
+        self.adj_factor_dir.mkdir(parents=True, exist_ok=True)
@@ -0,0 +1,239 @@
+from __future__ import annotations
+
+from bisect import bisect_right
+from datetime import date, datetime, timedelta
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import threading
+
+from . import metrics
+from .config import AppConfig
+from .data_source import _adata, _akshare, fetch_main_board_stocks, fetch_trade_calendar
+from .pipeline import incremental_update
+from .planner import in_report_window, load_open_days
+from .storage import get_last_date, init_sqlite, replace_table, set_last_date
+
+logger = logging.getLogger(__name__)
+
+COMMANDS = ("status", "run", "stop")
+
+
+def _trigger_at(day: str, run_at: str) -> datetime:
+    hour, minute = (int(part) for part in run_at.split(":"))
+    return datetime.strptime(day, "%Y%m%d").replace(hour=hour, minute=minute)
+
+
+def due_session(open_days: list[str], run_at: str, now: datetime) -> str | None:
+    idx = bisect_right(open_days, now.strftime("%Y%m%d"))
+    for day in reversed(open_days[max(0, idx - 2) : idx]):
+        if _trigger_at(day, run_at) <= now:
+            return day
+    return None
+
+
+def next_trigger(open_days: list[str], run_at: str, now: datetime) -> datetime | None:
+    idx = bisect_right(open_days, now.strftime("%Y%m%d")) - 1
+    for day in open_days[max(0, idx) :]:
+        at = _trigger_at(day, run_at)
+        if at > now:
+            return at
+    return None
+
+
+def _warm_imports(cfg: AppConfig) -> None:
+    for source in dict.fromkeys([*cfg.data_sources, *cfg.price_sources]):
+        try:
+            if source == "adata":
+                _adata()
+            else:
+                _akshare(source)
+        except ImportError as exc:
+            logger.warning("daemon: cannot import %s: %s", source, exc)
+
+
+class _ControlServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str, daemon: "Daemon") -> None:
+        self.daemon = daemon
+        super().__init__(path, _ControlHandler)
+
+
+class _ControlHandler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        line = self.rfile.readline().decode("utf-8").strip()
+        try:
+            request = json.loads(line) if line.startswith("{") else {"command": line}
+            reply = self.server.daemon.handle(request)
+        except Exception as exc:
+            reply = {"ok": False, "error": str(exc)}
+        self.wfile.write((json.dumps(reply, default=str) + "\n").encode("utf-8"))
+
+
+class Daemon:
+    def __init__(self, cfg: AppConfig, snapshot: bool = False) -> None:
+        self.cfg = cfg
+        self.snapshot = snapshot
+        self.conn = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._requested: dict | None = None
+        self._server: _ControlServer | None = None
+        self._reference_day: str | None = None
+        self._retry_at: datetime | None = None
+        self.status = {
+            "pid": os.getpid(),
+            "started_at": datetime.now().isoformat(timespec="seconds"),
+            "state": "starting",
+            "last_session": None,
+            "last_run": None,
+            "last_error": None,
+            "next_trigger": None,
+            "runs": 0,
+        }
+
+    def handle(self, request: dict) -> dict:
+        command = request.get("command")
+        if command not in COMMANDS:
+            raise ValueError(f"unknown command {command!r}, expected one of {COMMANDS}")
+        if command == "run":
+            with self._lock:
+                self._requested = {"financials": bool(request.get("financials", False))}
+            self._wake.set()
+        elif command == "stop":
+            self.stop()
+        with self._lock:
+            return {"ok": True, **self.status}
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+
+    def _set(self, **fields) -> None:
+        with self._lock:
+            self.status.update(fields)
+
+    def _refresh_reference(self, today: str) -> None:
+        if self._reference_day == today:
+            return
+        stocks = fetch_main_board_stocks(self.cfg)
+        replace_table(self.conn, "stock_basic", stocks)
+        horizon = (date.today() + timedelta(days=366)).strftime("%Y%m%d")
+        calendar = fetch_trade_calendar(self.cfg, self.cfg.default_start_date, horizon)
+        replace_table(self.conn, "trade_calendar", calendar)
+        set_last_date(self.conn, "trade_calendar", horizon)
+        self._reference_day = today
+
+    def _run(self, session: str, financials: bool) -> None:
+        started = datetime.now()
+        self._set(state="running")
+        logger.info("daemon: updating session %s (financials=%s)", session, financials)
+        try:
+            with metrics.timer("daemon_run"):
+                self._refresh_reference(started.strftime("%Y%m%d"))
+                counts = incremental_update(
+                    self.cfg,
+                    session,
+                    snapshot=self.snapshot,
+                    financials=financials,
+                    refresh_reference=False,
+                    conn=self.conn,
+                )
+        except Exception as exc:
+            logger.exception("daemon: update for %s failed", session)
+            metrics.inc("daemon_runs_total", outcome="error")
+            self._retry_at = datetime.now() + timedelta(seconds=self.cfg.daemon_retry)
+            self._set(state="idle", last_error=f"{session}: {exc}")
+            return
+        metrics.inc("daemon_runs_total", outcome="ok")
+        self._retry_at = None
+        with self._lock:
+            self.status["runs"] += 1
+            self.status.update(
+                state="idle",
+                last_session=max(session, self.status["last_session"] or ""),
+                last_error=None,
+                last_run={
+                    "session": session,
+                    "financials": financials,
+                    "started_at": started.isoformat(timespec="seconds"),
+                    "seconds": round((datetime.now() - started).total_seconds(), 1),
+                    "tasks": counts,
+                },
+            )
+
+    def _tick(self) -> float:
+        now = datetime.now()
+        try:
+            self._refresh_reference(now.strftime("%Y%m%d"))
+        except Exception as exc:
+            logger.warning("daemon: reference refresh failed: %s", exc)
+            self._set(last_error=f"reference: {exc}")
+        open_days = load_open_days(self.conn)
+        with self._lock:
+            requested, self._requested = self._requested, None
+            last_session = self.status["last_session"]
+        due = due_session(open_days, self.cfg.daemon_run_at, now)
+        retry_ok = self._retry_at is None or now >= self._retry_at
+        if requested is not None:
+            session = due or now.strftime("%Y%m%d")
+            self._run(session, requested["financials"] or in_report_window(session))
+        elif due and (not last_session or due > last_session) and retry_ok:
+            self._run(due, in_report_window(due))
+        now = datetime.now()
+        upcoming = next_trigger(load_open_days(self.conn), self.cfg.daemon_run_at, now)
+        self._set(next_trigger=upcoming.isoformat(timespec="minutes") if upcoming else None)
+        wait = self.cfg.daemon_poll
+        if upcoming is not None:
+            wait = min(wait, max(1.0, (upcoming - now).total_seconds()))
+        if self._retry_at is not None:
+            wait = min(wait, max(1.0, (self._retry_at - now).total_seconds()))
+        return wait
+
+    def _start_server(self) -> None:
+        path = self.cfg.daemon_socket
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if path.exists():
+            try:
+                send_command(self.cfg, "status")
+            except OSError:
+                path.unlink()
+            else:
+                raise RuntimeError(f"daemon already running on {path}")
+        self._server = _ControlServer(str(path), self)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def serve_forever(self) -> None:
+        _warm_imports(self.cfg)
+        self.cfg.ensure_dirs()
+        self.conn = init_sqlite(self.cfg.sqlite_path)
+        self._set(last_session=get_last_date(self.conn, "price_daily"), state="idle")
+        self._start_server()
+        signal.signal(signal.SIGTERM, lambda *_: self.stop())
+        logger.info("daemon: listening on %s", self.cfg.daemon_socket)
+        try:
+            while not self._stop.is_set():
+                wait = self._tick()
+                self._wake.wait(wait)
+                self._wake.clear()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._server.shutdown()
+            self._server.server_close()
+            self.cfg.daemon_socket.unlink(missing_ok=True)
+            self.conn.close()
+            logger.info("daemon: stopped")
+
+
+def send_command(cfg: AppConfig, command: str, **fields) -> dict:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(str(cfg.daemon_socket))
+        sock.sendall((json.dumps({"command": command, **fields}) + "\n").encode("utf-8"))
+        reply = sock.makefile("rb").readline()
+    return json.loads(reply.decode("utf-8"))
@@ -1,11 +1,21 @@
 from __future__ import annotations
 
 from datetime import datetime, timedelta
+from functools import partial
+import logging
+import threading
 import time
+from typing import Callable, Iterator
 
 import pandas as pd
 
+from . import metrics
+from .cache import RANGE_KWARGS, get_cache
 from .config import AppConfig
+from .router import SourceRouter
+from .schema import PRICE_SCHEMA, normalize_dates
+
+logger = logging.getLogger(__name__)
 
 
 def _normalize_date(value: str) -> str:
@@ -29,7 +39,12 @@ def _pick_col(df: pd.DataFrame, candidates: list[str]) -> str | None:
     return None
 
 
-def _akshare():
+def _akshare(source: str = "akshare"):
+    if source == "fake":
+        from . import fake_source
+
+        return fake_source
+
     import akshare as ak
 
     return ak
@@ -41,27 +56,106 @@ def _adata():
     return adata
 
 
-def _retry_call(func, cfg: AppConfig, *args, **kwargs):
+class TokenBucket:
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = rate
+        self.capacity = float(burst)
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.capacity, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            self._tokens -= 1.0
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+_limiters: dict[str, TokenBucket] = {}
+_limiters_lock = threading.Lock()
+
+
+def _endpoint_name(func) -> str:
+    return getattr(func, "__name__", str(func))
+
+
+def _source_name(func) -> str:
+    module = getattr(func, "__module__", None) or ""
+    return f"{module.split('.')[0]}:{_endpoint_name(func)}" if module else _endpoint_name(func)
+
+
+def _limiter(cfg: AppConfig, endpoint: str, source: str | None = None) -> TokenBucket:
+    with _limiters_lock:
+        bucket = _limiters.get(source or endpoint)
+        if bucket is None:
+            bucket = TokenBucket(cfg.rate_for(endpoint), cfg.request_burst)
+            _limiters[source or endpoint] = bucket
+        return bucket
+
+
+def _retry_call(func, cfg: AppConfig, *args, cache_scope: str | None = None, **kwargs):
+    endpoint = _endpoint_name(func)
+    cache = get_cache(cfg)
+    if cache is not None:
+        scoped = kwargs if cache_scope is None else {**kwargs, "_scope": cache_scope}
+        key, identity = cache.keys(_source_name(func), args, scoped)
+        if cfg.cache_mode == "replay":
+            metrics.inc("cache_requests_total", endpoint=endpoint, result="replay")
+            window = {k: v for k, v in kwargs.items() if k in RANGE_KWARGS}
+            return cache.replay(key, identity, window)
+        cached = cache.get(endpoint, key)
+        if cached is not None:
+            metrics.inc("cache_requests_total", endpoint=endpoint, result="hit")
+            return cached
+        metrics.inc("cache_requests_total", endpoint=endpoint, result="miss")
+    result = _call_upstream(func, cfg, endpoint, *args, **kwargs)
+    if cache is not None and isinstance(result, pd.DataFrame):
+        cache.put(endpoint, key, identity, result)
+    return result
+
+
+def _call_upstream(func, cfg: AppConfig, endpoint: str, *args, **kwargs):
     attempt = 0
     delay = cfg.retry_backoff
+    limiter = _limiter(cfg, endpoint, _source_name(func))
     while True:
+        waited = limiter.acquire()
+        if waited:
+            metrics.inc("rate_limit_wait_seconds_total", waited, endpoint=endpoint)
+        started = time.perf_counter()
         try:
-            return func(*args, **kwargs)
-        except Exception:
+            result = func(*args, **kwargs)
+        except Exception as exc:
+            elapsed = time.perf_counter() - started
+            metrics.observe(
+                "upstream_request_seconds", elapsed, endpoint=endpoint, outcome="error"
+            )
             attempt += 1
             if attempt >= cfg.max_retries:
+                metrics.inc("upstream_failures_total", endpoint=endpoint)
                 raise
+            logger.debug("%s failed (%s), retry %d in %.1fs", endpoint, exc, attempt, delay)
+            metrics.inc("upstream_retries_total", endpoint=endpoint)
+            metrics.inc("retry_sleep_seconds_total", delay, endpoint=endpoint)
             time.sleep(delay)
             delay *= 2
+            continue
+        elapsed = time.perf_counter() - started
+        metrics.observe("upstream_request_seconds", elapsed, endpoint=endpoint, outcome="ok")
+        return result
 
 
-def _sleep(cfg: AppConfig) -> None:
-    if cfg.request_sleep > 0:
-        time.sleep(cfg.request_sleep)
-
-
-def _ak_stock_list_main_board(cfg: AppConfig) -> pd.DataFrame:
-    ak = _akshare()
+def _ak_stock_list_main_board(cfg: AppConfig, source: str | None = None) -> pd.DataFrame:
+    ak = _akshare(source or cfg.data_source)
     try:
         sh = _retry_call(ak.stock_info_sh_name_code, cfg, indicator="主板A股")
     except TypeError:
@@ -127,9 +221,7 @@ def _adata_stock_list_main_board(cfg: AppConfig) -> pd.DataFrame:
 
 
 def fetch_main_board_stocks(cfg: AppConfig) -> pd.DataFrame:
-    if cfg.data_source == "adata":
-        return _adata_stock_list_main_board(cfg)
-    return _ak_stock_list_main_board(cfg)
+    return _router(cfg, "stock_list").call()
 
 
 def fetch_trade_calendar(cfg: AppConfig, start_date: str, end_date: str) -> pd.DataFrame:
@@ -141,12 +233,12 @@ def fetch_trade_calendar(cfg: AppConfig, start_date: str, end_date: str) -> pd.D
         date_col = _pick_col(df, ["trade_date", "交易日期", "日期"])
         df = df[[date_col]].copy()
         df.columns = ["cal_date"]
-        df["cal_date"] = df["cal_date"].apply(_normalize_date)
+        df["cal_date"] = normalize_dates(df["cal_date"])
         df = df[(df["cal_date"] >= start) & (df["cal_date"] <= end)]
         df["is_open"] = 1
         return df
 
-    ak = _akshare()
+    ak = _akshare(cfg.data_source)
     try:
         df = _retry_call(
             ak.tool_trade_date_hist_sina, cfg, start_date=start, end_date=end
@@ -156,13 +248,15 @@ def fetch_trade_calendar(cfg: AppConfig, start_date: str, end_date: str) -> pd.D
     date_col = _pick_col(df, ["trade_date", "交易日期", "日期"])
     df = df[[date_col]].copy()
     df.columns = ["cal_date"]
-    df["cal_date"] = df["cal_date"].apply(_normalize_date)
+    df["cal_date"] = normalize_dates(df["cal_date"])
     df = df[(df["cal_date"] >= start) & (df["cal_date"] <= end)]
     df["is_open"] = 1
     return df
 
 
-def _normalize_price_df(df: pd.DataFrame, ts_code: str, adjust: str) -> pd.DataFrame:
+def _normalize_price_df(
+    df: pd.DataFrame, ts_code: str | pd.Series, adjust: str
+) -> pd.DataFrame:
     mapping = {
         "日期": "trade_date",
         "开盘": "open",
@@ -171,21 +265,40 @@ def _normalize_price_df(df: pd.DataFrame, ts_code: str, adjust: str) -> pd.DataF
         "最低": "low",
         "成交量": "volume",
         "成交额": "amount",
+        "振幅": "amplitude",
+        "涨跌幅": "pct_chg",
+        "涨跌额": "change",
+        "换手率": "turnover",
         "date": "trade_date",
+        "最新价": "close",
+        "今开": "open",
+        "昨收": "pre_close",
     }
-    renamed = {c: mapping[c] for c in df.columns if c in mapping}
-    data = df.rename(columns=renamed).copy()
-    if "trade_date" in data.columns:
-        data["trade_date"] = data["trade_date"].apply(_normalize_date)
-    data["ts_code"] = ts_code
-    data["adjust"] = adjust
-    return data
+    with metrics.timer("normalize", dataset="price_daily"):
+        renamed = {c: mapping[c] for c in df.columns if c in mapping}
+        data = df.rename(columns=renamed).copy()
+        if "trade_date" in data.columns:
+            data["trade_date"] = normalize_dates(data["trade_date"])
+        data["ts_code"] = ts_code
+        data["adjust"] = adjust
+    return _price_columns(data)
+
+
+def _price_columns(data: pd.DataFrame) -> pd.DataFrame:
+    if "pre_close" not in data.columns and {"close", "change"} <= set(data.columns):
+        close = pd.to_numeric(data["close"], errors="coerce")
+        data["pre_close"] = close - pd.to_numeric(data["change"], errors="coerce")
+    return data.reindex(columns=PRICE_SCHEMA.names)
 
 
 def _ak_price_data(
-    cfg: AppConfig, codes: list[str], start_date: str, end_date: str
+    cfg: AppConfig,
+    codes: list[str],
+    start_date: str,
+    end_date: str,
+    source: str | None = None,
 ) -> pd.DataFrame:
-    ak = _akshare()
+    ak = _akshare(source or cfg.price_source)
     frames: list[pd.DataFrame] = []
     for code in codes:
         raw = _retry_call(
@@ -197,21 +310,8 @@ def _ak_price_data(
             end_date=end_date,
             adjust="",
         )
-        _sleep(cfg)
         if not raw.empty:
             frames.append(_normalize_price_df(raw, _code_to_ts(code), "none"))
-        qfq = _retry_call(
-            ak.stock_zh_a_hist,
-            cfg,
-            symbol=code,
-            period="daily",
-            start_date=start_date,
-            end_date=end_date,
-            adjust="qfq",
-        )
-        _sleep(cfg)
-        if not qfq.empty:
-            frames.append(_normalize_price_df(qfq, _code_to_ts(code), "qfq"))
     return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
 
 
@@ -229,20 +329,102 @@ def _adata_price_data(
             stock_code=code,
             k_type=1,
             start_date=start,
+            adjust_type=0,
         )
-        _sleep(cfg)
         if df is None or df.empty:
             continue
-        df = df.copy()
-        if "trade_date" in df.columns:
-            df["trade_date"] = df["trade_date"].apply(_normalize_date)
-            df = df[df["trade_date"] <= end]
-        df["ts_code"] = _code_to_ts(code)
-        df["adjust"] = "none"
-        frames.append(df)
+        frames.append(_normalize_adata_price_df(df, _code_to_ts(code), "none", end))
     return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
 
 
+def _normalize_adata_price_df(
+    df: pd.DataFrame, ts_code: str | pd.Series, adjust: str, end: str
+) -> pd.DataFrame:
+    with metrics.timer("normalize", dataset="price_daily"):
+        data = df.rename(columns={"change_pct": "pct_chg", "turnover_ratio": "turnover"})
+        if "trade_date" in data.columns:
+            data["trade_date"] = normalize_dates(data["trade_date"])
+            data = data[data["trade_date"] <= end].copy()
+        if "volume" in data.columns:
+            data["volume"] = pd.to_numeric(data["volume"], errors="coerce") / 100
+        if "amplitude" not in data.columns and "pre_close" in data.columns:
+            high = pd.to_numeric(data["high"], errors="coerce")
+            low = pd.to_numeric(data["low"], errors="coerce")
+            pre_close = pd.to_numeric(data["pre_close"], errors="coerce")
+            data["amplitude"] = (high - low) / pre_close * 100
+        data["ts_code"] = ts_code
+        data["adjust"] = adjust
+    return _price_columns(data)
+
+
+def _complete_bars(data: pd.DataFrame) -> pd.DataFrame:
+    prices = data[["open", "high", "low", "close"]].apply(pd.to_numeric, errors="coerce")
+    volume = pd.to_numeric(data["volume"], errors="coerce")
+    return data[prices.gt(0).all(axis=1) & volume.gt(0)].reset_index(drop=True)
+
+
+def _ak_price_snapshot(
+    cfg: AppConfig, trade_date: str, source: str | None = None
+) -> pd.DataFrame:
+    ak = _akshare(source or cfg.price_source)
+    raw = _retry_call(ak.stock_zh_a_spot_em, cfg, cache_scope=trade_date)
+    if raw is None or raw.empty:
+        return pd.DataFrame()
+    data = raw.copy()
+    data["日期"] = trade_date
+    ts_codes = data["代码"].astype(str).str.zfill(6).map(_code_to_ts)
+    return _complete_bars(_normalize_price_df(data, ts_codes, "none"))
+
+
+def _adata_price_snapshot(cfg: AppConfig, trade_date: str) -> pd.DataFrame:
+    adata = _adata()
+    raw = _retry_call(
+        adata.stock.market.list_market_current, cfg, cache_scope=trade_date
+    )
+    if raw is None or raw.empty:
+        return pd.DataFrame()
+    data = raw.rename(columns={"price": "close"})
+    data["trade_date"] = trade_date
+    ts_codes = data["stock_code"].astype(str).str.zfill(6).map(_code_to_ts)
+    return _complete_bars(_normalize_adata_price_df(data, ts_codes, "none", trade_date))
+
+
+PRICE_BACKENDS = {
+    "akshare": partial(_ak_price_data, source="akshare"),
+    "adata": _adata_price_data,
+    "fake": partial(_ak_price_data, source="fake"),
+}
+STOCK_LIST_BACKENDS = {
+    "akshare": partial(_ak_stock_list_main_board, source="akshare"),
+    "adata": _adata_stock_list_main_board,
+    "fake": partial(_ak_stock_list_main_board, source="fake"),
+}
+SNAPSHOT_BACKENDS = {
+    "akshare": partial(_ak_price_snapshot, source="akshare"),
+    "adata": _adata_price_snapshot,
+    "fake": partial(_ak_price_snapshot, source="fake"),
+}
+
+_routers: dict[tuple[str, tuple[str, ...]], SourceRouter] = {}
+_routers_lock = threading.Lock()
+
+
+def _router(cfg: AppConfig, kind: str) -> SourceRouter:
+    if kind == "price":
+        backends, order = PRICE_BACKENDS, cfg.price_sources
+    elif kind == "snapshot":
+        backends, order = SNAPSHOT_BACKENDS, cfg.price_sources
+    else:
+        backends, order = STOCK_LIST_BACKENDS, cfg.data_sources
+    key = (kind, tuple(order))
+    with _routers_lock:
+        router = _routers.get(key)
+        if router is None:
+            router = SourceRouter(cfg, kind, backends, order)
+            _routers[key] = router
+        return router
+
+
 def _code_to_ts(code: str) -> str:
     code = str(code).zfill(6)
     if code.startswith(("600", "601", "603", "605")):
@@ -250,46 +432,91 @@ def _code_to_ts(code: str) -> str:
     return f"{code}.SZ"
 
 
+def _symbols(stocks: pd.DataFrame) -> list[str]:
+    return stocks["symbol"].astype(str).str.zfill(6).tolist()
+
+
+def _iter_chunks(
+    cfg: AppConfig,
+    fetcher: Callable[[AppConfig, str, str, str], pd.DataFrame],
+    stocks: pd.DataFrame,
+    start_date: str,
+    end_date: str,
+    chunk_rows: int | None = None,
+) -> Iterator[pd.DataFrame]:
+    limit = chunk_rows or cfg.stream_chunk_rows
+    frames: list[pd.DataFrame] = []
+    rows = 0
+    for code in _symbols(stocks):
+        df = fetcher(cfg, code, start_date, end_date)
+        if df is None or df.empty:
+            continue
+        frames.append(df)
+        rows += len(df)
+        if rows >= limit:
+            yield pd.concat(frames, ignore_index=True)
+            frames = []
+            rows = 0
+    if frames:
+        yield pd.concat(frames, ignore_index=True)
+
+
+def _collect(chunks: Iterator[pd.DataFrame]) -> pd.DataFrame:
+    frames = list(chunks)
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+
+def iter_price_data(
+    cfg: AppConfig,
+    stocks: pd.DataFrame,
+    start_date: str,
+    end_date: str,
+    chunk_rows: int | None = None,
+) -> Iterator[pd.DataFrame]:
+    return _iter_chunks(
+        cfg, fetch_price_data_for_code, stocks, start_date, end_date, chunk_rows
+    )
+
+
 def fetch_price_data(
     cfg: AppConfig, stocks: pd.DataFrame, start_date: str, end_date: str
 ) -> pd.DataFrame:
-    codes = stocks["symbol"].astype(str).str.zfill(6).tolist()
-    if cfg.price_source == "adata":
-        return _adata_price_data(cfg, codes, start_date, end_date)
-    return _ak_price_data(cfg, codes, start_date, end_date)
+    return _collect(iter_price_data(cfg, stocks, start_date, end_date))
 
 
 def fetch_price_data_for_code(
     cfg: AppConfig, code: str, start_date: str, end_date: str
 ) -> pd.DataFrame:
-    if cfg.price_source == "adata":
-        return _adata_price_data(cfg, [code], start_date, end_date)
-    return _ak_price_data(cfg, [code], start_date, end_date)
+    return _router(cfg, "price").call([code], start_date, end_date)
+
+
+def fetch_price_snapshot(cfg: AppConfig, trade_date: str) -> pd.DataFrame:
+    return _router(cfg, "snapshot").call(_normalize_date(trade_date))
 
 
 def _ak_financial_report(cfg: AppConfig, code: str, report_type: str) -> pd.DataFrame:
-    ak = _akshare()
+    ak = _akshare(cfg.data_source)
     df = _retry_call(
         ak.stock_financial_report_sina, cfg, stock=code, symbol=report_type
     )
-    _sleep(cfg)
-    date_col = _pick_col(df, ["报表日期", "截止日期", "报告期"])
-    if date_col:
-        df = df.rename(columns={date_col: "end_date"})
-        df["end_date"] = df["end_date"].apply(_normalize_date)
-    df["ts_code"] = _code_to_ts(code)
+    with metrics.timer("normalize", dataset="financial"):
+        date_col = _pick_col(df, ["报表日期", "截止日期", "报告期"])
+        if date_col:
+            df = df.rename(columns={date_col: "end_date"})
+            df["end_date"] = normalize_dates(df["end_date"])
+        df["ts_code"] = _code_to_ts(code)
     return df
 
 
 def _ak_financial_indicator(cfg: AppConfig, code: str) -> pd.DataFrame:
-    ak = _akshare()
+    ak = _akshare(cfg.data_source)
     df = _retry_call(ak.stock_financial_analysis_indicator, cfg, stock=code)
-    _sleep(cfg)
-    date_col = _pick_col(df, ["报表日期", "截止日期", "报告期"])
-    if date_col:
-        df = df.rename(columns={date_col: "end_date"})
-        df["end_date"] = df["end_date"].apply(_normalize_date)
-    df["ts_code"] = _code_to_ts(code)
+    with metrics.timer("normalize", dataset="financial"):
+        date_col = _pick_col(df, ["报表日期", "截止日期", "报告期", "日期"])
+        if date_col:
+            df = df.rename(columns={date_col: "end_date"})
+            df["end_date"] = normalize_dates(df["end_date"])
+        df["ts_code"] = _code_to_ts(code)
     return df
 
 
@@ -299,18 +526,26 @@ def _filter_by_end_date(df: pd.DataFrame, start_date: str, end_date: str) -> pd.
     start = _normalize_date(start_date)
     end = _normalize_date(end_date)
     data = df.copy()
-    data["end_date"] = data["end_date"].apply(_normalize_date)
+    data["end_date"] = normalize_dates(data["end_date"])
     return data[(data["end_date"] >= start) & (data["end_date"] <= end)]
 
 
+def iter_balance_sheet(
+    cfg: AppConfig,
+    stocks: pd.DataFrame,
+    start_date: str,
+    end_date: str,
+    chunk_rows: int | None = None,
+) -> Iterator[pd.DataFrame]:
+    return _iter_chunks(
+        cfg, fetch_balance_sheet_for_code, stocks, start_date, end_date, chunk_rows
+    )
+
+
 def fetch_balance_sheet(
     cfg: AppConfig, stocks: pd.DataFrame, start_date: str, end_date: str
 ) -> pd.DataFrame:
-    frames: list[pd.DataFrame] = []
-    for code in stocks["symbol"].astype(str).str.zfill(6).tolist():
-        df = _ak_financial_report(cfg, code, "资产负债表")
-        frames.append(_filter_by_end_date(df, start_date, end_date))
-    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    return _collect(iter_balance_sheet(cfg, stocks, start_date, end_date))
 
 
 def fetch_balance_sheet_for_code(
@@ -320,14 +555,22 @@ def fetch_balance_sheet_for_code(
     return _filter_by_end_date(df, start_date, end_date)
 
 
+def iter_income_statement(
+    cfg: AppConfig,
+    stocks: pd.DataFrame,
+    start_date: str,
+    end_date: str,
+    chunk_rows: int | None = None,
+) -> Iterator[pd.DataFrame]:
+    return _iter_chunks(
+        cfg, fetch_income_statement_for_code, stocks, start_date, end_date, chunk_rows
+    )
+
+
 def fetch_income_statement(
     cfg: AppConfig, stocks: pd.DataFrame, start_date: str, end_date: str
 ) -> pd.DataFrame:
-    frames: list[pd.DataFrame] = []
-    for code in stocks["symbol"].astype(str).str.zfill(6).tolist():
-        df = _ak_financial_report(cfg, code, "利润表")
-        frames.append(_filter_by_end_date(df, start_date, end_date))
-    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    return _collect(iter_income_statement(cfg, stocks, start_date, end_date))
 
 
 def fetch_income_statement_for_code(
@@ -337,14 +580,22 @@ def fetch_income_statement_for_code(
     return _filter_by_end_date(df, start_date, end_date)
 
 
+def iter_cashflow_statement(
+    cfg: AppConfig,
+    stocks: pd.DataFrame,
+    start_date: str,
+    end_date: str,
+    chunk_rows: int | None = None,
+) -> Iterator[pd.DataFrame]:
+    return _iter_chunks(
+        cfg, fetch_cashflow_statement_for_code, stocks, start_date, end_date, chunk_rows
+    )
+
+
 def fetch_cashflow_statement(
     cfg: AppConfig, stocks: pd.DataFrame, start_date: str, end_date: str
 ) -> pd.DataFrame:
-    frames: list[pd.DataFrame] = []
-    for code in stocks["symbol"].astype(str).str.zfill(6).tolist():
-        df = _ak_financial_report(cfg, code, "现金流量表")
-        frames.append(_filter_by_end_date(df, start_date, end_date))
-    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    return _collect(iter_cashflow_statement(cfg, stocks, start_date, end_date))
 
 
 def fetch_cashflow_statement_for_code(
@@ -354,14 +605,22 @@ def fetch_cashflow_statement_for_code(
     return _filter_by_end_date(df, start_date, end_date)
 
 
+def iter_financial_indicator(
+    cfg: AppConfig,
+    stocks: pd.DataFrame,
+    start_date: str,
+    end_date: str,
+    chunk_rows: int | None = None,
+) -> Iterator[pd.DataFrame]:
+    return _iter_chunks(
+        cfg, fetch_financial_indicator_for_code, stocks, start_date, end_date, chunk_rows
+    )
+
+
 def fetch_financial_indicator(
     cfg: AppConfig, stocks: pd.DataFrame, start_date: str, end_date: str
 ) -> pd.DataFrame:
-    frames: list[pd.DataFrame] = []
-    for code in stocks["symbol"].astype(str).str.zfill(6).tolist():
-        df = _ak_financial_indicator(cfg, code)
-        frames.append(_filter_by_end_date(df, start_date, end_date))
-    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    return _collect(iter_financial_indicator(cfg, stocks, start_date, end_date))
 
 
 def fetch_financial_indicator_for_code(
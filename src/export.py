@@ -0,0 +1,74 @@
+from __future__ import annotations
+
+import json
+import logging
+from pathlib import Path
+
+import pandas as pd
+
+from . import metrics
+from .config import AppConfig
+from .data_source import (
+    fetch_main_board_stocks,
+    iter_balance_sheet,
+    iter_cashflow_statement,
+    iter_financial_indicator,
+    iter_income_statement,
+    iter_price_data,
+)
+from .financials import to_long
+from .schema import FINANCIAL_DATASETS, FINANCIAL_KEYS, SCHEMAS
+from .shard import filter_shard
+from .storage import ParquetStreamWriter, get_items, init_sqlite, read_table, register_items
+
+logger = logging.getLogger(__name__)
+
+EXPORTS = {
+    "price_daily": iter_price_data,
+    "balance_sheet": iter_balance_sheet,
+    "income_statement": iter_income_statement,
+    "cashflow_statement": iter_cashflow_statement,
+    "fina_indicator": iter_financial_indicator,
+}
+
+
+def _stocks(cfg: AppConfig, conn) -> pd.DataFrame:
+    try:
+        stocks = read_table(conn, "stock_basic")
+    except Exception:
+        stocks = pd.DataFrame()
+    if stocks.empty:
+        stocks = fetch_main_board_stocks(cfg)
+    return filter_shard(cfg, stocks)
+
+
+def export_dataset(
+    cfg: AppConfig, dataset: str, output: Path, start_date: str, end_date: str
+) -> int:
+    if dataset not in EXPORTS:
+        raise ValueError(f"cannot export {dataset!r}, expected one of {tuple(EXPORTS)}")
+    cfg.data_dir.mkdir(parents=True, exist_ok=True)
+    conn = init_sqlite(cfg.sqlite_path)
+    writer = ParquetStreamWriter(output, dataset, SCHEMAS[dataset])
+    financial = dataset in FINANCIAL_DATASETS
+    try:
+        stocks = _stocks(cfg, conn)
+        logger.info("%s: exporting %d codes to %s", dataset, len(stocks), output)
+        with metrics.timer("export", dataset=dataset):
+            for chunk in EXPORTS[dataset](cfg, stocks, start_date, end_date):
+                if financial:
+                    names = [c for c in chunk.columns if c not in FINANCIAL_KEYS]
+                    chunk = to_long(chunk, register_items(conn, dataset, names))
+                writer.write(chunk)
+            metadata = None
+            if financial:
+                items = get_items(conn, dataset)
+                metadata = {"items": json.dumps(items, ensure_ascii=False)}
+            rows = writer.close(metadata)
+    except BaseException:
+        writer.abort()
+        raise
+    finally:
+        conn.close()
+    logger.info("%s: exported %d rows to %s", dataset, rows, output)
+    return rows
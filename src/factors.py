@@ -0,0 +1,267 @@
+from __future__ import annotations
+
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+import logging
+import shutil
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+
+from . import metrics
+from .config import AppConfig
+from .planner import load_open_days
+from .reader import load_prices
+from .schema import FACTOR_KEYS
+from .storage import (
+    BufferedDatasetWriter,
+    clear_watermarks,
+    compact_partitions,
+    get_last_date,
+    get_watermarks,
+    init_sqlite,
+    read_table,
+    set_last_date,
+    set_watermarks,
+)
+
+logger = logging.getLogger(__name__)
+
+FACTOR_DATASET = "factor_daily"
+PRICE_COLUMNS = ["ts_code", "trade_date", "close", "volume", "amount", "turnover"]
+LOOKBACK_MULTIPLIER = 2
+
+
+@dataclass(frozen=True)
+class Factor:
+    name: str
+    window: int
+    func: Callable[[pd.DataFrame, object], pd.Series]
+
+
+FACTORS: dict[str, Factor] = {}
+
+
+def factor(name: str, window: int):
+    def decorator(func):
+        FACTORS[name] = Factor(name, window, func)
+        return func
+
+    return decorator
+
+
+def max_window() -> int:
+    return max((f.window for f in FACTORS.values()), default=1)
+
+
+def _rolling(groups, col: str, window: int):
+    return groups[col].rolling(window, min_periods=window)
+
+
+def _returns(data: pd.DataFrame, groups, periods: int) -> pd.Series:
+    return data["close"] / groups["close"].shift(periods) - 1
+
+
+for _n in (1, 5, 20, 60):
+
+    @factor(f"ret_{_n}d", _n + 1)
+    def _ret(data, groups, _n=_n):
+        return _returns(data, groups, _n)
+
+
+for _n in (5, 10, 20, 60):
+
+    @factor(f"ma_{_n}", _n)
+    def _ma(data, groups, _n=_n):
+        return _rolling(groups, "close", _n).mean().droplevel(0)
+
+
+@factor("vol_20", 21)
+def _vol_20(data, groups):
+    returns = _returns(data, groups, 1)
+    daily = returns.groupby(data["ts_code"], sort=False).rolling(20, min_periods=20).std()
+    return daily.droplevel(0) * np.sqrt(252)
+
+
+@factor("turnover_20", 20)
+def _turnover_20(data, groups):
+    return _rolling(groups, "turnover", 20).mean().droplevel(0)
+
+
+@factor("amount_20", 20)
+def _amount_20(data, groups):
+    return _rolling(groups, "amount", 20).mean().droplevel(0)
+
+
+@factor("volume_ratio_5", 6)
+def _volume_ratio_5(data, groups):
+    previous = groups["volume"].shift(1)
+    mean = previous.groupby(data["ts_code"], sort=False).rolling(5, min_periods=5).mean()
+    return data["volume"] / mean.droplevel(0)
+
+
+def compute_factors(prices: pd.DataFrame, since: dict[str, str | None]) -> pd.DataFrame:
+    columns = [*FACTOR_KEYS, *FACTORS]
+    if prices.empty:
+        return pd.DataFrame(columns=columns)
+    data = prices.assign(ts_code=prices["ts_code"].astype(str))
+    data = data.sort_values(FACTOR_KEYS, ignore_index=True)
+    for col in ("close", "volume", "amount", "turnover"):
+        data[col] = pd.to_numeric(data[col], errors="coerce").astype("float64")
+    groups = data.groupby("ts_code", sort=False)
+    out = data[FACTOR_KEYS].copy()
+    for name, item in FACTORS.items():
+        out[name] = item.func(data, groups).astype("float32")
+    cutoff = pd.to_datetime(out["ts_code"].map(since), format="%Y%m%d")
+    return out[cutoff.isna() | (out["trade_date"] > cutoff)].reset_index(drop=True)
+
+
+def _load_chunk(cfg: AppConfig, codes: list[str], start: str | None) -> pd.DataFrame:
+    prices = load_prices(cfg, codes=codes, start=start, adjust="hfq", columns=PRICE_COLUMNS)
+    if prices.empty:
+        prices = load_prices(cfg, codes=codes, start=start, columns=PRICE_COLUMNS)
+    return prices
+
+
+def _short_history(prices: pd.DataFrame, since: dict[str, str | None]) -> list[str]:
+    codes = prices["ts_code"].astype(str)
+    cutoff = pd.to_datetime(codes.map(since), format="%Y%m%d")
+    before = prices["trade_date"] <= cutoff
+    counts = before.groupby(codes).sum()
+    counts = counts.reindex(list(since), fill_value=0)
+    return sorted(counts.index[counts < max_window()])
+
+
+def _compute_chunk(
+    cfg: AppConfig, codes: list[str], start: str | None, since: dict[str, str | None]
+) -> pd.DataFrame:
+    prices = _load_chunk(cfg, codes, start)
+    if start is not None:
+        short = _short_history(prices, since)
+        if short:
+            kept = prices[~prices["ts_code"].astype(str).isin(short)]
+            prices = pd.concat([kept, _load_chunk(cfg, short, None)], ignore_index=True)
+    return compute_factors(prices, since)
+
+
+def _lookback_start(open_days: list[str], since: str) -> str | None:
+    idx = bisect_left(open_days, since) - max_window() * LOOKBACK_MULTIPLIER
+    return open_days[idx] if idx > 0 else None
+
+
+def _price_marks(conn) -> dict[str, str]:
+    marks = get_watermarks(conn, "price_daily")
+    found = {
+        str(row.ts_code): str(row.last_date)
+        for row in marks.itertuples(index=False)
+        if row.last_date
+    }
+    if found:
+        return found
+    last = get_last_date(conn, "price_daily")
+    if not last:
+        return {}
+    try:
+        stocks = read_table(conn, "stock_basic")
+    except Exception:
+        return {}
+    return {str(code): last for code in stocks["ts_code"]}
+
+
+def _jobs(
+    pending: list[tuple[str, str | None]], open_days: list[str], chunk: int
+) -> list[tuple[list[str], str | None, dict[str, str | None]]]:
+    pending = sorted(pending, key=lambda item: (item[1] or "", item[0]))
+    jobs = []
+    for i in range(0, len(pending), chunk):
+        part = pending[i : i + chunk]
+        since = dict(part)
+        known = [last for _, last in part if last]
+        start = None
+        if len(known) == len(part):
+            start = _lookback_start(open_days, min(known))
+        jobs.append(([code for code, _ in part], start, since))
+    return jobs
+
+
+def reset_factors(cfg: AppConfig, conn) -> None:
+    shutil.rmtree(cfg.dataset_dir(FACTOR_DATASET), ignore_errors=True)
+    clear_watermarks(conn, FACTOR_DATASET)
+
+
+def update_factors(cfg: AppConfig, rebuild: bool = False) -> int:
+    target = cfg.dataset_dir(FACTOR_DATASET)
+    conn = init_sqlite(cfg.sqlite_path)
+    if rebuild:
+        reset_factors(cfg, conn)
+    target.mkdir(parents=True, exist_ok=True)
+    done = {
+        str(row.ts_code): str(row.last_date)
+        for row in get_watermarks(conn, FACTOR_DATASET).itertuples(index=False)
+        if row.last_date
+    }
+    prices = _price_marks(conn)
+    pending = [
+        (code, done.get(code))
+        for code, last in prices.items()
+        if code not in done or last > done[code]
+    ]
+    if not pending:
+        conn.close()
+        return 0
+    jobs = _jobs(pending, load_open_days(conn), cfg.factor_chunk_codes)
+    writer = BufferedDatasetWriter(
+        target,
+        "trade_date",
+        FACTOR_KEYS,
+        max_rows=cfg.write_buffer_rows,
+        max_bytes=cfg.write_buffer_bytes,
+        append_only=True,
+        dataset=FACTOR_DATASET,
+    )
+    watermarks: list[tuple[str, str | None, int, str]] = []
+    written = 0
+
+    def checkpoint() -> None:
+        writer.flush()
+        last = max((mark[1] for mark in watermarks), default=None)
+        with conn:
+            set_watermarks(conn, FACTOR_DATASET, watermarks, commit=False)
+            stored = get_last_date(conn, FACTOR_DATASET)
+            if last and (not stored or last > stored):
+                set_last_date(conn, FACTOR_DATASET, last, commit=False)
+        watermarks.clear()
+
+    logger.info("%s: %d codes in %d chunks", FACTOR_DATASET, len(pending), len(jobs))
+    with metrics.timer("factors"), ProcessPoolExecutor(cfg.factor_workers) as pool:
+        results = pool.map(
+            _compute_chunk,
+            [cfg] * len(jobs),
+            [codes for codes, _, _ in jobs],
+            [start for _, start, _ in jobs],
+            [since for _, _, since in jobs],
+        )
+        for (codes, _start, _since), frame in zip(jobs, results):
+            writer.add(frame)
+            written += len(frame)
+            metrics.inc("factor_rows_total", len(frame))
+            counts = frame["ts_code"].value_counts() if not frame.empty else {}
+            fetched_at = datetime.now().isoformat(timespec="seconds")
+            watermarks.extend(
+                (code, prices[code], int(counts.get(code, 0)), fetched_at)
+                for code in codes
+            )
+            if writer.should_flush():
+                checkpoint()
+        checkpoint()
+    conn.close()
+    return written
+
+
+def compact_factors(cfg: AppConfig) -> dict[str, int]:
+    return compact_partitions(
+        cfg.dataset_dir(FACTOR_DATASET), "trade_date", FACTOR_KEYS, FACTOR_DATASET
+    )
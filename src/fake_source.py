@@ -0,0 +1,201 @@
+from __future__ import annotations
+
+from functools import lru_cache
+import os
+import random
+import time
+import zlib
+
+import numpy as np
+import pandas as pd
+
+_BALANCE_ITEMS = ["货币资金", "应收账款", "存货", "固定资产", "资产总计", "负债合计", "所有者权益合计"]
+_INCOME_ITEMS = ["营业总收入", "营业成本", "营业利润", "利润总额", "净利润", "基本每股收益"]
+_CASHFLOW_ITEMS = ["经营活动产生的现金流量净额", "投资活动产生的现金流量净额", "筹资活动产生的现金流量净额"]
+_INDICATOR_ITEMS = ["摊薄每股收益(元)", "净资产收益率(%)", "总资产利润率(%)", "资产负债率(%)", "流动比率"]
+_REPORT_ITEMS = {
+    "资产负债表": _BALANCE_ITEMS,
+    "利润表": _INCOME_ITEMS,
+    "现金流量表": _CASHFLOW_ITEMS,
+}
+
+
+class FakeUpstreamError(RuntimeError):
+    pass
+
+
+def _settings() -> tuple[int, float, float, int]:
+    return (
+        int(os.getenv("FAKE_CODES", "100")),
+        float(os.getenv("FAKE_LATENCY", "0")),
+        float(os.getenv("FAKE_ERROR_RATE", "0")),
+        int(os.getenv("FAKE_SEED", "7")),
+    )
+
+
+def _upstream() -> None:
+    _, latency, error_rate, _ = _settings()
+    if latency > 0:
+        time.sleep(random.expovariate(1.0 / latency))
+    if error_rate > 0 and random.random() < error_rate:
+        raise FakeUpstreamError("injected upstream failure")
+
+
+def _rng(*parts: object) -> np.random.Generator:
+    seed = _settings()[3]
+    key = "|".join(str(p) for p in parts)
+    return np.random.default_rng([seed, zlib.crc32(key.encode("utf-8"))])
+
+
+def _universe() -> tuple[list[str], list[str]]:
+    count = _settings()[0]
+    sh_count = count // 2
+    sh = [f"{600000 + i:06d}" for i in range(sh_count)]
+    sz = [f"{1 + i:06d}" for i in range(count - sh_count)]
+    return sh, sz
+
+
+@lru_cache(maxsize=8)
+def _trade_days(start: str = "20000101", end: str = "20301231") -> pd.DatetimeIndex:
+    days = pd.bdate_range(pd.Timestamp(start), pd.Timestamp(end))
+    holidays = (days.month == 10) & (days.day <= 7) | (days.month == 1) & (days.day == 1)
+    return days[~holidays]
+
+
+def stock_info_sh_name_code(indicator: str = "主板A股") -> pd.DataFrame:
+    _upstream()
+    sh, _ = _universe()
+    return pd.DataFrame(
+        {
+            "证券代码": sh,
+            "证券简称": [f"沪测{code[-4:]}" for code in sh],
+            "上市日期": "2000-01-04",
+        }
+    )
+
+
+def stock_info_sz_name_code(indicator: str = "A股列表") -> pd.DataFrame:
+    _upstream()
+    _, sz = _universe()
+    return pd.DataFrame(
+        {
+            "板块": "主板",
+            "A股代码": sz,
+            "A股简称": [f"深测{code[-4:]}" for code in sz],
+            "A股上市日期": "2000-01-04",
+        }
+    )
+
+
+def tool_trade_date_hist_sina() -> pd.DataFrame:
+    _upstream()
+    return pd.DataFrame({"trade_date": _trade_days().date})
+
+
+def _bars(symbol: str) -> pd.DataFrame:
+    days = _trade_days("20150101", "20301231")
+    rng = _rng("bars", symbol)
+    returns = rng.normal(0.0003, 0.02, len(days)).clip(-0.1, 0.1)
+    close = np.round(10 * np.exp(np.cumsum(returns)), 2)
+    pre_close = np.concatenate([[close[0]], close[:-1]])
+    events = rng.random(len(days)) < 0.002
+    pre_close = np.where(events, np.round(pre_close * 0.95, 2), pre_close)
+    spread = np.abs(rng.normal(0, 0.01, len(days)))
+    open_ = np.round(pre_close * (1 + rng.normal(0, 0.005, len(days))), 2)
+    high = np.round(np.maximum(open_, close) * (1 + spread), 2)
+    low = np.round(np.minimum(open_, close) * (1 - spread), 2)
+    volume = rng.integers(10_000, 2_000_000, len(days))
+    return pd.DataFrame(
+        {
+            "日期": days.date,
+            "股票代码": symbol,
+            "开盘": open_,
+            "收盘": close,
+            "最高": high,
+            "最低": low,
+            "成交量": volume,
+            "成交额": np.round(volume * close * 100, 2),
+            "振幅": np.round((high - low) / pre_close * 100, 2),
+            "涨跌幅": np.round((close / pre_close - 1) * 100, 2),
+            "涨跌额": np.round(close - pre_close, 2),
+            "换手率": np.round(volume / 1e6, 2),
+        }
+    )
+
+
+def stock_zh_a_hist(
+    symbol: str,
+    period: str = "daily",
+    start_date: str = "19700101",
+    end_date: str = "20500101",
+    adjust: str = "",
+) -> pd.DataFrame:
+    _upstream()
+    bars = _bars(symbol)
+    dates = pd.to_datetime(bars["日期"])
+    bars = bars[(dates >= pd.Timestamp(start_date)) & (dates <= pd.Timestamp(end_date))]
+    if adjust == "qfq":
+        bars = bars.copy()
+        for col in ["开盘", "收盘", "最高", "最低"]:
+            bars[col] = np.round(bars[col] * 0.9, 2)
+    return bars.reset_index(drop=True)
+
+
+def stock_zh_a_spot_em() -> pd.DataFrame:
+    _upstream()
+    sh, sz = _universe()
+    today = pd.Timestamp.today().normalize()
+    rows = []
+    for symbol in [*sh, *sz]:
+        bars = _bars(symbol)
+        bar = bars[pd.to_datetime(bars["日期"]) <= today].iloc[-1]
+        rows.append(
+            {
+                "代码": symbol,
+                "名称": f"测{symbol[-4:]}",
+                "最新价": bar["收盘"],
+                "涨跌幅": bar["涨跌幅"],
+                "涨跌额": bar["涨跌额"],
+                "成交量": bar["成交量"],
+                "成交额": bar["成交额"],
+                "振幅": bar["振幅"],
+                "最高": bar["最高"],
+                "最低": bar["最低"],
+                "今开": bar["开盘"],
+                "昨收": round(bar["收盘"] - bar["涨跌额"], 2),
+                "换手率": bar["换手率"],
+            }
+        )
+    return pd.DataFrame(rows)
+
+
+def _periods(until: pd.Timestamp) -> list[pd.Timestamp]:
+    periods = pd.date_range("2015-03-31", until, freq="QE")
+    return [p for p in periods if p + pd.Timedelta(days=30) <= until]
+
+
+def _report(stock: str, items: list[str], kind: str, date_col: str) -> pd.DataFrame:
+    periods = _periods(pd.Timestamp.today().normalize())
+    rng = _rng(kind, stock)
+    base = rng.uniform(1e7, 1e10, len(items))
+    rows = []
+    for i, period in enumerate(reversed(periods)):
+        scale = 1 + rng.normal(0, 0.05, len(items)) - i * 0.01
+        row = {date_col: period.strftime("%Y%m%d")}
+        row.update({item: f"{value:.2f}" for item, value in zip(items, base * scale)})
+        row["公告日期"] = (period + pd.Timedelta(days=25)).strftime("%Y-%m-%d")
+        row["币种"] = "CNY"
+        row["类型"] = "合并期末"
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def stock_financial_report_sina(stock: str, symbol: str) -> pd.DataFrame:
+    _upstream()
+    return _report(stock, _REPORT_ITEMS[symbol], symbol, "报表日期")
+
+
+def stock_financial_analysis_indicator(stock: str, start_year: str = "1900") -> pd.DataFrame:
+    _upstream()
+    df = _report(stock, _INDICATOR_ITEMS, "indicator", "日期")
+    return df.drop(columns=["公告日期", "币种", "类型"])
@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import nullcontext
+import queue
+import threading
+from typing import Callable, Iterator
+
+import pandas as pd
+
+from . import metrics
+from .config import AppConfig
+
+FetchFn = Callable[[AppConfig, str, str, str], pd.DataFrame]
+PrepareFn = Callable[[pd.DataFrame], pd.DataFrame]
+
+_DONE = object()
+_PUT_TIMEOUT = 0.5
+
+
+def _call(
+    fetcher: FetchFn,
+    cfg: AppConfig,
+    code: str,
+    start_date: str,
+    end_date: str,
+    prepare: PrepareFn | None = None,
+    cpu_pool: Executor | None = None,
+):
+    try:
+        df = fetcher(cfg, code, start_date, end_date)
+    except Exception as exc:
+        return None, exc
+    if prepare is None or df is None or df.empty:
+        return df, None
+    try:
+        if cpu_pool is not None:
+            return cpu_pool.submit(prepare, df).result(), None
+        return prepare(df), None
+    except Exception as exc:
+        return None, exc
+
+
+def _put(out: queue.Queue, item, stop: threading.Event) -> bool:
+    while not stop.is_set():
+        try:
+            out.put(item, timeout=_PUT_TIMEOUT)
+            return True
+        except queue.Full:
+            metrics.inc("pipeline_backpressure_total", stage="write")
+    return False
+
+
+def _produce(
+    cfg: AppConfig,
+    fetcher: FetchFn,
+    todo: Iterator[tuple[int, tuple[str, str]]],
+    end_date: str,
+    prepare: PrepareFn | None,
+    out: queue.Queue,
+    stop: threading.Event,
+) -> None:
+    use_processes = prepare is not None and cfg.normalize_workers > 0
+    cpu_context = (
+        ProcessPoolExecutor(max_workers=cfg.normalize_workers)
+        if use_processes
+        else nullcontext()
+    )
+    pending: deque[tuple[int, str, Future]] = deque()
+    try:
+        with ThreadPoolExecutor(max_workers=cfg.fetch_workers) as pool, cpu_context as cpu:
+            for idx, (code, start_date) in todo:
+                if stop.is_set():
+                    break
+                future = pool.submit(
+                    _call, fetcher, cfg, code, start_date, end_date, prepare, cpu
+                )
+                pending.append((idx, code, future))
+                while len(pending) >= cfg.fetch_queue and not stop.is_set():
+                    idx_done, code_done, done = pending.popleft()
+                    if not _put(out, (idx_done, code_done, *done.result()), stop):
+                        break
+            while pending and not stop.is_set():
+                idx_done, code_done, done = pending.popleft()
+                _put(out, (idx_done, code_done, *done.result()), stop)
+            for _, _, future in pending:
+                future.cancel()
+    except BaseException as exc:
+        _put(out, exc, stop)
+    finally:
+        _put(out, _DONE, stop)
+
+
+def iter_fetch(
+    cfg: AppConfig,
+    fetcher: FetchFn,
+    tasks: list[tuple[str, str]],
+    end_date: str,
+    start_index: int = 0,
+    prepare: PrepareFn | None = None,
+) -> Iterator[tuple[int, str, pd.DataFrame | None, Exception | None]]:
+    todo = enumerate(tasks[start_index:], start=start_index)
+    out: queue.Queue = queue.Queue(maxsize=cfg.write_queue)
+    stop = threading.Event()
+    producer = threading.Thread(
+        target=_produce,
+        args=(cfg, fetcher, todo, end_date, prepare, out, stop),
+        name="fetch-producer",
+        daemon=True,
+    )
+    producer.start()
+    try:
+        while True:
+            item = out.get()
+            if item is _DONE:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        producer.join()
@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+import logging
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from . import metrics
+from .config import AppConfig
+from .schema import FINANCIAL_ITEM_KEYS, FINANCIAL_KEYS, FINANCIAL_WIDE, conform
+from .storage import (
+    _write_atomic,
+    init_sqlite,
+    read_parquet_frame,
+    register_items,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def is_long_file(path: Path) -> bool:
+    return "item_id" in pq.read_schema(path).names
+
+
+def to_long(wide: pd.DataFrame, items: dict[str, int]) -> pd.DataFrame:
+    data = conform(wide, FINANCIAL_WIDE).dropna(subset=["end_date"])
+    frames = []
+    for col in data.columns:
+        if col in FINANCIAL_KEYS:
+            continue
+        values = data[col]
+        present = values.notna()
+        if not present.any():
+            continue
+        values = values[present]
+        numeric = pd.to_numeric(values, errors="coerce").astype("float64")
+        text = values.astype("string").where(numeric.isna())
+        frames.append(
+            pd.DataFrame(
+                {
+                    "ts_code": data["ts_code"][present].astype(str),
+                    "end_date": data["end_date"][present],
+                    "item_id": items[col],
+                    "value": numeric,
+                    "text": text,
+                }
+            )
+        )
+    if not frames:
+        return pd.DataFrame(columns=[*FINANCIAL_ITEM_KEYS, "value", "text"])
+    long = pd.concat(frames, ignore_index=True)
+    return long.sort_values(FINANCIAL_ITEM_KEYS, ignore_index=True)
+
+
+def pivot_wide(
+    long: pd.DataFrame, names: dict[int, str], items: list[str] | None = None
+) -> pd.DataFrame:
+    if long.empty:
+        frame = pd.DataFrame(columns=[*FINANCIAL_KEYS, *(items or [])])
+        frame["end_date"] = pd.to_datetime(frame["end_date"]).astype("datetime64[ms]")
+        return frame
+    keys = pd.MultiIndex.from_arrays([long["ts_code"].astype(str), long["end_date"]])
+    rows, uniques = keys.factorize()
+    cols, item_ids = pd.factorize(long["item_id"].to_numpy(), sort=True)
+    values = np.full((len(uniques), len(item_ids)), np.nan)
+    values[rows, cols] = long["value"].to_numpy("float64", na_value=np.nan)
+    wide = pd.DataFrame(
+        values, columns=[names.get(int(i), f"item_{int(i)}") for i in item_ids]
+    )
+    text = long["text"]
+    has_text = text.notna().to_numpy()
+    if has_text.any():
+        for col in np.unique(cols[has_text]):
+            mixed = wide.iloc[:, col].astype(object)
+            picked = has_text & (cols == col)
+            mixed.iloc[rows[picked]] = text.to_numpy(object)[picked]
+            if np.isnan(values[:, col]).all():
+                mixed = mixed.astype("string")
+            wide.isetitem(col, mixed)
+    wide.insert(0, "ts_code", pd.Categorical(uniques.get_level_values(0)))
+    wide.insert(1, "end_date", uniques.get_level_values(1))
+    wide = wide.sort_values(FINANCIAL_KEYS, ignore_index=True)
+    if items is not None:
+        wide = wide.reindex(columns=[*FINANCIAL_KEYS, *items])
+    return wide
+
+
+class LongFinancialWriter:
+    def __init__(self, conn, writer, dataset: str) -> None:
+        self.conn = conn
+        self.writer = writer
+        self.dataset = dataset
+        self.base_dir = writer.base_dir
+        self.date_col = writer.date_col
+
+    @property
+    def pending_rows(self) -> int:
+        return self.writer.pending_rows
+
+    def add(self, df: pd.DataFrame) -> None:
+        if df is None or df.empty or "end_date" not in df.columns:
+            return
+        names = [c for c in df.columns if c not in FINANCIAL_KEYS]
+        items = register_items(self.conn, self.dataset, names)
+        with metrics.timer("normalize", dataset=self.dataset):
+            long = to_long(df, items)
+        metrics.inc("financial_items_total", len(long), dataset=self.dataset)
+        self.writer.add(long)
+
+    def should_flush(self) -> bool:
+        return self.writer.should_flush()
+
+    def flush(self) -> int:
+        return self.writer.flush()
+
+    def close(self) -> int:
+        return self.flush()
+
+
+def migrate_wide_files(cfg: AppConfig, dataset: str, conn=None) -> int:
+    base_dir = cfg.dataset_dir(dataset)
+    migrated = 0
+    owned = conn is None
+    if owned:
+        conn = init_sqlite(cfg.sqlite_path)
+    try:
+        for path in sorted(base_dir.glob("[0-9][0-9][0-9][0-9].parquet")):
+            if is_long_file(path):
+                continue
+            wide = read_parquet_frame(path)
+            names = [c for c in wide.columns if c not in FINANCIAL_KEYS]
+            long = to_long(wide, register_items(conn, dataset, names))
+            before = path.stat().st_size
+            _write_atomic(long, path, dataset)
+            logger.info(
+                "%s: %s converted to long format, %d -> %d bytes",
+                dataset,
+                path.name,
+                before,
+                path.stat().st_size,
+            )
+            migrated += 1
+    finally:
+        if owned:
+            conn.close()
+    return migrated
@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+from pathlib import Path
+import sqlite3
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from . import metrics
+
+INDEX_NAME = "_index.db"
+LOOKUP_CHUNK = 500
+
+
+def index_root(path: Path) -> Path:
+    parent = path.parent
+    return parent.parent if parent.name.startswith("year=") else parent
+
+
+def _connect(root: Path) -> sqlite3.Connection:
+    conn = sqlite3.connect(root / INDEX_NAME, timeout=30)
+    conn.execute("pragma journal_mode=wal")
+    conn.execute("pragma synchronous=normal")
+    conn.execute(
+        "create table if not exists index_files ("
+        "file text primary key, mtime_ns integer not null, rows integer not null)"
+    )
+    conn.execute(
+        "create table if not exists index_locations ("
+        "file text not null, ts_code text not null, row_group_start integer not null, "
+        "row_group_end integer not null, row_start integer not null, "
+        "row_count integer not null, primary key(ts_code, file))"
+    )
+    return conn
+
+
+def _file_key(root: Path, path: Path) -> str:
+    return path.relative_to(root).as_posix()
+
+
+def index_file(path: Path, table: pa.Table) -> None:
+    if "ts_code" not in table.column_names:
+        return
+    meta = pq.read_metadata(path)
+    sizes = [meta.row_group(i).num_rows for i in range(meta.num_row_groups)]
+    offsets = np.cumsum([0, *sizes])
+    codes = table.column("ts_code").cast(pa.string()).to_numpy(zero_copy_only=False)
+    spans = (
+        pd.DataFrame({"code": codes, "pos": np.arange(len(codes))})
+        .groupby("code")["pos"]
+        .agg(["min", "max", "count"])
+    )
+    first = np.searchsorted(offsets, spans["min"].to_numpy(), side="right") - 1
+    last = np.searchsorted(offsets, spans["max"].to_numpy(), side="right") - 1
+    root = index_root(path)
+    key = _file_key(root, path)
+    rows = [
+        (key, code, int(a), int(b), int(lo), int(n))
+        for code, a, b, lo, n in zip(spans.index, first, last, spans["min"], spans["count"])
+    ]
+    conn = _connect(root)
+    try:
+        with conn:
+            conn.execute("delete from index_locations where file = ?", (key,))
+            conn.executemany(
+                "insert into index_locations(file, ts_code, row_group_start, "
+                "row_group_end, row_start, row_count) values(?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            conn.execute(
+                "insert or replace into index_files(file, mtime_ns, rows) values(?, ?, ?)",
+                (key, path.stat().st_mtime_ns, meta.num_rows),
+            )
+    finally:
+        conn.close()
+
+
+def drop_files(paths: Iterable[Path]) -> None:
+    by_root: dict[Path, list[str]] = {}
+    for path in paths:
+        root = index_root(path)
+        by_root.setdefault(root, []).append(_file_key(root, path))
+    for root, keys in by_root.items():
+        if not (root / INDEX_NAME).exists():
+            continue
+        conn = _connect(root)
+        try:
+            with conn:
+                conn.executemany(
+                    "delete from index_locations where file = ?", [(k,) for k in keys]
+                )
+                conn.executemany("delete from index_files where file = ?", [(k,) for k in keys])
+        finally:
+            conn.close()
+
+
+def lookup(files: list[Path], codes: list[str]) -> dict[Path, list[int] | None]:
+    found: dict[Path, list[int] | None] = {path: None for path in files}
+    by_root: dict[Path, dict[str, Path]] = {}
+    for path in files:
+        root = index_root(path)
+        by_root.setdefault(root, {})[_file_key(root, path)] = path
+    for root, keyed in by_root.items():
+        if not (root / INDEX_NAME).exists():
+            continue
+        conn = _connect(root)
+        try:
+            fresh = {}
+            for key, mtime_ns in conn.execute("select file, mtime_ns from index_files"):
+                path = keyed.get(key)
+                if path is not None and path.exists() and path.stat().st_mtime_ns == mtime_ns:
+                    fresh[key] = path
+            groups: dict[str, set[int]] = {key: set() for key in fresh}
+            for i in range(0, len(codes), LOOKUP_CHUNK):
+                chunk = codes[i : i + LOOKUP_CHUNK]
+                marks = ",".join("?" * len(chunk))
+                rows = conn.execute(
+                    "select file, row_group_start, row_group_end from index_locations "
+                    f"where ts_code in ({marks})",
+                    chunk,
+                )
+                for key, start, end in rows:
+                    if key in groups:
+                        groups[key].update(range(start, end + 1))
+        finally:
+            conn.close()
+        for key, path in fresh.items():
+            found[path] = sorted(groups[key])
+    hits = sum(1 for value in found.values() if value is not None)
+    metrics.inc("location_lookups_total", hits, result="indexed")
+    metrics.inc("location_lookups_total", len(found) - hits, result="unindexed")
+    return found
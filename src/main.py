@@ -1,9 +1,28 @@
 from __future__ import annotations
 
 import argparse
+import json
+import logging
+import os
+from pathlib import Path
 
 from .config import AppConfig
-from .pipeline import full_download, incremental_update, init_storage
+from .daemon import COMMANDS, Daemon, send_command
+from .export import EXPORTS, export_dataset
+from .factors import FACTORS, compact_factors, update_factors
+from .optimize import format_reports, optimize_all, optimize_dataset
+from .panel import build_panel
+from .pit import build_pit
+from .pipeline import (
+    compact_price,
+    full_download,
+    incremental_update,
+    init_storage,
+    rebuild_adj_factors,
+)
+from .schema import FINANCIAL_DATASETS
+from .server import COMMANDS as SERVE_COMMANDS, ArrowServer, send
+from .shard import merge_shards, parse_shard
 
 
 def build_parser() -> argparse.ArgumentParser:
@@ -16,19 +35,80 @@ def build_parser() -> argparse.ArgumentParser:
     full_cmd = sub.add_parser("full")
     full_cmd.add_argument("--start-date", default=None)
     full_cmd.add_argument("--end-date", default=None)
+    full_cmd.add_argument("--replay", action="store_true")
+    full_cmd.add_argument("--shard", type=parse_shard, default=None)
     full_cmd.set_defaults(func="full")
 
     update_cmd = sub.add_parser("update")
     update_cmd.add_argument("--end-date", default=None)
+    update_cmd.add_argument("--plan-only", action="store_true")
+    update_cmd.add_argument("--snapshot", action="store_true")
+    update_cmd.add_argument("--replay", action="store_true")
+    update_cmd.add_argument("--shard", type=parse_shard, default=None)
     update_cmd.set_defaults(func="update")
 
+    daemon_cmd = sub.add_parser("daemon")
+    daemon_cmd.add_argument("--snapshot", action="store_true")
+    daemon_cmd.add_argument("--send", choices=COMMANDS, default=None)
+    daemon_cmd.add_argument("--financials", action="store_true")
+    daemon_cmd.set_defaults(func="daemon")
+
+    serve_cmd = sub.add_parser("serve")
+    serve_cmd.add_argument("--send", choices=SERVE_COMMANDS, default=None)
+    serve_cmd.set_defaults(func="serve")
+
+    export_cmd = sub.add_parser("export")
+    export_cmd.add_argument("dataset", choices=EXPORTS)
+    export_cmd.add_argument("output", type=Path)
+    export_cmd.add_argument("--start-date", default=None)
+    export_cmd.add_argument("--end-date", default=None)
+    export_cmd.add_argument("--replay", action="store_true")
+    export_cmd.add_argument("--shard", type=parse_shard, default=None)
+    export_cmd.set_defaults(func="export")
+
+    compact_cmd = sub.add_parser("compact")
+    compact_cmd.set_defaults(func="compact")
+
+    optimize_cmd = sub.add_parser("optimize")
+    optimize_cmd.add_argument("--dataset", default=None)
+    optimize_cmd.set_defaults(func="optimize")
+
+    factors_cmd = sub.add_parser("adj-factors")
+    factors_cmd.set_defaults(func="adj-factors")
+
+    factor_cmd = sub.add_parser("factors")
+    factor_cmd.add_argument("--rebuild", action="store_true")
+    factor_cmd.add_argument("--list", action="store_true")
+    factor_cmd.set_defaults(func="factors")
+
+    merge_cmd = sub.add_parser("merge")
+    merge_cmd.add_argument("shard_dirs", nargs="*", type=Path)
+    merge_cmd.set_defaults(func="merge")
+
+    panel_cmd = sub.add_parser("build-panel")
+    panel_cmd.set_defaults(func="build-panel")
+
+    pit_cmd = sub.add_parser("pit")
+    pit_cmd.add_argument("--dataset", required=True, choices=FINANCIAL_DATASETS)
+    pit_cmd.add_argument("--fields", default=None)
+    pit_cmd.add_argument("--rebuild", action="store_true")
+    pit_cmd.set_defaults(func="pit")
+
     return parser
 
 
 def main() -> None:
     parser = build_parser()
     args = parser.parse_args()
+    logging.basicConfig(
+        level=os.getenv("LOG_LEVEL", "INFO").upper(),
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+    )
     cfg = AppConfig()
+    if getattr(args, "replay", False):
+        cfg.cache_mode = "replay"
+    if getattr(args, "shard", None):
+        cfg.use_shard(*args.shard)
 
     if args.command == "init":
         init_storage(cfg)
@@ -44,7 +124,85 @@ def main() -> None:
     if args.command == "update":
         end_date = args.end_date or cfg.default_end_date
         init_storage(cfg)
-        incremental_update(cfg, end_date)
+        incremental_update(
+            cfg, end_date, plan_only=args.plan_only, snapshot=args.snapshot
+        )
+        return
+
+    if args.command == "daemon":
+        if args.send:
+            reply = send_command(cfg, args.send, financials=args.financials)
+            print(json.dumps(reply, ensure_ascii=False, indent=2, default=str))
+            return
+        Daemon(cfg, snapshot=args.snapshot).serve_forever()
+        return
+
+    if args.command == "serve":
+        if args.send:
+            print(json.dumps(send(cfg, args.send), ensure_ascii=False, indent=2))
+            return
+        ArrowServer(cfg).serve_forever()
+        return
+
+    if args.command == "export":
+        start_date = args.start_date or cfg.default_start_date
+        end_date = args.end_date or cfg.default_end_date
+        rows = export_dataset(cfg, args.dataset, args.output, start_date, end_date)
+        print(f"{args.dataset}: exported {rows} rows to {args.output}")
+        return
+
+    if args.command == "compact":
+        init_storage(cfg)
+        merged = compact_price(cfg)
+        for year, count in merged.items():
+            print(f"price_daily year={year}: merged {count} delta files")
+        for year, count in compact_factors(cfg).items():
+            print(f"factor_daily year={year}: merged {count} delta files")
+        return
+
+    if args.command == "optimize":
+        init_storage(cfg)
+        if args.dataset:
+            reports = optimize_dataset(cfg, args.dataset)
+        else:
+            reports = optimize_all(cfg)
+        print(format_reports(reports) or "nothing to optimize")
+        return
+
+    if args.command == "adj-factors":
+        init_storage(cfg)
+        events = rebuild_adj_factors(cfg)
+        print(f"adj_factor: {events} factor rows written")
+        return
+
+    if args.command == "factors":
+        if args.list:
+            for item in FACTORS.values():
+                print(f"{item.name}: window {item.window}")
+            return
+        init_storage(cfg)
+        rows = update_factors(cfg, rebuild=args.rebuild)
+        print(f"factor_daily: {rows} rows written")
+        return
+
+    if args.command == "merge":
+        init_storage(cfg)
+        totals = merge_shards(cfg, args.shard_dirs or None)
+        for dataset, rows in totals.items():
+            print(f"{dataset}: merged {rows} rows")
+        return
+
+    if args.command == "build-panel":
+        init_storage(cfg)
+        meta = build_panel(cfg)
+        print(f"panel: {len(meta['dates'])} dates x {len(meta['codes'])} codes")
+        return
+
+    if args.command == "pit":
+        init_storage(cfg)
+        fields = args.fields.split(",") if args.fields else None
+        rows = build_pit(cfg, args.dataset, fields=fields, rebuild=args.rebuild)
+        print(f"pit_{args.dataset}: {rows} rows written")
         return
 
 
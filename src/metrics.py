@@ -0,0 +1,216 @@
+from __future__ import annotations
+
+from contextlib import contextmanager
+from datetime import datetime
+import json
+import logging
+import os
+from pathlib import Path
+import threading
+import time
+from typing import Iterator
+
+from .config import AppConfig
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "astock_"
+BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelKey = tuple[tuple[str, str], ...]
+
+
+def _labels(labels: dict[str, object]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _key_text(key: LabelKey) -> str:
+    return ",".join(f"{k}={v}" for k, v in key)
+
+
+def _format_labels(key: LabelKey, extra: tuple[str, str] | None = None) -> str:
+    items = list(key) + ([extra] if extra else [])
+    if not items:
+        return ""
+    body = ",".join(f'{k}="{v}"' for k, v in items)
+    return "{" + body + "}"
+
+
+class _Histogram:
+    def __init__(self) -> None:
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.total += value
+        self.count += 1
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.counters: dict[str, dict[LabelKey, float]] = {}
+        self.gauges: dict[str, dict[LabelKey, float]] = {}
+        self.histograms: dict[str, dict[LabelKey, _Histogram]] = {}
+
+    def inc(self, name: str, value: float = 1.0, **labels) -> None:
+        key = _labels(labels)
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+
+    def set(self, name: str, value: float, **labels) -> None:
+        with self._lock:
+            self.gauges.setdefault(name, {})[_labels(labels)] = value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = _labels(labels)
+        with self._lock:
+            series = self.histograms.setdefault(name, {})
+            hist = series.get(key)
+            if hist is None:
+                hist = series[key] = _Histogram()
+            hist.observe(value)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+
+    def stage_totals(self) -> dict[str, float]:
+        totals: dict[str, float] = {}
+        with self._lock:
+            for key, hist in self.histograms.get("stage_seconds", {}).items():
+                totals[_key_text(key)] = round(hist.total, 4)
+        return dict(sorted(totals.items()))
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counters = {
+                name: {_key_text(key): value for key, value in series.items()}
+                for name, series in self.counters.items()
+            }
+            gauges = {
+                name: {_key_text(key): value for key, value in series.items()}
+                for name, series in self.gauges.items()
+            }
+            histograms = {
+                name: {
+                    _key_text(key): {"count": h.count, "sum": round(h.total, 6)}
+                    for key, h in series.items()
+                }
+                for name, series in self.histograms.items()
+            }
+        return {"counters": counters, "gauges": gauges, "histograms": histograms}
+
+    def prometheus(self) -> str:
+        lines: list[str] = []
+        with self._lock:
+            for name, series in sorted(self.counters.items()):
+                lines.append(f"# TYPE {PREFIX}{name} counter")
+                for key, value in series.items():
+                    lines.append(f"{PREFIX}{name}{_format_labels(key)} {value}")
+            for name, series in sorted(self.gauges.items()):
+                lines.append(f"# TYPE {PREFIX}{name} gauge")
+                for key, value in series.items():
+                    lines.append(f"{PREFIX}{name}{_format_labels(key)} {value}")
+            for name, series in sorted(self.histograms.items()):
+                lines.append(f"# TYPE {PREFIX}{name} histogram")
+                for key, hist in series.items():
+                    running = 0
+                    for bound, count in zip(BUCKETS, hist.counts):
+                        running += count
+                        labels = _format_labels(key, ("le", str(bound)))
+                        lines.append(f"{PREFIX}{name}_bucket{labels} {running}")
+                    labels = _format_labels(key, ("le", "+Inf"))
+                    lines.append(f"{PREFIX}{name}_bucket{labels} {hist.count}")
+                    lines.append(f"{PREFIX}{name}_sum{_format_labels(key)} {hist.total}")
+                    lines.append(f"{PREFIX}{name}_count{_format_labels(key)} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def inc(name: str, value: float = 1.0, **labels) -> None:
+    REGISTRY.inc(name, value, **labels)
+
+
+def observe(name: str, value: float, **labels) -> None:
+    REGISTRY.observe(name, value, **labels)
+
+
+@contextmanager
+def timer(stage: str, **labels) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        REGISTRY.observe("stage_seconds", elapsed, stage=stage, **labels)
+
+
+def emit(cfg: AppConfig, event: str, **fields) -> None:
+    now = datetime.now().isoformat(timespec="seconds")
+    record = {"ts": now, "event": event, **fields}
+    cfg.metrics_dir.mkdir(parents=True, exist_ok=True)
+    with open(cfg.metrics_dir / "events.jsonl", "a", encoding="utf-8") as handle:
+        handle.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+
+
+def export(cfg: AppConfig, run: str) -> Path:
+    cfg.metrics_dir.mkdir(parents=True, exist_ok=True)
+    path = cfg.metrics_dir / "a_stock_data.prom"
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(REGISTRY.prometheus())
+    os.replace(tmp, path)
+    emit(cfg, "run_summary", run=run, **REGISTRY.snapshot())
+    return path
+
+
+class ProgressReporter:
+    def __init__(self, cfg: AppConfig, dataset: str, total: int, start: int = 0) -> None:
+        self.cfg = cfg
+        self.dataset = dataset
+        self.total = total
+        self.start = start
+        self.started = time.monotonic()
+        self.last_report = self.started
+
+    def update(self, done: int, force: bool = False) -> None:
+        now = time.monotonic()
+        if not force and now - self.last_report < self.cfg.progress_interval:
+            return
+        self.last_report = now
+        elapsed = max(now - self.started, 1e-9)
+        rate = (done - self.start) / elapsed
+        remaining = self.total - done
+        eta = remaining / rate if rate > 0 else None
+        REGISTRY.set("progress_codes_done", done, dataset=self.dataset)
+        REGISTRY.set("progress_codes_total", self.total, dataset=self.dataset)
+        REGISTRY.set("progress_codes_per_second", rate, dataset=self.dataset)
+        logger.info(
+            "%s: %d/%d codes, %.2f codes/s, eta %s",
+            self.dataset,
+            done,
+            self.total,
+            rate,
+            f"{eta:.0f}s" if eta is not None else "n/a",
+        )
+        emit(
+            self.cfg,
+            "progress",
+            dataset=self.dataset,
+            done=done,
+            total=self.total,
+            codes_per_s=round(rate, 3),
+            eta_s=round(eta, 1) if eta is not None else None,
+        )
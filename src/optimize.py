@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+import logging
+from pathlib import Path
+import time
+
+import pyarrow.compute as pc
+import pyarrow.dataset as pds
+import pyarrow.parquet as pq
+
+from .adjust import ADJ_FACTOR_KEYS
+from .changes import REVISION_KEYS
+from .config import AppConfig
+from .pit import PIT_KEYS
+from .financials import migrate_wide_files
+from .schema import FACTOR_KEYS, FINANCIAL_DATASETS, FINANCIAL_ITEM_KEYS, PRICE_KEYS
+from .storage import (
+    _partition_lock,
+    compact_partitions,
+    partition_dir,
+    partition_snapshot,
+    partition_years,
+    rewrite_sorted,
+)
+
+logger = logging.getLogger(__name__)
+
+PROBE_CODES = 10
+
+
+@dataclass
+class FileReport:
+    dataset: str
+    path: Path
+    bytes_before: int
+    bytes_after: int
+    row_groups_before: int
+    row_groups_after: int
+    read_ms_before: float
+    read_ms_after: float
+
+
+def dataset_layout(dataset: str) -> tuple[str, list[str]] | None:
+    if dataset == "price_daily":
+        return "trade_date", PRICE_KEYS
+    if dataset == "adj_factor":
+        return "trade_date", ADJ_FACTOR_KEYS
+    if dataset == "factor_daily":
+        return "trade_date", FACTOR_KEYS
+    if dataset in FINANCIAL_DATASETS:
+        return "end_date", FINANCIAL_ITEM_KEYS
+    if dataset.startswith("pit_"):
+        return "trade_date", PIT_KEYS
+    if dataset.endswith("_revisions"):
+        return "end_date", REVISION_KEYS
+    return None
+
+
+def _probe_codes(path: Path) -> list[str]:
+    codes = pq.read_table(path, columns=["ts_code"]).column("ts_code")
+    unique = sorted(pc.unique(codes.cast("string")).to_pylist())
+    step = max(1, len(unique) // PROBE_CODES)
+    return unique[::step][:PROBE_CODES]
+
+
+def _read_latency_ms(path: Path, codes: list[str]) -> float:
+    if not codes:
+        return 0.0
+    started = time.perf_counter()
+    for code in codes:
+        pds.dataset(path, format="parquet").to_table(filter=pc.field("ts_code") == code)
+    return (time.perf_counter() - started) * 1000 / len(codes)
+
+
+def _rewrite(dataset: str, path: Path, keys: list[str]) -> FileReport:
+    codes = _probe_codes(path)
+    bytes_before = path.stat().st_size
+    groups_before = pq.ParquetFile(path).metadata.num_row_groups
+    ms_before = _read_latency_ms(path, codes)
+    rewrite_sorted(path, keys, dataset)
+    return FileReport(
+        dataset=dataset,
+        path=path,
+        bytes_before=bytes_before,
+        bytes_after=path.stat().st_size,
+        row_groups_before=groups_before,
+        row_groups_after=pq.ParquetFile(path).metadata.num_row_groups,
+        read_ms_before=ms_before,
+        read_ms_after=_read_latency_ms(path, codes),
+    )
+
+
+def optimize_dataset(cfg: AppConfig, dataset: str) -> list[FileReport]:
+    layout = dataset_layout(dataset)
+    base_dir = cfg.dataset_dir(dataset)
+    if layout is None or not base_dir.exists():
+        return []
+    date_col, keys = layout
+    reports = []
+    if dataset in FINANCIAL_DATASETS:
+        migrate_wide_files(cfg, dataset)
+    if any(base_dir.glob("year=*")):
+        compact_partitions(base_dir, date_col, keys, dataset)
+        for year in partition_years(base_dir):
+            with _partition_lock(partition_dir(base_dir, year)):
+                for path in partition_snapshot(base_dir, year):
+                    reports.append(_rewrite(dataset, path, keys))
+        return reports
+    for path in sorted(base_dir.glob("[0-9][0-9][0-9][0-9].parquet")):
+        reports.append(_rewrite(dataset, path, keys))
+    return reports
+
+
+def optimize_all(cfg: AppConfig) -> list[FileReport]:
+    reports = []
+    if not cfg.parquet_dir.exists():
+        return reports
+    for base_dir in sorted(p for p in cfg.parquet_dir.iterdir() if p.is_dir()):
+        found = optimize_dataset(cfg, base_dir.name)
+        logger.info("optimized %s: %d files", base_dir.name, len(found))
+        reports.extend(found)
+    return reports
+
+
+def format_reports(reports: list[FileReport]) -> str:
+    totals: dict[str, list[FileReport]] = {}
+    for report in reports:
+        totals.setdefault(report.dataset, []).append(report)
+    lines = []
+    for dataset, items in totals.items():
+        before = sum(r.bytes_before for r in items)
+        after = sum(r.bytes_after for r in items)
+        ms_before = sum(r.read_ms_before for r in items) / len(items)
+        ms_after = sum(r.read_ms_after for r in items) / len(items)
+        lines.append(
+            f"{dataset}: {len(items)} files, {before / 1e6:.1f} MB -> {after / 1e6:.1f} MB, "
+            f"row groups {sum(r.row_groups_before for r in items)} -> "
+            f"{sum(r.row_groups_after for r in items)}, "
+            f"single-code read {ms_before:.1f} ms -> {ms_after:.1f} ms"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,257 @@
+from __future__ import annotations
+
+import json
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .config import AppConfig
+from .adjust import ADJUSTED_COLUMNS
+from .reader import load_adj_factors, load_prices
+from .storage import get_last_date, init_sqlite, read_table
+
+PANEL_FIELDS = {
+    "open": "float32",
+    "high": "float32",
+    "low": "float32",
+    "close": "float32",
+    "volume": "float64",
+    "amount": "float64",
+}
+PANEL_ADJUSTS = ("none", "qfq", "hfq")
+FACTOR_FILE = "adj_factor.bin"
+SCALED_FIELDS = [name for name in PANEL_FIELDS if name in ADJUSTED_COLUMNS]
+QFQ_CHUNK_ROWS = 256
+
+
+def _current_dir(cfg: AppConfig) -> Path | None:
+    pointer = cfg.panel_dir / "CURRENT"
+    if not pointer.exists():
+        return None
+    return cfg.panel_dir / pointer.read_text().strip()
+
+
+def _read_meta(version_dir: Path) -> dict:
+    return json.loads((version_dir / "meta.json").read_text())
+
+
+def _write_text_atomic(path: Path, text: str) -> None:
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(text)
+    os.replace(tmp, path)
+
+
+def _axes(cfg: AppConfig) -> tuple[list[str], list[str]]:
+    conn = init_sqlite(cfg.sqlite_path)
+    try:
+        stocks = read_table(conn, "stock_basic")
+        cal = read_table(conn, "trade_calendar")
+        last_price = get_last_date(conn, "price_daily")
+    finally:
+        conn.close()
+    codes = sorted(stocks["ts_code"].astype(str).unique().tolist())
+    dates = cal.loc[cal["is_open"] == 1, "cal_date"].astype(str)
+    dates = dates[dates >= cfg.default_start_date]
+    if last_price:
+        dates = dates[dates <= last_price]
+    return sorted(dates.unique().tolist()), codes
+
+
+def _factor_block(cfg: AppConfig, dates: list[str], codes: list[str]) -> np.ndarray:
+    block = np.ones((len(dates), len(codes)), dtype="float64")
+    if not dates:
+        return block
+    factors = load_adj_factors(cfg)
+    index = pd.DatetimeIndex(pd.to_datetime(dates, format="%Y%m%d"))
+    factors = factors[factors["trade_date"] <= index[-1]]
+    if factors.empty:
+        return block
+    wide = factors.assign(ts_code=factors["ts_code"].astype(str)).pivot(
+        index="trade_date", columns="ts_code", values="adj_factor"
+    )
+    wide = wide.reindex(wide.index.union(index)).ffill().reindex(index)
+    return wide.reindex(columns=codes).fillna(1.0).to_numpy("float64")
+
+
+def _append_blocks(version_dir: Path, blocks: dict[str, np.ndarray], sync: bool) -> None:
+    factor = blocks.get("adj_factor")
+    files = []
+    for name, block in blocks.items():
+        if name in PANEL_FIELDS:
+            files.append((version_dir / "none" / f"{name}.bin", block))
+        else:
+            files.append((version_dir / FACTOR_FILE, block))
+        if name in SCALED_FIELDS and factor is not None:
+            scaled = (block * factor).astype(PANEL_FIELDS[name])
+            files.append((version_dir / "hfq" / f"{name}.bin", scaled))
+    for path, block in files:
+        with open(path, "ab") as handle:
+            handle.write(np.ascontiguousarray(block).tobytes())
+            if sync:
+                handle.flush()
+                os.fsync(handle.fileno())
+
+
+def _truncate(version_dir: Path, cells: int) -> None:
+    files = [(version_dir / FACTOR_FILE, "float64")]
+    for name, dtype in PANEL_FIELDS.items():
+        files.append((version_dir / "none" / f"{name}.bin", dtype))
+        if name in SCALED_FIELDS:
+            files.append((version_dir / "hfq" / f"{name}.bin", dtype))
+    for path, dtype in files:
+        size = cells * np.dtype(dtype).itemsize
+        if path.exists() and path.stat().st_size > size:
+            os.truncate(path, size)
+
+
+def _fill_block(
+    cfg: AppConfig,
+    dates: list[str],
+    codes: list[str],
+) -> dict[str, np.ndarray]:
+    blocks = {
+        name: np.full((len(dates), len(codes)), np.nan, dtype=dtype)
+        for name, dtype in PANEL_FIELDS.items()
+    }
+    if not dates:
+        return blocks
+    blocks["adj_factor"] = _factor_block(cfg, dates, codes)
+    prices = load_prices(
+        cfg,
+        start=dates[0],
+        end=dates[-1],
+        adjust="none",
+        columns=["ts_code", "trade_date", *PANEL_FIELDS],
+    )
+    if prices.empty:
+        return blocks
+    date_pos = pd.Index(pd.to_datetime(dates, format="%Y%m%d")).get_indexer(
+        prices["trade_date"]
+    )
+    code_pos = pd.Index(codes).get_indexer(prices["ts_code"].astype(str))
+    mask = (date_pos >= 0) & (code_pos >= 0)
+    rows, cols = date_pos[mask], code_pos[mask]
+    for name in PANEL_FIELDS:
+        values = pd.to_numeric(prices[name], errors="coerce").to_numpy(
+            dtype=PANEL_FIELDS[name], na_value=np.nan
+        )
+        blocks[name][rows, cols] = values[mask]
+    return blocks
+
+
+def _write_qfq(version_dir: Path, shape: tuple[int, int]) -> None:
+    target = version_dir / "qfq"
+    target.mkdir(exist_ok=True)
+    if 0 in shape:
+        return
+    factor = np.memmap(version_dir / FACTOR_FILE, dtype="float64", mode="r", shape=shape)
+    last = np.array(factor[-1])
+    for name in SCALED_FIELDS:
+        dtype = PANEL_FIELDS[name]
+        raw = np.memmap(version_dir / "none" / f"{name}.bin", dtype=dtype, mode="r", shape=shape)
+        path = target / f"{name}.bin"
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        with open(tmp, "wb") as handle:
+            for start in range(0, shape[0], QFQ_CHUNK_ROWS):
+                rows = slice(start, start + QFQ_CHUNK_ROWS)
+                block = (raw[rows] * (factor[rows] / last)).astype(dtype)
+                handle.write(np.ascontiguousarray(block).tobytes())
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(tmp, path)
+
+
+def _year_chunks(dates: list[str]) -> list[list[str]]:
+    chunks: dict[str, list[str]] = {}
+    for date in dates:
+        chunks.setdefault(date[:4], []).append(date)
+    return [chunks[year] for year in sorted(chunks)]
+
+
+def build_panel(cfg: AppConfig) -> dict:
+    dates, codes = _axes(cfg)
+    cfg.panel_dir.mkdir(parents=True, exist_ok=True)
+    previous = _current_dir(cfg)
+    version = f"v{int(previous.name[1:]) + 1}" if previous else "v1"
+    version_dir = cfg.panel_dir / version
+    shutil.rmtree(version_dir, ignore_errors=True)
+    (version_dir / "none").mkdir(parents=True)
+    (version_dir / "hfq").mkdir()
+    for chunk in _year_chunks(dates):
+        _append_blocks(version_dir, _fill_block(cfg, chunk, codes), sync=False)
+    _write_qfq(version_dir, (len(dates), len(codes)))
+    meta = {
+        "dates": dates,
+        "codes": codes,
+        "fields": PANEL_FIELDS,
+        "adj_factor": True,
+        "scaled": SCALED_FIELDS,
+    }
+    _write_text_atomic(version_dir / "meta.json", json.dumps(meta))
+    _write_text_atomic(cfg.panel_dir / "CURRENT", version)
+    if previous is not None:
+        for old in cfg.panel_dir.glob("v*"):
+            if old.is_dir() and old.name not in (version, previous.name):
+                shutil.rmtree(old, ignore_errors=True)
+    return meta
+
+
+def extend_panel(cfg: AppConfig) -> int:
+    version_dir = _current_dir(cfg)
+    if version_dir is None:
+        return 0
+    meta = _read_meta(version_dir)
+    dates, codes = _axes(cfg)
+    if (
+        codes != meta["codes"]
+        or meta["fields"] != PANEL_FIELDS
+        or not meta.get("adj_factor")
+        or meta.get("scaled") != SCALED_FIELDS
+    ):
+        build_panel(cfg)
+        return len(dates)
+    last = meta["dates"][-1] if meta["dates"] else ""
+    new_dates = [date for date in dates if date > last]
+    if not new_dates:
+        return 0
+    _truncate(version_dir, len(meta["dates"]) * len(codes))
+    _append_blocks(version_dir, _fill_block(cfg, new_dates, codes), sync=True)
+    meta["dates"] = meta["dates"] + new_dates
+    _write_qfq(version_dir, (len(meta["dates"]), len(codes)))
+    _write_text_atomic(version_dir / "meta.json", json.dumps(meta))
+    return len(new_dates)
+
+
+def load_panel(
+    cfg: AppConfig, field: str, adjust: str = "none"
+) -> tuple[np.ndarray, pd.DatetimeIndex, pd.Index]:
+    if adjust not in PANEL_ADJUSTS:
+        raise ValueError(f"unknown adjust {adjust!r}")
+    version_dir = _current_dir(cfg)
+    if version_dir is None:
+        raise FileNotFoundError(cfg.panel_dir / "CURRENT")
+    meta = _read_meta(version_dir)
+    shape = (len(meta["dates"]), len(meta["codes"]))
+    dtype = meta["fields"][field]
+    if 0 in shape:
+        matrix = np.empty(shape, dtype=dtype)
+    else:
+        scaled = adjust != "none" and field in ADJUSTED_COLUMNS
+        stored = scaled and field in meta.get("scaled", [])
+        matrix = np.memmap(
+            version_dir / (adjust if stored else "none") / f"{field}.bin",
+            dtype=dtype,
+            mode="r",
+            shape=shape,
+        )
+        if scaled and not stored:
+            factor = np.memmap(
+                version_dir / FACTOR_FILE, dtype="float64", mode="r", shape=shape
+            )
+            scale = factor if adjust == "hfq" else factor / factor[-1]
+            matrix = (matrix * scale).astype(dtype)
+    dates = pd.DatetimeIndex(pd.to_datetime(meta["dates"], format="%Y%m%d"))
+    return matrix, dates, pd.Index(meta["codes"])
@@ -1,17 +1,64 @@
 from __future__ import annotations
 
+from bisect import bisect_right
+from datetime import datetime
+import logging
+
+import pandas as pd
+
+from . import metrics
+from .adjust import (
+    ADJ_FACTOR_KEYS,
+    AdjustedPriceWriter,
+    earliest_factors,
+    factor_events,
+    latest_factors,
+)
+from .changes import ChangeFilteringWriter, prepare_financial
 from .config import AppConfig
 from .data_source import (
     fetch_main_board_stocks,
     fetch_price_data_for_code,
+    fetch_price_snapshot,
     fetch_trade_calendar,
     fetch_balance_sheet_for_code,
     fetch_income_statement_for_code,
     fetch_cashflow_statement_for_code,
     fetch_financial_indicator_for_code,
-    next_day,
+    _code_to_ts,
+    _normalize_date,
+)
+from .planner import (
+    DatasetPlan,
+    format_plan,
+    load_open_days,
+    plan_financial,
+    plan_price,
 )
-from .storage import get_last_date, replace_table, set_last_date, upsert_parquet_by_year
+from .factors import reset_factors, update_factors
+from .fetch_executor import iter_fetch
+from .financials import LongFinancialWriter, migrate_wide_files
+from .metrics import ProgressReporter
+from .panel import extend_panel
+from .pit import refresh_pit
+from .reader import load_adj_factors, load_prices
+from .schema import FINANCIAL_ITEM_KEYS, FINANCIAL_KEYS, PRICE_KEYS, format_dates
+from .server import notify_reload
+from .shard import filter_shard
+from .storage import (
+    BufferedDatasetWriter,
+    compact_partitions,
+    get_last_date,
+    init_sqlite,
+    partition_years,
+    read_partition,
+    read_table,
+    replace_table,
+    set_last_date,
+    set_watermarks,
+)
+
+logger = logging.getLogger(__name__)
 
 
 def init_storage(cfg: AppConfig) -> None:
@@ -28,6 +75,148 @@ def _sorted_codes(stocks):
     return codes
 
 
+def _financial_datasets(cfg: AppConfig):
+    return [
+        ("balance_sheet", fetch_balance_sheet_for_code, cfg.balance_dir),
+        ("income_statement", fetch_income_statement_for_code, cfg.income_dir),
+        ("cashflow_statement", fetch_cashflow_statement_for_code, cfg.cashflow_dir),
+        ("fina_indicator", fetch_financial_indicator_for_code, cfg.indicator_dir),
+    ]
+
+
+def _new_writer(
+    cfg: AppConfig,
+    dataset: str,
+    target_dir,
+    date_col: str,
+    key_cols: list[str],
+    append_only: bool = False,
+):
+    return BufferedDatasetWriter(
+        target_dir,
+        date_col,
+        key_cols,
+        max_rows=cfg.write_buffer_rows,
+        max_bytes=cfg.write_buffer_bytes,
+        append_only=append_only,
+        dataset=dataset,
+    )
+
+
+def _price_writer(cfg: AppConfig, base=None):
+    prices = _new_writer(
+        cfg, "price_daily", cfg.price_dir, "trade_date", PRICE_KEYS, append_only=True
+    )
+    factors = _new_writer(
+        cfg, "adj_factor", cfg.adj_factor_dir, "trade_date", ADJ_FACTOR_KEYS
+    )
+    if base is not None:
+        return AdjustedPriceWriter(prices, factors, base)
+    stored = load_adj_factors(cfg)
+    return AdjustedPriceWriter(
+        prices, factors, latest_factors(stored), earliest_factors(stored)
+    )
+
+
+def _rebuild_backfilled(cfg: AppConfig, writer: AdjustedPriceWriter) -> None:
+    if not writer.backfilled:
+        return
+    logger.info(
+        "adj_factor: %d codes fetched before their factor history, rebuilding",
+        len(writer.backfilled),
+    )
+    rebuild_adj_factors(cfg)
+
+
+def _financial_writer(cfg: AppConfig, conn, dataset: str, target_dir):
+    migrate_wide_files(cfg, dataset, conn)
+    writer = BufferedDatasetWriter(
+        target_dir,
+        "end_date",
+        FINANCIAL_ITEM_KEYS,
+        max_rows=cfg.write_buffer_rows,
+        max_bytes=cfg.write_buffer_bytes,
+        dataset=dataset,
+        replace_on=FINANCIAL_KEYS,
+    )
+    long = LongFinancialWriter(conn, writer, dataset)
+    return ChangeFilteringWriter(cfg, conn, long, dataset)
+
+
+def _checkpoint(
+    conn,
+    writer,
+    dataset: str,
+    progress_key: str | None,
+    done: int,
+    last_date,
+    watermarks: list[tuple[str, str | None, int, str]],
+) -> None:
+    writer.flush()
+    with metrics.timer("sqlite_commit", dataset=dataset), conn:
+        set_watermarks(conn, dataset, watermarks, commit=False)
+        if last_date:
+            stored = get_last_date(conn, dataset)
+            if not stored or last_date > stored:
+                set_last_date(conn, dataset, last_date, commit=False)
+        if progress_key:
+            set_last_date(conn, progress_key, str(done), commit=False)
+
+
+def _checked_at(end_date: str) -> str:
+    now = datetime.now().isoformat(timespec="seconds")
+    end = datetime.strptime(_normalize_date(end_date), "%Y%m%d")
+    return min(now, end.replace(hour=23, minute=59, second=59).isoformat())
+
+
+def _run_dataset(
+    conn,
+    cfg: AppConfig,
+    dataset: str,
+    tasks: list[tuple[str, str]],
+    fetcher,
+    writer,
+    end_date: str,
+    progress_key: str | None = None,
+    prepare=None,
+) -> None:
+    progress = get_last_date(conn, progress_key) if progress_key else None
+    start_index = int(progress) if progress else 0
+    pending_last = None
+    watermarks: list[tuple[str, str | None, int, str]] = []
+    done = start_index
+    reporter = ProgressReporter(cfg, dataset, len(tasks), start_index)
+    with metrics.timer("dataset", dataset=dataset):
+        for idx, code, df, error in iter_fetch(
+            cfg, fetcher, tasks, end_date, start_index, prepare=prepare
+        ):
+            fetched_at = _checked_at(end_date)
+            code_last = None
+            if error is not None:
+                metrics.inc("fetch_errors_total", dataset=dataset)
+                logger.warning("%s %s: fetch failed: %s", dataset, code, error)
+            if df is not None and not df.empty:
+                writer.add(df)
+                metrics.inc("rows_fetched_total", len(df), dataset=dataset)
+                code_last = format_dates(df[writer.date_col]).max()
+                if not pending_last or code_last > pending_last:
+                    pending_last = code_last
+            if error is None:
+                rows = 0 if df is None else len(df)
+                watermarks.append((_code_to_ts(code), code_last, rows, fetched_at))
+            done = idx + 1
+            metrics.inc("codes_processed_total", dataset=dataset)
+            if writer.should_flush() or len(watermarks) >= cfg.checkpoint_every:
+                _checkpoint(
+                    conn, writer, dataset, progress_key, done, pending_last, watermarks
+                )
+                pending_last = None
+                watermarks = []
+            reporter.update(done)
+        _checkpoint(conn, writer, dataset, progress_key, done, pending_last, watermarks)
+    reporter.update(done, force=True)
+
+
 def full_download(cfg: AppConfig, start_date: str, end_date: str) -> None:
     stocks = fetch_main_board_stocks(cfg)
     trade_cal = fetch_trade_calendar(cfg, start_date, end_date)
@@ -36,96 +225,250 @@ def full_download(cfg: AppConfig, start_date: str, end_date: str) -> None:
 
     conn = init_sqlite(cfg.sqlite_path)
     replace_table(conn, "stock_basic", stocks)
-    replace_table(conn, "trade_calendar", trade_cal)
+    _store_calendar(conn, trade_cal, end_date)
 
-    codes = _sorted_codes(stocks)
+    tasks = [(code, start_date) for code in _sorted_codes(filter_shard(cfg, stocks))]
 
-    price_progress = get_last_date(conn, _progress_key("price_daily", "full"))
-    price_start_index = int(price_progress) if price_progress else 0
-    for idx, code in enumerate(codes[price_start_index:], start=price_start_index):
-        try:
-            price = fetch_price_data_for_code(cfg, code, start_date, end_date)
-        except Exception:
-            continue
-        upsert_parquet_by_year(
-            price, cfg.price_dir, "trade_date", ["ts_code", "trade_date", "adjust"]
-        )
-        if not price.empty:
-            set_last_date(conn, "price_daily", price["trade_date"].max())
-        set_last_date(conn, _progress_key("price_daily", "full"), str(idx + 1))
+    writer = _price_writer(cfg)
+    _run_dataset(
+        conn,
+        cfg,
+        "price_daily",
+        tasks,
+        fetch_price_data_for_code,
+        writer,
+        end_date,
+        _progress_key("price_daily", "full"),
+    )
+    _rebuild_backfilled(cfg, writer)
 
-    for dataset, fetcher, target_dir in [
-        ("balance_sheet", fetch_balance_sheet_for_code, cfg.balance_dir),
-        ("income_statement", fetch_income_statement_for_code, cfg.income_dir),
-        ("cashflow_statement", fetch_cashflow_statement_for_code, cfg.cashflow_dir),
-        ("fina_indicator", fetch_financial_indicator_for_code, cfg.indicator_dir),
-    ]:
-        progress = get_last_date(conn, _progress_key(dataset, "full"))
-        start_index = int(progress) if progress else 0
-        for idx, code in enumerate(codes[start_index:], start=start_index):
-            try:
-                df = fetcher(cfg, code, start_date, end_date)
-            except Exception:
-                continue
-            upsert_parquet_by_year(df, target_dir, "end_date", ["ts_code", "end_date"])
-            if not df.empty:
-                set_last_date(conn, dataset, df["end_date"].max())
-            set_last_date(conn, _progress_key(dataset, "full"), str(idx + 1))
+    for dataset, fetcher, target_dir in _financial_datasets(cfg):
+        writer = _financial_writer(cfg, conn, dataset, target_dir)
+        _run_dataset(
+            conn,
+            cfg,
+            dataset,
+            tasks,
+            fetcher,
+            writer,
+            end_date,
+            _progress_key(dataset, "full"),
+            prepare=prepare_financial,
+        )
 
     conn.close()
+    metrics.export(cfg, "full")
+
+
+def _load_or_fetch(conn, table: str, fetch):
+    try:
+        df = read_table(conn, table)
+    except Exception:
+        df = None
+    if df is None or df.empty:
+        df = fetch()
+        replace_table(conn, table, df)
+    return df
+
+
+def _store_calendar(conn, cal: pd.DataFrame, end_date: str) -> None:
+    replace_table(conn, "trade_calendar", cal)
+    set_last_date(conn, "trade_calendar", _normalize_date(end_date))
+
+
+def _load_calendar(conn, cfg: AppConfig, end_date: str) -> pd.DataFrame:
+    end = _normalize_date(end_date)
+    try:
+        cal = read_table(conn, "trade_calendar")
+    except Exception:
+        cal = pd.DataFrame()
+    covered = get_last_date(conn, "trade_calendar")
+    if not covered and not cal.empty:
+        covered = str(cal["cal_date"].astype(str).map(_normalize_date).max())
+    if not covered or covered < end:
+        cal = fetch_trade_calendar(cfg, cfg.default_start_date, end)
+        _store_calendar(conn, cal, end)
+    return cal
+
+
+def plan_update(cfg: AppConfig, conn, stocks, end_date: str) -> list[DatasetPlan]:
+    codes = _sorted_codes(filter_shard(cfg, stocks))
+    open_days = load_open_days(conn)
+    plans = [plan_price(cfg, conn, codes, end_date, open_days)]
+    for dataset, _fetcher, _target_dir in _financial_datasets(cfg):
+        plans.append(plan_financial(cfg, conn, dataset, codes, end_date))
+    return plans
+
+
+def _snapshot_day(cfg: AppConfig, open_days: list[str], end_date: str) -> str | None:
+    now = datetime.now()
+    today = now.strftime("%Y%m%d")
+    idx = bisect_right(open_days, today)
+    if idx == 0:
+        return None
+    day = open_days[idx - 1]
+    if day == today and now.strftime("%H:%M") < cfg.snapshot_after:
+        return None
+    if day > _normalize_date(end_date) or idx < 2:
+        return None
+    return day
+
+
+def _run_snapshot(
+    conn, cfg: AppConfig, tasks: list[tuple[str, str]], end_date: str
+) -> list[tuple[str, str]]:
+    open_days = load_open_days(conn)
+    day = _snapshot_day(cfg, open_days, end_date)
+    if day is None:
+        logger.info("price_daily: no settled session to snapshot, fetching per code")
+        return tasks
+    prev = open_days[open_days.index(day) - 1]
+    wanted = {_code_to_ts(code) for code, start in tasks if start == prev}
+    if not wanted:
+        return tasks
+    try:
+        with metrics.timer("snapshot", dataset="price_daily"):
+            snapshot = fetch_price_snapshot(cfg, day)
+    except Exception as exc:
+        logger.warning("price_daily: snapshot failed, fetching per code: %s", exc)
+        return tasks
+    if not snapshot.empty:
+        snapshot = snapshot[snapshot["ts_code"].isin(wanted)]
+    if snapshot.empty:
+        return tasks
+    covered = set(snapshot["ts_code"])
+    history = load_prices(cfg, codes=sorted(covered), start=prev, end=prev)
+    writer = _price_writer(cfg)
+    writer.add(snapshot, history=history)
+    fetched_at = _checked_at(day)
+    watermarks = [(code, day, 1, fetched_at) for code in sorted(covered)]
+    _checkpoint(conn, writer, "price_daily", None, 0, day, watermarks)
+    metrics.inc("rows_fetched_total", len(snapshot), dataset="price_daily")
+    metrics.inc("snapshot_codes_total", len(covered), dataset="price_daily")
+    remaining = [(code, start) for code, start in tasks if _code_to_ts(code) not in covered]
+    logger.info(
+        "price_daily: snapshot %s covered %d codes, %d left for per-code fetches",
+        day,
+        len(covered),
+        len(remaining),
+    )
+    return remaining
 
 
-def incremental_update(cfg: AppConfig, end_date: str) -> None:
+def incremental_update(
+    cfg: AppConfig,
+    end_date: str,
+    plan_only: bool = False,
+    snapshot: bool = False,
+    financials: bool = True,
+    refresh_reference: bool = True,
+    conn=None,
+) -> dict[str, int]:
     from .storage import init_sqlite
 
-    conn = init_sqlite(cfg.sqlite_path)
+    owned = conn is None
+    if owned:
+        conn = init_sqlite(cfg.sqlite_path)
 
-    stocks = fetch_main_board_stocks(cfg)
-    replace_table(conn, "stock_basic", stocks)
+    if plan_only:
+        stocks = _load_or_fetch(conn, "stock_basic", lambda: fetch_main_board_stocks(cfg))
+        _load_calendar(conn, cfg, end_date)
+        print(format_plan(plan_update(cfg, conn, stocks, end_date)))
+        if owned:
+            conn.close()
+        return {}
 
-    trade_cal = fetch_trade_calendar(cfg, cfg.default_start_date, end_date)
-    replace_table(conn, "trade_calendar", trade_cal)
+    if refresh_reference:
+        stocks = fetch_main_board_stocks(cfg)
+        replace_table(conn, "stock_basic", stocks)
 
-    last_price_date = get_last_date(conn, "price_daily")
-    if last_price_date:
-        price_start = next_day(last_price_date)
+        trade_cal = fetch_trade_calendar(cfg, cfg.default_start_date, end_date)
+        _store_calendar(conn, trade_cal, end_date)
     else:
-        price_start = cfg.default_start_date
+        stocks = _load_or_fetch(conn, "stock_basic", lambda: fetch_main_board_stocks(cfg))
+        _load_calendar(conn, cfg, end_date)
+
+    plans = {plan.dataset: plan for plan in plan_update(cfg, conn, stocks, end_date)}
+    price_tasks = plans["price_daily"].tasks
+    if snapshot:
+        price_tasks = _run_snapshot(conn, cfg, price_tasks, end_date)
+    counts = {"price_daily": len(plans["price_daily"].tasks)}
+
+    writer = _price_writer(cfg)
+    _run_dataset(
+        conn,
+        cfg,
+        "price_daily",
+        price_tasks,
+        fetch_price_data_for_code,
+        writer,
+        end_date,
+    )
+    _rebuild_backfilled(cfg, writer)
+
+    if financials:
+        for dataset, fetcher, target_dir in _financial_datasets(cfg):
+            writer = _financial_writer(cfg, conn, dataset, target_dir)
+            tasks = plans[dataset].tasks
+            _run_dataset(
+                conn,
+                cfg,
+                dataset,
+                tasks,
+                fetcher,
+                writer,
+                end_date,
+                prepare=prepare_financial,
+            )
+            counts[dataset] = len(tasks)
+
+    if owned:
+        conn.close()
+    if cfg.shard is None:
+        with metrics.timer("panel"):
+            extend_panel(cfg)
+        if cfg.factor_update:
+            update_factors(cfg)
+        if financials:
+            with metrics.timer("pit"):
+                refresh_pit(cfg)
+        notify_reload(cfg)
+    metrics.export(cfg, "update")
+    return counts
 
-    codes = _sorted_codes(stocks)
 
-    price_progress = get_last_date(conn, _progress_key("price_daily", "update"))
-    price_start_index = int(price_progress) if price_progress else 0
-    for idx, code in enumerate(codes[price_start_index:], start=price_start_index):
-        try:
-            price = fetch_price_data_for_code(cfg, code, price_start, end_date)
-        except Exception:
+def rebuild_adj_factors(cfg: AppConfig) -> int:
+    for path in cfg.adj_factor_dir.glob("*.parquet"):
+        path.unlink()
+    conn = init_sqlite(cfg.sqlite_path)
+    try:
+        reset_factors(cfg, conn)
+    finally:
+        conn.close()
+    writer = _new_writer(
+        cfg, "adj_factor", cfg.adj_factor_dir, "trade_date", ADJ_FACTOR_KEYS
+    )
+    base: dict = {}
+    carry = None
+    events = 0
+    for year in partition_years(cfg.price_dir):
+        bars = read_partition(cfg.price_dir, year, PRICE_KEYS)
+        if bars.empty:
             continue
-        upsert_parquet_by_year(
-            price, cfg.price_dir, "trade_date", ["ts_code", "trade_date", "adjust"]
-        )
-        if not price.empty:
-            set_last_date(conn, "price_daily", price["trade_date"].max())
-        set_last_date(conn, _progress_key("price_daily", "update"), str(idx + 1))
+        bars = bars[bars["adjust"].astype(str) == "none"]
+        if carry is not None:
+            bars = pd.concat([carry, bars], ignore_index=True)
+        found = factor_events(bars, base)
+        writer.add(found)
+        writer.flush()
+        base.update(latest_factors(found))
+        events += len(found)
+        bars = bars.sort_values("trade_date")
+        carry = bars.groupby(bars["ts_code"].astype(str)).tail(1)
+    return events
 
-    for dataset, fetcher, target_dir in [
-        ("balance_sheet", fetch_balance_sheet_for_code, cfg.balance_dir),
-        ("income_statement", fetch_income_statement_for_code, cfg.income_dir),
-        ("cashflow_statement", fetch_cashflow_statement_for_code, cfg.cashflow_dir),
-        ("fina_indicator", fetch_financial_indicator_for_code, cfg.indicator_dir),
-    ]:
-        last_date = get_last_date(conn, dataset)
-        start_date = next_day(last_date) if last_date else cfg.default_start_date
-        progress = get_last_date(conn, _progress_key(dataset, "update"))
-        start_index = int(progress) if progress else 0
-        for idx, code in enumerate(codes[start_index:], start=start_index):
-            try:
-                df = fetcher(cfg, code, start_date, end_date)
-            except Exception:
-                continue
-            upsert_parquet_by_year(df, target_dir, "end_date", ["ts_code", "end_date"])
-            if not df.empty:
-                set_last_date(conn, dataset, df["end_date"].max())
-            set_last_date(conn, _progress_key(dataset, "update"), str(idx + 1))
 
-    conn.close()
+def compact_price(cfg: AppConfig) -> dict[str, int]:
+    return compact_partitions(
+        cfg.price_dir, "trade_date", PRICE_KEYS, "price_daily"
+    )
@@ -0,0 +1,150 @@
+from __future__ import annotations
+
+from datetime import datetime, timedelta
+import json
+import shutil
+
+import pandas as pd
+
+from .config import AppConfig
+from .planner import report_deadline
+from .reader import load_financials, load_prices
+from .schema import FINANCIAL_DATASETS, parse_dates
+from .storage import (
+    BufferedDatasetWriter,
+    get_last_date,
+    init_sqlite,
+    partition_years,
+    set_last_date,
+)
+
+ANN_DATE_COLUMNS = ["公告日期", "ann_date"]
+PIT_KEYS = ["ts_code", "trade_date"]
+CHUNK_CODES = 500
+
+
+def pit_dataset(dataset: str) -> str:
+    return f"pit_{dataset}"
+
+
+def _availability(reports: pd.DataFrame) -> pd.Series:
+    periods = reports["end_date"].dt.strftime("%Y%m%d")
+    deadline = parse_dates(periods.map(report_deadline))
+    for col in ANN_DATE_COLUMNS:
+        if col in reports.columns and reports[col].notna().any():
+            announced = parse_dates(reports[col])
+            return announced.where(announced.notna(), deadline)
+    return deadline
+
+
+def _report_timeline(cfg: AppConfig, dataset: str, fields: list[str] | None):
+    columns = None
+    if fields:
+        columns = list(dict.fromkeys(["ts_code", "end_date", *ANN_DATE_COLUMNS, *fields]))
+    reports = load_financials(cfg, dataset, columns=columns)
+    if reports.empty:
+        return reports
+    reports = reports.copy()
+    reports["ann_date"] = _availability(reports)
+    reports = reports[reports["ann_date"].notna() & reports["end_date"].notna()]
+    reports = reports.sort_values(["ts_code", "ann_date", "end_date"])
+    latest = reports.groupby("ts_code", observed=True)["end_date"].cummax()
+    reports = reports[reports["end_date"] >= latest]
+    reports = reports.drop_duplicates(["ts_code", "ann_date"], keep="last")
+    keep = ["ts_code", "end_date", "ann_date"]
+    if fields:
+        keep += [f for f in fields if f in reports.columns and f not in keep]
+    else:
+        keep += [c for c in reports.columns if c not in keep and c not in ANN_DATE_COLUMNS]
+    reports = reports[keep]
+    reports["ts_code"] = reports["ts_code"].astype(str)
+    return reports.sort_values("ann_date", ignore_index=True)
+
+
+def asof_join(prices: pd.DataFrame, reports: pd.DataFrame) -> pd.DataFrame:
+    left = prices[PIT_KEYS].copy()
+    left["ts_code"] = left["ts_code"].astype(str)
+    left = left.sort_values("trade_date", ignore_index=True)
+    joined = pd.merge_asof(
+        left,
+        reports,
+        left_on="trade_date",
+        right_on="ann_date",
+        by="ts_code",
+        direction="backward",
+    )
+    return joined[joined["end_date"].notna()]
+
+
+def _fields_path(cfg: AppConfig, dataset: str):
+    return cfg.dataset_dir(pit_dataset(dataset)) / "_fields.json"
+
+
+def build_pit(
+    cfg: AppConfig,
+    dataset: str,
+    fields: list[str] | None = None,
+    rebuild: bool = False,
+) -> int:
+    target_dir = cfg.dataset_dir(pit_dataset(dataset))
+    fields_path = _fields_path(cfg, dataset)
+    if rebuild:
+        shutil.rmtree(target_dir, ignore_errors=True)
+    target_dir.mkdir(parents=True, exist_ok=True)
+    if fields is None and fields_path.exists():
+        fields = json.loads(fields_path.read_text()) or None
+    fields_path.write_text(json.dumps(fields or [], ensure_ascii=False))
+
+    conn = init_sqlite(cfg.sqlite_path)
+    state_key = f"{pit_dataset(dataset)}_built"
+    built = None if rebuild else get_last_date(conn, state_key)
+    start = None
+    if built:
+        start = datetime.strptime(built, "%Y%m%d") - timedelta(days=cfg.pit_refresh_days)
+        start = start.strftime("%Y%m%d")
+
+    reports = _report_timeline(cfg, dataset, fields)
+    writer = BufferedDatasetWriter(
+        target_dir,
+        "trade_date",
+        PIT_KEYS,
+        max_rows=cfg.write_buffer_rows,
+        max_bytes=cfg.write_buffer_bytes,
+        dataset=pit_dataset(dataset),
+    )
+    written = 0
+    last_built = built
+    if not reports.empty:
+        years = partition_years(cfg.price_dir)
+        if start:
+            years = [y for y in years if y >= start[:4]]
+        for year in years:
+            lo = max(f"{year}0101", start) if start else f"{year}0101"
+            prices = load_prices(cfg, start=lo, end=f"{year}1231", columns=PIT_KEYS)
+            if prices.empty:
+                continue
+            codes = prices["ts_code"].astype(str)
+            unique_codes = sorted(codes.unique())
+            for i in range(0, len(unique_codes), CHUNK_CODES):
+                chunk = prices[codes.isin(unique_codes[i : i + CHUNK_CODES])]
+                joined = asof_join(chunk, reports)
+                writer.add(joined)
+                written += len(joined)
+                if writer.should_flush():
+                    writer.flush()
+            year_last = prices["trade_date"].max().strftime("%Y%m%d")
+            if not last_built or year_last > last_built:
+                last_built = year_last
+    writer.close()
+    if last_built:
+        set_last_date(conn, state_key, last_built)
+    conn.close()
+    return written
+
+
+def refresh_pit(cfg: AppConfig) -> dict[str, int]:
+    results: dict[str, int] = {}
+    for dataset in FINANCIAL_DATASETS:
+        if _fields_path(cfg, dataset).exists():
+            results[dataset] = build_pit(cfg, dataset)
+    return results
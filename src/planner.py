@@ -0,0 +1,168 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from datetime import date, datetime
+import sqlite3
+
+import pandas as pd
+
+from .config import AppConfig
+from .data_source import _code_to_ts, _normalize_date
+from .storage import get_last_date, get_watermarks
+
+_PERIOD_DEADLINES = {"0331": "0430", "0630": "0831", "0930": "1031", "1231": "0430"}
+
+
+@dataclass
+class DatasetPlan:
+    dataset: str
+    tasks: list[tuple[str, str]] = field(default_factory=list)
+    skipped: int = 0
+    requests_per_code: int = 1
+
+    @property
+    def requests(self) -> int:
+        return len(self.tasks) * self.requests_per_code
+
+
+def _today() -> str:
+    return date.today().strftime("%Y%m%d")
+
+
+def _days_between(start: str, end: str) -> int:
+    fmt = "%Y%m%d"
+    return (datetime.strptime(end, fmt) - datetime.strptime(start, fmt)).days
+
+
+def load_open_days(conn: sqlite3.Connection) -> list[str]:
+    try:
+        cal = pd.read_sql_query(
+            "select cal_date from trade_calendar where is_open = 1", conn
+        )
+    except Exception:
+        return []
+    return sorted(cal["cal_date"].astype(str).map(_normalize_date).unique().tolist())
+
+
+def next_open_day(open_days: list[str], after: str) -> str | None:
+    idx = pd.Index(open_days).searchsorted(after, side="right")
+    return open_days[idx] if idx < len(open_days) else None
+
+
+def next_report_period(last_end_date: str) -> str:
+    year = int(last_end_date[:4])
+    for suffix in ["0331", "0630", "0930", "1231"]:
+        period = f"{year}{suffix}"
+        if period > last_end_date:
+            return period
+    return f"{year + 1}0331"
+
+
+def report_deadline(period: str) -> str:
+    suffix = period[4:]
+    year = int(period[:4]) + (1 if suffix == "1231" else 0)
+    return f"{year}{_PERIOD_DEADLINES[suffix]}"
+
+
+def in_report_window(day: str) -> bool:
+    year = int(day[:4])
+    for period in [f"{year - 1}1231", f"{year}0331", f"{year}0630", f"{year}0930"]:
+        if period < day <= report_deadline(period):
+            return True
+    return False
+
+
+def _watermark_map(conn: sqlite3.Connection, dataset: str) -> dict[str, tuple]:
+    marks = get_watermarks(conn, dataset)
+    return {
+        row.ts_code: (row.last_date, row.fetched_at)
+        for row in marks.itertuples(index=False)
+    }
+
+
+def plan_price(
+    cfg: AppConfig,
+    conn: sqlite3.Connection,
+    codes: list[str],
+    end_date: str,
+    open_days: list[str],
+) -> DatasetPlan:
+    plan = DatasetPlan("price_daily", requests_per_code=1)
+    as_of = min(_normalize_date(end_date), _today())
+    marks = _watermark_map(conn, "price_daily")
+    global_last = None
+    if not any(last for last, _ in marks.values()):
+        global_last = get_last_date(conn, "price_daily")
+    for code in codes:
+        last = marks.get(_code_to_ts(code), (None, None))[0] or global_last
+        if not last:
+            plan.tasks.append((code, cfg.default_start_date))
+            continue
+        if open_days:
+            start = next_open_day(open_days, last)
+            if start is None or start > as_of:
+                plan.skipped += 1
+                continue
+        plan.tasks.append((code, last))
+    return plan
+
+
+def _pending_periods(last_end_date: str | None, as_of: str) -> list[str]:
+    if not last_end_date:
+        return []
+    periods = []
+    period = next_report_period(last_end_date)
+    while period < as_of:
+        periods.append(period)
+        period = next_report_period(period)
+    return periods
+
+
+def _needs_report_fetch(
+    last_end_date: str | None, fetched_at: str | None, as_of: str, recheck_days: int
+) -> bool:
+    if not fetched_at:
+        return True
+    fetched = _normalize_date(fetched_at)
+    if not last_end_date:
+        return _days_between(fetched, as_of) >= recheck_days
+    for period in _pending_periods(last_end_date, as_of):
+        deadline = report_deadline(period)
+        if as_of <= deadline:
+            if _days_between(fetched, as_of) >= recheck_days:
+                return True
+        elif fetched <= deadline:
+            return True
+    return False
+
+
+def plan_financial(
+    cfg: AppConfig,
+    conn: sqlite3.Connection,
+    dataset: str,
+    codes: list[str],
+    end_date: str,
+) -> DatasetPlan:
+    plan = DatasetPlan(dataset)
+    as_of = min(_normalize_date(end_date), _today())
+    marks = _watermark_map(conn, dataset)
+    for code in codes:
+        last, fetched_at = marks.get(_code_to_ts(code), (None, None))
+        if not _needs_report_fetch(
+            last, fetched_at, as_of, cfg.report_recheck_days
+        ):
+            plan.skipped += 1
+            continue
+        plan.tasks.append((code, cfg.default_start_date))
+    return plan
+
+
+def format_plan(plans: list[DatasetPlan]) -> str:
+    lines = []
+    for plan in plans:
+        lines.append(
+            f"{plan.dataset}: {len(plan.tasks)} codes, {plan.skipped} skipped, "
+            f"{plan.requests} requests"
+        )
+    lines.append(f"total: {sum(plan.requests for plan in plans)} requests")
+    return "\n".join(lines)
@@ -0,0 +1,468 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+from pathlib import Path
+import threading
+from typing import Iterable
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as pds
+import pyarrow.parquet as pq
+
+from .adjust import ADJ_FACTOR_KEYS, DERIVED_ADJUSTS, apply_factors
+from .config import AppConfig
+from .financials import is_long_file, pivot_wide
+from .locations import lookup
+from .schema import (
+    FACTOR_KEYS,
+    FINANCIAL_ITEM_KEYS,
+    FINANCIAL_KEYS,
+    FINANCIAL_WIDE,
+    PRICE_KEYS,
+    SCHEMAS,
+    conform,
+    format_dates,
+)
+from .storage import get_items, init_sqlite, partition_snapshot, partition_years
+
+
+_PANDAS_MAJOR = int(pd.__version__.split(".")[0])
+
+
+def _detach(df: pd.DataFrame) -> pd.DataFrame:
+    if _PANDAS_MAJOR >= 3 or pd.get_option("mode.copy_on_write") is True:
+        return df.copy(deep=False)
+    return df.copy()
+
+
+class ResultCache:
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[tuple, tuple[pd.DataFrame, int]] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> pd.DataFrame | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return _detach(entry[0])
+
+    def put(self, key: tuple, df: pd.DataFrame) -> None:
+        size = int(df.memory_usage(index=True, deep=True).sum())
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (df, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+_caches: dict[int, ResultCache] = {}
+_caches_lock = threading.Lock()
+
+
+def _cache(cfg: AppConfig) -> ResultCache:
+    with _caches_lock:
+        cache = _caches.get(cfg.reader_cache_bytes)
+        if cache is None:
+            cache = ResultCache(cfg.reader_cache_bytes)
+            _caches[cfg.reader_cache_bytes] = cache
+        return cache
+
+
+def _as_date(value) -> pd.Timestamp | None:
+    if value is None:
+        return None
+    return pd.Timestamp(format_dates(pd.Series([value])).iloc[0])
+
+
+def _as_list(values) -> list[str] | None:
+    if values is None:
+        return None
+    if isinstance(values, str):
+        return [values]
+    return sorted(set(values))
+
+
+def _signature(files: list[Path]) -> tuple:
+    return tuple((str(path), path.stat().st_mtime_ns) for path in files)
+
+
+def _years_between(years: list[str], start, end) -> list[str]:
+    lo = str(start.year) if start is not None else None
+    hi = str(end.year) if end is not None else None
+    return [y for y in years if (lo is None or y >= lo) and (hi is None or y <= hi)]
+
+
+def _is_typed(path: Path, date_col: str) -> bool:
+    schema = pq.read_schema(path)
+    idx = schema.get_field_index(date_col)
+    return idx >= 0 and pa.types.is_date32(schema.field(idx).type)
+
+
+def _restore_types(table: pa.Table, dataset: str) -> pa.Table:
+    schema = SCHEMAS.get(dataset)
+    if schema is None:
+        return table
+    for field in schema:
+        idx = table.schema.get_field_index(field.name)
+        if idx < 0 or not pa.types.is_dictionary(field.type):
+            continue
+        if not pa.types.is_dictionary(table.schema.field(idx).type):
+            table = table.set_column(idx, field, table.column(idx).dictionary_encode())
+    return table
+
+
+def _filter_expr(
+    codes: list[str] | None,
+    date_col: str,
+    start=None,
+    end=None,
+    dates: list[pd.Timestamp] | None = None,
+    adjust: list[str] | None = None,
+    items: list[int] | None = None,
+):
+    expr = None
+    parts = []
+    if codes is not None:
+        parts.append(pc.field("ts_code").isin(codes))
+    if start is not None:
+        parts.append(pc.field(date_col) >= pa.scalar(start.date(), pa.date32()))
+    if end is not None:
+        parts.append(pc.field(date_col) <= pa.scalar(end.date(), pa.date32()))
+    if dates is not None:
+        parts.append(pc.field(date_col).isin(pa.array([d.date() for d in dates])))
+    if adjust is not None:
+        parts.append(pc.field("adjust").isin(adjust))
+    if items is not None:
+        parts.append(pc.field("item_id").isin(items))
+    for part in parts:
+        expr = part if expr is None else expr & part
+    return expr
+
+
+def _filter_frame(
+    df: pd.DataFrame,
+    codes: list[str] | None,
+    date_col: str,
+    start=None,
+    end=None,
+    dates: list[pd.Timestamp] | None = None,
+    adjust: list[str] | None = None,
+    items: list[int] | None = None,
+) -> pd.DataFrame:
+    mask = pd.Series(True, index=df.index)
+    if codes is not None:
+        mask &= df["ts_code"].astype(str).isin(codes)
+    if start is not None:
+        mask &= df[date_col] >= start
+    if end is not None:
+        mask &= df[date_col] <= end
+    if dates is not None:
+        mask &= df[date_col].isin(dates)
+    if adjust is not None:
+        mask &= df["adjust"].astype(str).isin(adjust)
+    if items is not None:
+        mask &= df["item_id"].isin(items)
+    return df[mask]
+
+
+def _scan(
+    files: list[Path],
+    dataset: str,
+    date_col: str,
+    keys: list[str],
+    columns: list[str] | None,
+    **filters,
+) -> pd.DataFrame:
+    read_cols = None
+    if columns is not None:
+        read_cols = list(dict.fromkeys([*keys, *columns]))
+    frames = []
+    codes = filters.get("codes")
+    located = lookup(files, codes) if codes is not None else {}
+    for path in files:
+        groups = located.get(path)
+        if groups is not None and not groups:
+            continue
+        if _is_typed(path, date_col):
+            expr = _filter_expr(date_col=date_col, **filters)
+            if groups is not None:
+                parquet = pq.ParquetFile(path)
+                names = parquet.schema_arrow.names
+                cols = [c for c in read_cols if c in names] if read_cols else None
+                table = parquet.read_row_groups(groups, columns=cols).filter(expr)
+            else:
+                fragment = pds.dataset(path, format="parquet")
+                names = fragment.schema.names
+                cols = [c for c in read_cols if c in names] if read_cols else None
+                table = fragment.to_table(columns=cols, filter=expr)
+            frames.append(_restore_types(table, dataset).to_pandas(date_as_object=False))
+        else:
+            legacy = conform(pd.read_parquet(path), dataset)
+            legacy = _filter_frame(legacy, date_col=date_col, **filters)
+            if read_cols:
+                legacy = legacy[[c for c in read_cols if c in legacy.columns]]
+            frames.append(legacy)
+    frames = [f for f in frames if not f.empty]
+    if not frames:
+        names = read_cols or list(SCHEMAS[dataset].names)
+        return pd.DataFrame(columns=names)
+    data = pd.concat(frames, ignore_index=True)
+    if len(files) > 1:
+        data = data.drop_duplicates(subset=keys, keep="last")
+    data = data.sort_values(keys, ignore_index=True)
+    if columns is not None:
+        data = data[columns]
+    return data
+
+
+def _yearly_files(base_dir: Path, years: list[str] | None = None) -> list[Path]:
+    if not base_dir.exists():
+        return []
+    files = sorted(base_dir.glob("[0-9][0-9][0-9][0-9].parquet"))
+    if years is None:
+        return files
+    return [path for path in files if path.stem in years]
+
+
+def load_adj_factors(
+    cfg: AppConfig, codes: Iterable[str] | str | None = None
+) -> pd.DataFrame:
+    code_list = _as_list(codes)
+    files = _yearly_files(cfg.adj_factor_dir)
+    key = (
+        "adj_factor",
+        tuple(code_list) if code_list is not None else None,
+        _signature(files),
+    )
+    cache = _cache(cfg)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+    data = _scan(files, "adj_factor", "trade_date", ADJ_FACTOR_KEYS, None, codes=code_list)
+    cache.put(key, data)
+    return _detach(data)
+
+
+def _derive_adjusted(
+    cfg: AppConfig,
+    data: pd.DataFrame,
+    stored: list[str],
+    derived: list[str],
+    columns: list[str] | None,
+) -> pd.DataFrame:
+    raw = data[data["adjust"].astype(str) == "none"]
+    factors = load_adj_factors(cfg, sorted(raw["ts_code"].astype(str).unique()))
+    frames = [data[data["adjust"].astype(str).isin(stored)]]
+    frames += [apply_factors(raw, factors, how) for how in derived]
+    frames = [frame for frame in frames if not frame.empty]
+    if not frames:
+        return data.iloc[0:0]
+    result = pd.concat(frames, ignore_index=True)
+    result["adjust"] = result["adjust"].astype(str).astype("category")
+    result = result.sort_values(PRICE_KEYS, ignore_index=True)
+    if columns is not None:
+        result = result[columns]
+    return result
+
+
+def load_prices(
+    cfg: AppConfig,
+    codes: Iterable[str] | str | None = None,
+    start=None,
+    end=None,
+    adjust: Iterable[str] | str | None = "none",
+    columns: list[str] | None = None,
+) -> pd.DataFrame:
+    code_list = _as_list(codes)
+    adjust_list = _as_list(adjust)
+    start_ts = _as_date(start)
+    end_ts = _as_date(end)
+    years = _years_between(partition_years(cfg.price_dir), start_ts, end_ts)
+    files = [path for year in years for path in partition_snapshot(cfg.price_dir, year)]
+    factor_files = _yearly_files(cfg.adj_factor_dir)
+    key = (
+        "price_daily",
+        tuple(code_list) if code_list is not None else None,
+        start_ts,
+        end_ts,
+        tuple(adjust_list) if adjust_list is not None else None,
+        tuple(columns) if columns is not None else None,
+        _signature(files),
+        _signature(factor_files),
+    )
+    cache = _cache(cfg)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+    derived: list[str] = []
+    read_adjust = adjust_list
+    read_columns = columns
+    if adjust_list is not None and factor_files:
+        derived = [a for a in adjust_list if a in DERIVED_ADJUSTS]
+    if derived:
+        read_adjust = sorted({"none", *adjust_list} - set(derived))
+        if columns is not None:
+            read_columns = list(dict.fromkeys([*PRICE_KEYS, *columns]))
+    data = _scan(
+        files,
+        "price_daily",
+        "trade_date",
+        PRICE_KEYS,
+        read_columns,
+        codes=code_list,
+        start=start_ts,
+        end=end_ts,
+        adjust=read_adjust,
+    )
+    if derived:
+        stored = [a for a in adjust_list if a not in DERIVED_ADJUSTS]
+        data = _derive_adjusted(cfg, data, stored, derived, columns)
+    cache.put(key, data)
+    return _detach(data)
+
+
+def load_factors(
+    cfg: AppConfig,
+    codes: Iterable[str] | str | None = None,
+    start=None,
+    end=None,
+    columns: list[str] | None = None,
+) -> pd.DataFrame:
+    code_list = _as_list(codes)
+    start_ts = _as_date(start)
+    end_ts = _as_date(end)
+    base_dir = cfg.dataset_dir("factor_daily")
+    years = _years_between(partition_years(base_dir), start_ts, end_ts)
+    files = [path for year in years for path in partition_snapshot(base_dir, year)]
+    key = (
+        "factor_daily",
+        tuple(code_list) if code_list is not None else None,
+        start_ts,
+        end_ts,
+        tuple(columns) if columns is not None else None,
+        _signature(files),
+    )
+    cache = _cache(cfg)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+    data = _scan(
+        files,
+        "factor_daily",
+        "trade_date",
+        FACTOR_KEYS,
+        columns,
+        codes=code_list,
+        start=start_ts,
+        end=end_ts,
+    )
+    cache.put(key, data)
+    return _detach(data)
+
+
+def financial_items(cfg: AppConfig, dataset: str) -> dict[str, int]:
+    if not cfg.sqlite_path.exists():
+        return {}
+    conn = init_sqlite(cfg.sqlite_path)
+    try:
+        return get_items(conn, dataset)
+    finally:
+        conn.close()
+
+
+def load_financials(
+    cfg: AppConfig,
+    dataset: str,
+    codes: Iterable[str] | str | None = None,
+    periods: Iterable[str] | str | None = None,
+    columns: list[str] | None = None,
+) -> pd.DataFrame:
+    code_list = _as_list(codes)
+    period_list = _as_list(periods)
+    dates = [_as_date(p) for p in period_list] if period_list is not None else None
+    years = sorted({str(d.year) for d in dates}) if dates is not None else None
+    files = _yearly_files(cfg.dataset_dir(dataset), years)
+    key = (
+        dataset,
+        tuple(code_list) if code_list is not None else None,
+        tuple(dates) if dates is not None else None,
+        tuple(columns) if columns is not None else None,
+        _signature(files),
+    )
+    cache = _cache(cfg)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+    long_files = [path for path in files if is_long_file(path)]
+    wide_files = [path for path in files if path not in long_files]
+    items = financial_items(cfg, dataset)
+    wanted = None
+    item_ids = None
+    if columns is not None:
+        wanted = [c for c in columns if c not in FINANCIAL_KEYS]
+        item_ids = sorted({items[c] for c in wanted if c in items})
+    frames = []
+    if long_files:
+        long = _scan(
+            long_files,
+            dataset,
+            "end_date",
+            FINANCIAL_ITEM_KEYS,
+            None,
+            codes=code_list,
+            dates=dates,
+            items=item_ids,
+        )
+        names = {item_id: name for name, item_id in items.items()}
+        frames.append(pivot_wide(long, names, wanted))
+    if wide_files:
+        frames.append(
+            _scan(
+                wide_files,
+                FINANCIAL_WIDE,
+                "end_date",
+                FINANCIAL_KEYS,
+                None,
+                codes=code_list,
+                dates=dates,
+            )
+        )
+    frames = [frame for frame in frames if not frame.empty]
+    if not frames:
+        data = pivot_wide(pd.DataFrame(), {}, wanted)
+    elif len(frames) == 1:
+        data = frames[0]
+    else:
+        data = pd.concat(frames, ignore_index=True)
+        data["ts_code"] = data["ts_code"].astype(str).astype("category")
+        data = data.drop_duplicates(subset=FINANCIAL_KEYS, keep="last")
+        data = data.sort_values(FINANCIAL_KEYS, ignore_index=True)
+    if columns is not None:
+        data = data.reindex(columns=columns)
+    cache.put(key, data)
+    return _detach(data)
+
+
+def read_financial_file(cfg: AppConfig, dataset: str, path: Path) -> pd.DataFrame:
+    if not is_long_file(path):
+        return conform(pd.read_parquet(path), FINANCIAL_WIDE)
+    long = _scan([path], dataset, "end_date", FINANCIAL_ITEM_KEYS, None, codes=None)
+    items = financial_items(cfg, dataset)
+    return pivot_wide(long, {item_id: name for name, item_id in items.items()})
@@ -0,0 +1,219 @@
+from __future__ import annotations
+
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import copy
+import logging
+import threading
+import time
+from typing import Callable
+
+from . import metrics
+from .config import AppConfig
+
+logger = logging.getLogger(__name__)
+
+LATENCY_WINDOW = 200
+
+
+class CircuitBreaker:
+    def __init__(self, failures: int, reset_after: float) -> None:
+        self.failures = failures
+        self.reset_after = reset_after
+        self._errors = 0
+        self._opened_at: float | None = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            return "half_open" if self._probing else "open"
+
+    def ready(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            return (
+                not self._probing
+                and time.monotonic() - self._opened_at >= self.reset_after
+            )
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._probing or time.monotonic() - self._opened_at < self.reset_after:
+                return False
+            self._probing = True
+            return True
+
+    def retry_in(self) -> float:
+        with self._lock:
+            if self._opened_at is None:
+                return 0.0
+            return max(0.0, self.reset_after - (time.monotonic() - self._opened_at))
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._errors = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self) -> bool:
+        with self._lock:
+            self._errors += 1
+            if self._probing or (
+                self._opened_at is None and self._errors >= self.failures
+            ):
+                self._opened_at = time.monotonic()
+                self._probing = False
+                return True
+            return False
+
+
+class BackendStats:
+    def __init__(self) -> None:
+        self.latencies: deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self.calls = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def record(self, latency: float, ok: bool) -> None:
+        with self._lock:
+            self.calls += 1
+            if ok:
+                self.latencies.append(latency)
+            else:
+                self.errors += 1
+
+    def quantile(self, q: float, min_samples: int) -> float | None:
+        with self._lock:
+            if len(self.latencies) < min_samples:
+                return None
+            ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def error_rate(self) -> float:
+        with self._lock:
+            return self.errors / self.calls if self.calls else 0.0
+
+
+_hedge_pool: ThreadPoolExecutor | None = None
+_hedge_lock = threading.Lock()
+
+
+def _pool(cfg: AppConfig) -> ThreadPoolExecutor:
+    global _hedge_pool
+    with _hedge_lock:
+        if _hedge_pool is None:
+            _hedge_pool = ThreadPoolExecutor(
+                max_workers=cfg.fetch_workers * 2, thread_name_prefix="hedge"
+            )
+        return _hedge_pool
+
+
+class SourceRouter:
+    def __init__(
+        self, cfg: AppConfig, kind: str, backends: dict[str, Callable], order: list[str]
+    ) -> None:
+        unknown = [name for name in order if name not in backends]
+        if unknown:
+            raise ValueError(f"unknown {kind} source(s): {', '.join(unknown)}")
+        self.cfg = cfg
+        self.kind = kind
+        self.order = list(dict.fromkeys(order))
+        self.backends = backends
+        self.breakers = {
+            name: CircuitBreaker(cfg.breaker_failures, cfg.breaker_reset)
+            for name in self.order
+        }
+        self.stats = {name: BackendStats() for name in self.order}
+        self._backend_cfg = cfg
+        if len(self.order) > 1:
+            self._backend_cfg = copy.copy(cfg)
+            self._backend_cfg.max_retries = min(cfg.max_retries, cfg.failover_retries)
+
+    def _available(self) -> list[str]:
+        if len(self.order) == 1:
+            return list(self.order)
+        while True:
+            names = [name for name in self.order if self.breakers[name].ready()]
+            if names:
+                return names
+            delay = min(self.breakers[name].retry_in() for name in self.order)
+            logger.warning("%s: all sources open, waiting %.1fs", self.kind, delay)
+            time.sleep(max(delay, 0.05))
+
+    def _attempt(self, name: str, args: tuple):
+        started = time.perf_counter()
+        try:
+            result = self.backends[name](self._backend_cfg, *args)
+        except Exception:
+            elapsed = time.perf_counter() - started
+            self.stats[name].record(elapsed, ok=False)
+            metrics.inc("router_requests_total", kind=self.kind, source=name, outcome="error")
+            if len(self.order) > 1 and self.breakers[name].record_failure():
+                logger.warning(
+                    "%s: circuit opened for %s (error rate %.0f%%)",
+                    self.kind,
+                    name,
+                    self.stats[name].error_rate() * 100,
+                )
+                metrics.inc("router_breaker_opened_total", kind=self.kind, source=name)
+            raise
+        elapsed = time.perf_counter() - started
+        self.stats[name].record(elapsed, ok=True)
+        self.breakers[name].record_success()
+        metrics.inc("router_requests_total", kind=self.kind, source=name, outcome="ok")
+        return result
+
+    def _hedged(self, primary: str, backup: str | None, args: tuple, tried: set[str]):
+        tried.add(primary)
+        delay = None
+        if self.cfg.hedge_requests and backup is not None:
+            delay = self.stats[primary].quantile(
+                self.cfg.hedge_quantile, self.cfg.hedge_min_samples
+            )
+        if delay is None:
+            return self._attempt(primary, args)
+        pool = _pool(self.cfg)
+        first = pool.submit(self._attempt, primary, args)
+        done, _ = wait([first], timeout=delay)
+        if done or not self.breakers[backup].allow():
+            return first.result()
+        tried.add(backup)
+        metrics.inc("router_hedges_total", kind=self.kind, source=backup)
+        pending = {first, pool.submit(self._attempt, backup, args)}
+        error: Exception | None = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    return future.result()
+                except Exception as exc:
+                    error = exc
+        raise error
+
+    def call(self, *args):
+        tried: set[str] = set()
+        error: Exception | None = None
+        while error is None:
+            names = self._available()
+            for idx, name in enumerate(names):
+                if name in tried or not self.breakers[name].allow():
+                    continue
+                rest = [n for n in names[idx + 1 :] if n not in tried]
+                backup = rest[0] if rest else None
+                try:
+                    return self._hedged(name, backup, args, tried)
+                except Exception as exc:
+                    error = exc
+                    if backup is not None:
+                        logger.info(
+                            "%s: %s failed (%s), failing over", self.kind, name, exc
+                        )
+                        metrics.inc("router_failovers_total", kind=self.kind, source=name)
+        raise error
@@ -0,0 +1,168 @@
+from __future__ import annotations
+
+import pandas as pd
+import pyarrow as pa
+
+KEY_TYPE = pa.dictionary(pa.int32(), pa.string())
+FINANCIAL_DATASETS = (
+    "balance_sheet",
+    "income_statement",
+    "cashflow_statement",
+    "fina_indicator",
+)
+PRICE_KEYS = ["ts_code", "trade_date", "adjust"]
+FINANCIAL_KEYS = ["ts_code", "end_date"]
+FACTOR_KEYS = ["ts_code", "trade_date"]
+FINANCIAL_ITEM_KEYS = ["ts_code", "end_date", "item_id"]
+FINANCIAL_WIDE = "financial_wide"
+STRICT_DATASETS = ("price_daily", "stock_basic", "adj_factor", *FINANCIAL_DATASETS)
+NULL_TOKENS = ["", "--", "-", "nan", "NaN", "None", "null"]
+
+PRICE_SCHEMA = pa.schema(
+    [
+        ("ts_code", KEY_TYPE),
+        ("trade_date", pa.date32()),
+        ("adjust", KEY_TYPE),
+        ("open", pa.float32()),
+        ("high", pa.float32()),
+        ("low", pa.float32()),
+        ("close", pa.float32()),
+        ("pre_close", pa.float32()),
+        ("change", pa.float32()),
+        ("pct_chg", pa.float32()),
+        ("volume", pa.int64()),
+        ("amount", pa.float64()),
+        ("amplitude", pa.float32()),
+        ("turnover", pa.float32()),
+    ]
+)
+
+STOCK_BASIC_SCHEMA = pa.schema(
+    [
+        ("ts_code", KEY_TYPE),
+        ("symbol", pa.string()),
+        ("name", pa.string()),
+        ("exchange", KEY_TYPE),
+        ("market", KEY_TYPE),
+    ]
+)
+
+FINANCIAL_KEY_SCHEMA = pa.schema([("ts_code", KEY_TYPE), ("end_date", pa.date32())])
+
+FINANCIAL_LONG_SCHEMA = pa.schema(
+    [
+        ("ts_code", KEY_TYPE),
+        ("end_date", pa.date32()),
+        ("item_id", pa.int32()),
+        ("value", pa.float64()),
+        ("text", pa.string()),
+    ]
+)
+
+ADJ_FACTOR_SCHEMA = pa.schema(
+    [
+        ("ts_code", KEY_TYPE),
+        ("trade_date", pa.date32()),
+        ("adj_factor", pa.float64()),
+    ]
+)
+
+PIT_KEY_SCHEMA = pa.schema(
+    [
+        ("ts_code", KEY_TYPE),
+        ("trade_date", pa.date32()),
+        ("end_date", pa.date32()),
+        ("ann_date", pa.date32()),
+    ]
+)
+
+SCHEMAS = {
+    "price_daily": PRICE_SCHEMA,
+    "stock_basic": STOCK_BASIC_SCHEMA,
+    "adj_factor": ADJ_FACTOR_SCHEMA,
+    FINANCIAL_WIDE: FINANCIAL_KEY_SCHEMA,
+    "factor_daily": pa.schema([("ts_code", KEY_TYPE), ("trade_date", pa.date32())]),
+}
+for _name in FINANCIAL_DATASETS:
+    SCHEMAS[_name] = FINANCIAL_LONG_SCHEMA
+    SCHEMAS[f"pit_{_name}"] = PIT_KEY_SCHEMA
+    SCHEMAS[f"{_name}_revisions"] = FINANCIAL_KEY_SCHEMA
+
+
+def normalize_dates(values: pd.Series) -> pd.Series:
+    text = values.astype(str).str.strip()
+    return text.str.replace(r"[-/.]", "", regex=True).str.slice(0, 8)
+
+
+def parse_dates(values: pd.Series) -> pd.Series:
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values.astype("datetime64[ms]")
+    parsed = pd.to_datetime(normalize_dates(values), format="%Y%m%d", errors="coerce")
+    return parsed.astype("datetime64[ms]")
+
+
+def format_dates(values: pd.Series) -> pd.Series:
+    return parse_dates(values).dt.strftime("%Y%m%d")
+
+
+def _coerce_numeric(values: pd.Series) -> pd.Series:
+    if pd.api.types.is_numeric_dtype(values) or pd.api.types.is_bool_dtype(values):
+        return values
+    present = values.notna() & ~values.astype(str).str.strip().isin(NULL_TOKENS)
+    numeric = pd.to_numeric(values.where(present), errors="coerce")
+    if numeric[present].notna().all():
+        return numeric.astype("float64")
+    return values.where(present).astype("string")
+
+
+def _cast_column(values: pd.Series, dtype: pa.DataType) -> pd.Series:
+    if pa.types.is_date(dtype):
+        return parse_dates(values)
+    if pa.types.is_dictionary(dtype):
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            return values
+        return values.astype("string").astype("category")
+    if pa.types.is_integer(dtype):
+        return pd.to_numeric(values, errors="coerce").round().astype("Int64")
+    if pa.types.is_floating(dtype):
+        numeric = pd.to_numeric(values, errors="coerce")
+        return numeric.astype("float32" if dtype == pa.float32() else "float64")
+    return values.astype("string")
+
+
+def conform(df: pd.DataFrame, dataset: str) -> pd.DataFrame:
+    schema = SCHEMAS.get(dataset)
+    data = df.copy()
+    declared = set()
+    if schema is not None:
+        for field in schema:
+            declared.add(field.name)
+            if field.name in data.columns:
+                data[field.name] = _cast_column(data[field.name], field.type)
+            else:
+                data[field.name] = _cast_column(
+                    pd.Series(pd.NA, index=data.index, dtype="object"), field.type
+                )
+    if dataset in STRICT_DATASETS:
+        return data[schema.names]
+    for col in data.columns:
+        if col not in declared:
+            data[col] = _coerce_numeric(data[col])
+    return data
+
+
+def to_table(df: pd.DataFrame, dataset: str) -> pa.Table:
+    data = conform(df, dataset)
+    schema = SCHEMAS.get(dataset)
+    if dataset in STRICT_DATASETS:
+        table = pa.Table.from_pandas(data, schema=schema, preserve_index=False)
+        return table.replace_schema_metadata(None)
+    table = pa.Table.from_pandas(data, preserve_index=False)
+    declared = {field.name: field for field in schema} if schema is not None else {}
+    for idx, field in enumerate(table.schema):
+        target = declared.get(field.name)
+        if target is None and pa.types.is_large_string(field.type):
+            target = pa.field(field.name, pa.string())
+        if target is not None and target.type != field.type:
+            table = table.set_column(idx, target, table.column(idx).cast(target.type))
+    return table.replace_schema_metadata(None)
@@ -0,0 +1,377 @@
+from __future__ import annotations
+
+from datetime import datetime
+import json
+import logging
+import os
+from pathlib import Path
+import signal
+import socket
+import socketserver
+import threading
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from . import metrics
+from .adjust import DERIVED_ADJUSTS
+from .config import AppConfig
+from .reader import (
+    _as_date,
+    _as_list,
+    _filter_expr,
+    _scan,
+    _signature,
+    _years_between,
+    load_prices,
+)
+from .schema import PRICE_KEYS, PRICE_SCHEMA, SCHEMAS, to_table
+from .storage import init_sqlite, partition_snapshot, partition_years, read_table
+
+logger = logging.getLogger(__name__)
+
+COMMANDS = ("status", "reload", "stop")
+REFERENCE_TABLES = {"stock_basic": None, "trade_calendar": "cal_date"}
+SERVED = ("price_daily", *REFERENCE_TABLES)
+
+
+class Resident:
+    def __init__(self, name: str, path: Path, signature, generation: int) -> None:
+        self.name = name
+        self.path = path
+        self.signature = signature
+        self.generation = generation
+        self.table = pa.ipc.open_file(pa.memory_map(str(path))).read_all()
+        self.loaded_at = datetime.now().isoformat(timespec="seconds")
+
+    def describe(self) -> dict:
+        return {
+            "rows": self.table.num_rows,
+            "bytes": self.table.nbytes,
+            "file": str(self.path),
+            "generation": self.generation,
+            "loaded_at": self.loaded_at,
+        }
+
+
+def _write_ipc(table: pa.Table, path: Path) -> None:
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with pa.OSFile(str(tmp), "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    os.replace(tmp, path)
+
+
+def _table_signature(df: pd.DataFrame) -> int:
+    return int(pd.util.hash_pandas_object(df, index=False).sum())
+
+
+def _reference_table(df: pd.DataFrame, name: str) -> pa.Table:
+    if name in SCHEMAS:
+        return to_table(df, name)
+    return pa.Table.from_pandas(df, preserve_index=False).replace_schema_metadata(None)
+
+
+def _date_bound(table: pa.Table, column: str, value: pd.Timestamp):
+    if pa.types.is_date32(table.schema.field(column).type):
+        return pa.scalar(value.date(), pa.date32())
+    return value.strftime("%Y%m%d")
+
+
+def _sort_keys(table: pa.Table, keys: list[str]) -> pa.Table:
+    decoded = {}
+    for key in keys:
+        column = table.column(key)
+        if pa.types.is_dictionary(column.type):
+            column = column.cast(column.type.value_type)
+        decoded[key] = column
+    order = pc.sort_indices(pa.table(decoded), [(key, "ascending") for key in keys])
+    return table.take(order)
+
+
+def _filter_reference(table: pa.Table, date_col: str | None, request: dict) -> pa.Table:
+    expr = None
+    codes = _as_list(request.get("codes"))
+    if codes is not None and "ts_code" in table.column_names:
+        expr = pc.field("ts_code").isin(codes)
+    for bound, op in (("start", "__ge__"), ("end", "__le__")):
+        value = _as_date(request.get(bound))
+        if value is None or date_col is None:
+            continue
+        part = getattr(pc.field(date_col), op)(_date_bound(table, date_col, value))
+        expr = part if expr is None else expr & part
+    return table.filter(expr) if expr is not None else table
+
+
+class _QueryServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str, store: "ArrowServer") -> None:
+        self.store = store
+        super().__init__(path, _QueryHandler)
+
+
+class _QueryHandler(socketserver.StreamRequestHandler):
+    def _reply(self, header: dict) -> None:
+        self.wfile.write((json.dumps(header, default=str) + "\n").encode("utf-8"))
+
+    def handle(self) -> None:
+        line = self.rfile.readline().decode("utf-8").strip()
+        try:
+            request = json.loads(line) if line.startswith("{") else {"command": line}
+            command = request.get("command", "query")
+            metrics.inc("serve_requests_total", command=command)
+            if command != "query":
+                self._reply(self.server.store.handle(request))
+                return
+            table = self.server.store.query(request)
+        except Exception as exc:
+            self._reply({"ok": False, "error": str(exc)})
+            return
+        self._reply({"ok": True, "rows": table.num_rows, "bytes": table.nbytes})
+        with pa.ipc.new_stream(self.wfile, table.schema) as writer:
+            writer.write_table(table)
+        metrics.inc("serve_bytes_total", table.nbytes)
+
+
+class ArrowServer:
+    def __init__(self, cfg: AppConfig) -> None:
+        self.cfg = cfg
+        self.tables: dict[str, Resident] = {}
+        self._retired: dict[str, Resident] = {}
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._generation = 0
+        self._server: _QueryServer | None = None
+
+    def _install(self, name: str, table: pa.Table, signature) -> None:
+        self._generation += 1
+        path = self.cfg.serve_dir / f"{name}.{self._generation}.arrow"
+        _write_ipc(table, path)
+        resident = Resident(name, path, signature, self._generation)
+        with self._lock:
+            old = self.tables.get(name)
+            self.tables[name] = resident
+        if old is not None:
+            stale = self._retired.pop(name, None)
+            if stale is not None:
+                stale.path.unlink(missing_ok=True)
+            self._retired[name] = old
+        metrics.inc("serve_reloads_total", table=name.split("-")[0])
+        logger.info("serve: loaded %s (%d rows)", name, table.num_rows)
+
+    def _evict(self, name: str) -> None:
+        with self._lock:
+            old = self.tables.pop(name, None)
+        for resident in (old, self._retired.pop(name, None)):
+            if resident is not None:
+                resident.path.unlink(missing_ok=True)
+
+    def _hot_years(self) -> list[str]:
+        years = partition_years(self.cfg.price_dir)
+        return years[-self.cfg.serve_years :] if self.cfg.serve_years > 0 else []
+
+    def refresh(self) -> list[str]:
+        reloaded = []
+        with self._refresh_lock, metrics.timer("serve_refresh"):
+            hot = self._hot_years()
+            for year in hot:
+                name = f"price_daily-{year}"
+                files = partition_snapshot(self.cfg.price_dir, year)
+                signature = _signature(files)
+                current = self.tables.get(name)
+                if current is not None and current.signature == signature:
+                    continue
+                data = _scan(files, "price_daily", "trade_date", PRICE_KEYS, None, codes=None)
+                self._install(name, to_table(data, "price_daily"), signature)
+                reloaded.append(name)
+            for name in [n for n in self.tables if n.startswith("price_daily-")]:
+                if name.split("-", 1)[1] not in hot:
+                    self._evict(name)
+            if self.cfg.sqlite_path.exists():
+                conn = init_sqlite(self.cfg.sqlite_path)
+                try:
+                    for name in REFERENCE_TABLES:
+                        try:
+                            df = read_table(conn, name)
+                        except Exception:
+                            continue
+                        signature = _table_signature(df)
+                        current = self.tables.get(name)
+                        if current is None or current.signature != signature:
+                            self._install(name, _reference_table(df, name), signature)
+                            reloaded.append(name)
+                finally:
+                    conn.close()
+        return reloaded
+
+    def _resident(self, names: list[str]) -> list[pa.Table] | None:
+        with self._lock:
+            found = [self.tables.get(name) for name in names]
+        if any(resident is None for resident in found):
+            return None
+        return [resident.table for resident in found]
+
+    def query(self, request: dict) -> pa.Table:
+        dataset = request.get("dataset")
+        if dataset not in SERVED:
+            raise ValueError(f"dataset {dataset!r} is not served, expected one of {SERVED}")
+        columns = request.get("columns")
+        with metrics.timer("serve_query", dataset=dataset):
+            if dataset in REFERENCE_TABLES:
+                tables = self._resident([dataset])
+                if tables is None:
+                    raise ValueError(f"{dataset} is not loaded")
+                table = _filter_reference(tables[0], REFERENCE_TABLES[dataset], request)
+            else:
+                table = self._query_prices(request)
+            if columns is not None:
+                table = table.select(columns)
+        return table
+
+    def _query_prices(self, request: dict) -> pa.Table:
+        codes = _as_list(request.get("codes"))
+        adjust = request.get("adjust", "none")
+        adjust_list = _as_list(adjust)
+        start = _as_date(request.get("start"))
+        end = _as_date(request.get("end"))
+        years = _years_between(partition_years(self.cfg.price_dir), start, end)
+        tables = self._resident([f"price_daily-{year}" for year in years])
+        derived = adjust_list is not None and any(a in DERIVED_ADJUSTS for a in adjust_list)
+        if tables is None or derived:
+            metrics.inc("serve_queries_total", path="cold")
+            data = load_prices(self.cfg, codes=codes, start=start, end=end, adjust=adjust)
+            return to_table(data, "price_daily")
+        metrics.inc("serve_queries_total", path="resident")
+        if not tables:
+            return PRICE_SCHEMA.empty_table()
+        expr = _filter_expr(codes, "trade_date", start, end, adjust=adjust_list)
+        parts = [table.filter(expr) if expr is not None else table for table in tables]
+        table = pa.concat_tables(parts) if len(parts) > 1 else parts[0]
+        if len(parts) > 1:
+            table = _sort_keys(table, PRICE_KEYS)
+        return table
+
+    def handle(self, request: dict) -> dict:
+        command = request.get("command")
+        if command not in COMMANDS:
+            raise ValueError(f"unknown command {command!r}, expected one of {COMMANDS}")
+        reply: dict = {"ok": True}
+        if command == "reload":
+            reply["reloaded"] = self.refresh()
+        elif command == "stop":
+            self.stop()
+        with self._lock:
+            reply["tables"] = {name: r.describe() for name, r in sorted(self.tables.items())}
+        return reply
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+
+    def _start_server(self) -> None:
+        path = self.cfg.serve_socket
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if path.exists():
+            try:
+                send(self.cfg, "status")
+            except OSError:
+                path.unlink()
+            else:
+                raise RuntimeError(f"server already running on {path}")
+        self._server = _QueryServer(str(path), self)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def serve_forever(self) -> None:
+        self.cfg.serve_dir.mkdir(parents=True, exist_ok=True)
+        self.refresh()
+        self._start_server()
+        signal.signal(signal.SIGTERM, lambda *_: self.stop())
+        logger.info("serve: listening on %s", self.cfg.serve_socket)
+        try:
+            while not self._stop.is_set():
+                self._wake.wait(self.cfg.serve_poll)
+                self._wake.clear()
+                if self._stop.is_set():
+                    break
+                try:
+                    self.refresh()
+                except Exception:
+                    logger.exception("serve: refresh failed")
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._server.shutdown()
+            self._server.server_close()
+            self.cfg.serve_socket.unlink(missing_ok=True)
+            for name in list(self.tables):
+                self._evict(name)
+            try:
+                self.cfg.serve_dir.rmdir()
+            except OSError:
+                pass
+            logger.info("serve: stopped")
+
+
+def _request(cfg: AppConfig, request: dict):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(str(cfg.serve_socket))
+    sock.sendall((json.dumps(request, default=str) + "\n").encode("utf-8"))
+    stream = sock.makefile("rb")
+    header = json.loads(stream.readline().decode("utf-8"))
+    return sock, stream, header
+
+
+def send(cfg: AppConfig, command: str) -> dict:
+    sock, stream, header = _request(cfg, {"command": command})
+    with sock, stream:
+        return header
+
+
+def query(
+    cfg: AppConfig,
+    dataset: str,
+    codes=None,
+    start=None,
+    end=None,
+    adjust="none",
+    columns: list[str] | None = None,
+) -> pa.Table:
+    request = {
+        "command": "query",
+        "dataset": dataset,
+        "codes": _as_list(codes),
+        "start": start,
+        "end": end,
+        "adjust": adjust,
+        "columns": columns,
+    }
+    sock, stream, header = _request(cfg, request)
+    with sock, stream:
+        if not header.get("ok"):
+            raise RuntimeError(header.get("error"))
+        return pa.ipc.open_stream(stream).read_all()
+
+
+def attach(cfg: AppConfig, dataset: str) -> pa.Table:
+    tables = send(cfg, "status")["tables"]
+    files = [
+        info["file"]
+        for name, info in sorted(tables.items())
+        if name == dataset or name.startswith(f"{dataset}-")
+    ]
+    if not files:
+        raise ValueError(f"{dataset} is not resident")
+    parts = [pa.ipc.open_file(pa.memory_map(path)).read_all() for path in files]
+    return pa.concat_tables(parts) if len(parts) > 1 else parts[0]
+
+
+def notify_reload(cfg: AppConfig) -> None:
+    if not cfg.serve_socket.exists():
+        return
+    try:
+        send(cfg, "reload")
+    except OSError as exc:
+        logger.debug("serve: reload notification failed: %s", exc)
@@ -0,0 +1,208 @@
+from __future__ import annotations
+
+import copy
+from datetime import datetime
+import logging
+from pathlib import Path
+import re
+import zlib
+
+import pandas as pd
+
+from .adjust import ADJ_FACTOR_KEYS
+from .changes import REVISION_KEYS, revisions_dataset
+from .config import AppConfig
+from .financials import LongFinancialWriter
+from .reader import read_financial_file
+from .schema import FINANCIAL_DATASETS, FINANCIAL_ITEM_KEYS, FINANCIAL_KEYS, PRICE_KEYS
+from .storage import (
+    BufferedDatasetWriter,
+    add_revisions,
+    compact_partitions,
+    get_last_date,
+    get_revisions,
+    get_row_hashes,
+    get_watermarks,
+    init_sqlite,
+    partition_years,
+    read_parquet_frame,
+    read_partition,
+    read_table,
+    replace_table,
+    set_last_date,
+    set_row_hashes,
+    set_watermarks,
+)
+
+logger = logging.getLogger(__name__)
+
+SHARD_DIR_PATTERN = re.compile(r"^(\d+)-of-(\d+)$")
+
+
+def parse_shard(text: str) -> tuple[int, int]:
+    match = re.fullmatch(r"(\d+)/(\d+)", text.strip())
+    if not match:
+        raise ValueError(f"shard must look like i/N, got {text!r}")
+    index, count = int(match.group(1)), int(match.group(2))
+    if count < 1 or index >= count:
+        raise ValueError(f"shard index must be in [0, {count}), got {index}")
+    return index, count
+
+
+def shard_of(ts_code: str, count: int) -> int:
+    return zlib.crc32(str(ts_code).encode("utf-8")) % count
+
+
+def filter_shard(cfg: AppConfig, stocks: pd.DataFrame) -> pd.DataFrame:
+    if cfg.shard is None:
+        return stocks
+    index, count = cfg.shard
+    mask = stocks["ts_code"].astype(str).map(lambda code: shard_of(code, count) == index)
+    return stocks[mask].reset_index(drop=True)
+
+
+def discover_shards(cfg: AppConfig) -> list[Path]:
+    if not cfg.shards_dir.exists():
+        return []
+    return sorted(
+        path
+        for path in cfg.shards_dir.iterdir()
+        if path.is_dir() and SHARD_DIR_PATTERN.match(path.name)
+    )
+
+
+def _shard_config(cfg: AppConfig, data_dir: Path) -> AppConfig:
+    shard_cfg = copy.copy(cfg)
+    shard_cfg.use_data_dir(data_dir)
+    return shard_cfg
+
+
+def _merge_meta(conn, shard_conn, datasets: list[str]) -> None:
+    for table in ("stock_basic", "trade_calendar"):
+        try:
+            incoming = read_table(shard_conn, table)
+        except Exception:
+            continue
+        try:
+            current = read_table(conn, table)
+        except Exception:
+            current = pd.DataFrame()
+        combined = pd.concat([current, incoming], ignore_index=True).drop_duplicates()
+        replace_table(conn, table, combined)
+    now = datetime.now().isoformat(timespec="seconds")
+    with conn:
+        for dataset in datasets:
+            marks = get_watermarks(shard_conn, dataset)
+            set_watermarks(conn, dataset, marks.itertuples(index=False, name=None), commit=False)
+            if dataset in FINANCIAL_DATASETS:
+                add_revisions(conn, dataset, get_revisions(shard_conn, dataset), commit=False)
+                hashes = [
+                    (code, end, digest, now)
+                    for (code, end), digest in get_row_hashes(shard_conn, dataset).items()
+                ]
+                set_row_hashes(conn, dataset, hashes, commit=False)
+            last = get_last_date(shard_conn, dataset)
+            stored = get_last_date(conn, dataset)
+            if last and (not stored or last > stored):
+                set_last_date(conn, dataset, last, commit=False)
+
+
+def _writer(
+    cfg: AppConfig,
+    dataset: str,
+    date_col: str,
+    keys,
+    append_only: bool,
+    replace_on: list[str] | None = None,
+):
+    return BufferedDatasetWriter(
+        cfg.dataset_dir(dataset),
+        date_col,
+        keys,
+        max_rows=cfg.write_buffer_rows,
+        max_bytes=cfg.write_buffer_bytes,
+        append_only=append_only,
+        dataset=dataset,
+        replace_on=replace_on,
+    )
+
+
+def _merge_price(cfg: AppConfig, shard_cfg: AppConfig) -> int:
+    writer = _writer(cfg, "price_daily", "trade_date", PRICE_KEYS, append_only=True)
+    rows = 0
+    for year in partition_years(shard_cfg.price_dir):
+        data = read_partition(shard_cfg.price_dir, year, PRICE_KEYS)
+        writer.add(data)
+        rows += len(data)
+        if writer.should_flush():
+            writer.flush()
+    writer.close()
+    return rows
+
+
+def _merge_yearly(
+    cfg: AppConfig, shard_cfg: AppConfig, dataset: str, date_col: str, keys: list[str]
+) -> int:
+    source = shard_cfg.dataset_dir(dataset)
+    if not source.exists():
+        return 0
+    cfg.dataset_dir(dataset).mkdir(parents=True, exist_ok=True)
+    writer = _writer(cfg, dataset, date_col, keys, append_only=False)
+    rows = 0
+    for path in sorted(source.glob("[0-9][0-9][0-9][0-9].parquet")):
+        data = read_parquet_frame(path)
+        writer.add(data)
+        rows += len(data)
+        if writer.should_flush():
+            writer.flush()
+    writer.close()
+    return rows
+
+
+def _merge_financial(cfg: AppConfig, conn, shard_cfg: AppConfig, dataset: str) -> int:
+    source = shard_cfg.dataset_dir(dataset)
+    if not source.exists():
+        return 0
+    writer = _writer(
+        cfg, dataset, "end_date", FINANCIAL_ITEM_KEYS, False, replace_on=FINANCIAL_KEYS
+    )
+    writer = LongFinancialWriter(conn, writer, dataset)
+    rows = 0
+    for path in sorted(source.glob("[0-9][0-9][0-9][0-9].parquet")):
+        data = read_financial_file(shard_cfg, dataset, path)
+        writer.add(data)
+        rows += len(data)
+        if writer.should_flush():
+            writer.flush()
+    writer.close()
+    return rows
+
+
+def merge_shards(cfg: AppConfig, shard_dirs: list[Path] | None = None) -> dict[str, int]:
+    shard_dirs = shard_dirs if shard_dirs is not None else discover_shards(cfg)
+    datasets = ["price_daily", "adj_factor", *FINANCIAL_DATASETS]
+    totals = {dataset: 0 for dataset in datasets}
+    cfg.ensure_dirs()
+    conn = init_sqlite(cfg.sqlite_path)
+    for shard_dir in shard_dirs:
+        shard_cfg = _shard_config(cfg, shard_dir)
+        if not shard_cfg.sqlite_path.exists():
+            logger.warning("%s: no meta.db, skipping", shard_dir)
+            continue
+        shard_conn = init_sqlite(shard_cfg.sqlite_path)
+        totals["price_daily"] += _merge_price(cfg, shard_cfg)
+        totals["adj_factor"] += _merge_yearly(
+            cfg, shard_cfg, "adj_factor", "trade_date", ADJ_FACTOR_KEYS
+        )
+        for dataset in FINANCIAL_DATASETS:
+            totals[dataset] += _merge_financial(cfg, conn, shard_cfg, dataset)
+            archive = revisions_dataset(dataset)
+            totals[archive] = totals.get(archive, 0) + _merge_yearly(
+                cfg, shard_cfg, archive, "end_date", REVISION_KEYS
+            )
+        _merge_meta(conn, shard_conn, datasets)
+        shard_conn.close()
+        logger.info("merged shard %s", shard_dir)
+    conn.close()
+    compact_partitions(cfg.price_dir, "trade_date", PRICE_KEYS, "price_daily")
+    return totals
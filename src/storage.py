@@ -1,29 +1,202 @@
 from __future__ import annotations
 
+from contextlib import contextmanager
+from datetime import datetime
+import fcntl
+import logging
+import os
+import re
 import sqlite3
 from pathlib import Path
-from typing import Iterable
+from typing import Iterable, Iterator
 
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from . import metrics
+from .locations import drop_files, index_file
+from .schema import conform, to_table
+
+PARQUET_OPTIONS = {
+    "compression": "zstd",
+    "compression_level": 3,
+    "use_dictionary": True,
+    "write_statistics": True,
+    "write_page_index": True,
+    "store_schema": False,
+}
+ROW_GROUP_ROWS = {"price_daily": 32768}
+DEFAULT_ROW_GROUP_ROWS = 16384
+SAMPLE_ROWS = 5
+
+logger = logging.getLogger(__name__)
 
 
 def init_sqlite(db_path: Path) -> sqlite3.Connection:
     db_path.parent.mkdir(parents=True, exist_ok=True)
     conn = sqlite3.connect(db_path)
+    conn.execute("pragma journal_mode=wal")
+    conn.execute("pragma synchronous=normal")
     conn.execute(
         "create table if not exists meta_updates (dataset text primary key, last_date text)"
     )
+    conn.execute(
+        "create table if not exists meta_watermarks ("
+        "dataset text not null, ts_code text not null, last_date text, "
+        "row_count integer, fetched_at text, primary key(dataset, ts_code))"
+    )
+    conn.execute(
+        "create table if not exists meta_row_hashes ("
+        "dataset text not null, ts_code text not null, end_date text not null, "
+        "hash text not null, updated_at text, primary key(dataset, ts_code, end_date))"
+    )
+    conn.execute(
+        "create table if not exists meta_revisions ("
+        "dataset text not null, ts_code text not null, end_date text not null, "
+        "revision integer not null, old_hash text, new_hash text, detected_at text, "
+        "primary key(dataset, ts_code, end_date, revision))"
+    )
+    conn.execute(
+        "create table if not exists meta_items ("
+        "dataset text not null, item_id integer not null, name text not null, "
+        "created_at text, primary key(dataset, item_id), unique(dataset, name))"
+    )
     conn.commit()
     return conn
 
 
-def set_last_date(conn: sqlite3.Connection, dataset: str, last_date: str) -> None:
+def set_last_date(
+    conn: sqlite3.Connection, dataset: str, last_date: str, commit: bool = True
+) -> None:
     conn.execute(
         "insert into meta_updates(dataset, last_date) values(?, ?) "
         "on conflict(dataset) do update set last_date=excluded.last_date",
         (dataset, last_date),
     )
-    conn.commit()
+    if commit:
+        conn.commit()
+
+
+def set_watermarks(
+    conn: sqlite3.Connection,
+    dataset: str,
+    rows: Iterable[tuple[str, str | None, int, str]],
+    commit: bool = True,
+) -> None:
+    conn.executemany(
+        "insert into meta_watermarks(dataset, ts_code, last_date, row_count, fetched_at) "
+        "values(?, ?, ?, ?, ?) "
+        "on conflict(dataset, ts_code) do update set "
+        "last_date=case when excluded.last_date is null then meta_watermarks.last_date "
+        "when meta_watermarks.last_date is null "
+        "or excluded.last_date > meta_watermarks.last_date then excluded.last_date "
+        "else meta_watermarks.last_date end, "
+        "row_count=excluded.row_count, fetched_at=excluded.fetched_at",
+        [(dataset, *row) for row in rows],
+    )
+    if commit:
+        conn.commit()
+
+
+def clear_watermarks(conn: sqlite3.Connection, dataset: str) -> None:
+    with conn:
+        conn.execute("delete from meta_watermarks where dataset = ?", (dataset,))
+        conn.execute("delete from meta_updates where dataset = ?", (dataset,))
+
+
+def get_watermarks(conn: sqlite3.Connection, dataset: str) -> pd.DataFrame:
+    return pd.read_sql_query(
+        "select ts_code, last_date, row_count, fetched_at from meta_watermarks "
+        "where dataset = ?",
+        conn,
+        params=(dataset,),
+    )
+
+
+def get_row_hashes(conn: sqlite3.Connection, dataset: str) -> dict[tuple[str, str], str]:
+    rows = conn.execute(
+        "select ts_code, end_date, hash from meta_row_hashes where dataset = ?",
+        (dataset,),
+    )
+    return {(ts_code, end_date): digest for ts_code, end_date, digest in rows}
+
+
+def set_row_hashes(
+    conn: sqlite3.Connection,
+    dataset: str,
+    rows: Iterable[tuple[str, str, str, str]],
+    commit: bool = True,
+) -> None:
+    conn.executemany(
+        "insert into meta_row_hashes(dataset, ts_code, end_date, hash, updated_at) "
+        "values(?, ?, ?, ?, ?) "
+        "on conflict(dataset, ts_code, end_date) do update set "
+        "hash=excluded.hash, updated_at=excluded.updated_at",
+        [(dataset, *row) for row in rows],
+    )
+    if commit:
+        conn.commit()
+
+
+def add_revisions(
+    conn: sqlite3.Connection,
+    dataset: str,
+    rows: Iterable[tuple[str, str, int, str, str, str]],
+    commit: bool = True,
+) -> None:
+    conn.executemany(
+        "insert or replace into meta_revisions(dataset, ts_code, end_date, revision, "
+        "old_hash, new_hash, detected_at) values(?, ?, ?, ?, ?, ?, ?)",
+        [(dataset, *row) for row in rows],
+    )
+    if commit:
+        conn.commit()
+
+
+def get_revisions(
+    conn: sqlite3.Connection, dataset: str
+) -> list[tuple[str, str, int, str, str, str]]:
+    return conn.execute(
+        "select ts_code, end_date, revision, old_hash, new_hash, detected_at "
+        "from meta_revisions where dataset = ?",
+        (dataset,),
+    ).fetchall()
+
+
+def next_revision(conn: sqlite3.Connection, dataset: str, ts_code: str, end_date: str) -> int:
+    row = conn.execute(
+        "select coalesce(max(revision), 0) from meta_revisions "
+        "where dataset = ? and ts_code = ? and end_date = ?",
+        (dataset, ts_code, end_date),
+    ).fetchone()
+    return int(row[0]) + 1
+
+
+def get_items(conn: sqlite3.Connection, dataset: str) -> dict[str, int]:
+    rows = conn.execute(
+        "select name, item_id from meta_items where dataset = ?", (dataset,)
+    ).fetchall()
+    return {name: int(item_id) for name, item_id in rows}
+
+
+def register_items(
+    conn: sqlite3.Connection, dataset: str, names: Iterable[str]
+) -> dict[str, int]:
+    known = get_items(conn, dataset)
+    missing = [name for name in dict.fromkeys(names) if name not in known]
+    if missing:
+        now = datetime.now().isoformat(timespec="seconds")
+        start = max(known.values(), default=0) + 1
+        rows = [(dataset, start + i, name, now) for i, name in enumerate(missing)]
+        with conn:
+            conn.executemany(
+                "insert into meta_items(dataset, item_id, name, created_at) "
+                "values(?, ?, ?, ?)",
+                rows,
+            )
+        known.update({name: item_id for _, item_id, name, _ in rows})
+    return known
 
 
 def get_last_date(conn: sqlite3.Connection, dataset: str) -> str | None:
@@ -41,25 +214,319 @@ def read_table(conn: sqlite3.Connection, table: str) -> pd.DataFrame:
     return pd.read_sql_query(f"select * from {table}", conn)
 
 
+def read_parquet_frame(path: Path, columns: list[str] | None = None) -> pd.DataFrame:
+    with metrics.timer("parquet_read"):
+        return pq.read_table(path, columns=columns).to_pandas(date_as_object=False)
+
+
+def row_group_rows(dataset: str) -> int:
+    return ROW_GROUP_ROWS.get(dataset, DEFAULT_ROW_GROUP_ROWS)
+
+
+def write_parquet(table, path: Path, dataset: str) -> None:
+    pq.write_table(table, path, row_group_size=row_group_rows(dataset), **PARQUET_OPTIONS)
+
+
+def _write_atomic(df: pd.DataFrame, path: Path, dataset: str) -> None:
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with metrics.timer("parquet_write", dataset=dataset):
+        table = to_table(df, dataset)
+        write_parquet(table, tmp, dataset)
+        os.replace(tmp, path)
+    with metrics.timer("location_index", dataset=dataset):
+        index_file(path, table)
+
+
+def _split_years(
+    df: pd.DataFrame, date_col: str, dataset: str
+) -> Iterator[tuple[str, pd.DataFrame]]:
+    data = conform(df, dataset)
+    invalid = data[date_col].isna()
+    if invalid.any():
+        sample = df.loc[invalid[invalid].index[:SAMPLE_ROWS]]
+        logger.warning(
+            "%s: dropping %d rows with unparseable %s, e.g.\n%s",
+            dataset,
+            int(invalid.sum()),
+            date_col,
+            sample.to_string(),
+        )
+        metrics.inc("invalid_date_rows_total", int(invalid.sum()), dataset=dataset)
+    for year, part in data.groupby(data[date_col].dt.year):
+        yield str(int(year)), part
+
+
+def _merge_frames(
+    frames: list[pd.DataFrame], key_cols: list[str], dataset: str
+) -> pd.DataFrame:
+    with metrics.timer("parquet_merge", dataset=dataset):
+        combined = pd.concat([conform(f, dataset) for f in frames], ignore_index=True)
+        combined = combined.drop_duplicates(subset=key_cols, keep="last")
+        return combined.sort_values(key_cols)
+
+
+def rewrite_sorted(path: Path, key_cols: Iterable[str], dataset: str = "") -> None:
+    data = _merge_frames([read_parquet_frame(path)], list(key_cols), dataset)
+    _write_atomic(data, path, dataset)
+
+
+def _drop_replaced(
+    existing: pd.DataFrame, incoming: pd.DataFrame, replace_on: list[str]
+) -> pd.DataFrame:
+    def _keys(frame: pd.DataFrame) -> pd.MultiIndex:
+        return pd.MultiIndex.from_arrays([frame[c].astype(str) for c in replace_on])
+
+    return existing[~_keys(existing).isin(_keys(incoming))]
+
+
 def upsert_parquet_by_year(
     df: pd.DataFrame,
     base_dir: Path,
     date_col: str,
     key_cols: Iterable[str],
+    dataset: str = "",
+    replace_on: list[str] | None = None,
 ) -> None:
     if df.empty:
         return
-    data = df.copy()
-    data[date_col] = data[date_col].astype(str)
-    data["year"] = data[date_col].str.slice(0, 4)
-    for year, part in data.groupby("year"):
+    keys = list(key_cols)
+    for year, part in _split_years(df, date_col, dataset):
         path = base_dir / f"{year}.parquet"
-        part = part.drop(columns=["year"])
+        frames = []
         if path.exists():
-            existing = pd.read_parquet(path)
-            combined = pd.concat([existing, part], ignore_index=True)
-            combined = combined.drop_duplicates(subset=list(key_cols), keep="last")
+            existing = conform(read_parquet_frame(path), dataset)
+            if replace_on:
+                existing = _drop_replaced(existing, part, replace_on)
+            frames.append(existing)
+        frames.append(part)
+        _write_atomic(_merge_frames(frames, keys, dataset), path, dataset)
+
+
+_BASE_RE = re.compile(r"^base-(\d+)\.parquet$")
+_DELTA_RE = re.compile(r"^delta-(\d+)\.parquet$")
+
+
+def partition_dir(base_dir: Path, year: str) -> Path:
+    return base_dir / f"year={year}"
+
+
+def partition_years(base_dir: Path) -> list[str]:
+    if not base_dir.exists():
+        return []
+    years = {p.name[5:] for p in base_dir.glob("year=*") if p.is_dir()}
+    years.update(p.stem for p in base_dir.glob("[0-9][0-9][0-9][0-9].parquet"))
+    return sorted(years)
+
+
+@contextmanager
+def _partition_lock(part_dir: Path) -> Iterator[None]:
+    part_dir.mkdir(parents=True, exist_ok=True)
+    with open(part_dir / ".lock", "a") as handle:
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+def _scan_partition(part_dir: Path) -> tuple[dict[int, Path], dict[int, Path]]:
+    bases: dict[int, Path] = {}
+    deltas: dict[int, Path] = {}
+    if part_dir.exists():
+        for path in part_dir.iterdir():
+            match = _BASE_RE.match(path.name)
+            if match:
+                bases[int(match.group(1))] = path
+                continue
+            match = _DELTA_RE.match(path.name)
+            if match:
+                deltas[int(match.group(1))] = path
+    return bases, deltas
+
+
+def partition_snapshot(base_dir: Path, year: str) -> list[Path]:
+    bases, deltas = _scan_partition(partition_dir(base_dir, year))
+    files: list[Path] = []
+    base_seq = max(bases) if bases else 0
+    if bases:
+        files.append(bases[base_seq])
+    else:
+        legacy = base_dir / f"{year}.parquet"
+        if legacy.exists():
+            files.append(legacy)
+    files.extend(deltas[seq] for seq in sorted(deltas) if seq > base_seq)
+    return files
+
+
+def read_partition(
+    base_dir: Path, year: str, key_cols: Iterable[str], retries: int = 3
+) -> pd.DataFrame:
+    for attempt in range(retries):
+        files = partition_snapshot(base_dir, year)
+        try:
+            frames = [read_parquet_frame(path) for path in files]
+        except FileNotFoundError:
+            if attempt + 1 >= retries:
+                raise
+            continue
+        if not frames:
+            return pd.DataFrame()
+        data = pd.concat(frames, ignore_index=True)
+        return data.drop_duplicates(subset=list(key_cols), keep="last")
+    return pd.DataFrame()
+
+
+def append_delta_by_year(
+    df: pd.DataFrame,
+    base_dir: Path,
+    date_col: str,
+    key_cols: Iterable[str],
+    dataset: str = "",
+) -> None:
+    if df.empty:
+        return
+    keys = list(key_cols)
+    for year, part in _split_years(df, date_col, dataset):
+        part = _merge_frames([part], keys, dataset)
+        part_dir = partition_dir(base_dir, year)
+        with _partition_lock(part_dir):
+            bases, deltas = _scan_partition(part_dir)
+            seq = max([0, *bases, *deltas]) + 1
+            _write_atomic(part, part_dir / f"delta-{seq:010d}.parquet", dataset)
+
+
+def compact_partitions(
+    base_dir: Path, date_col: str, key_cols: Iterable[str], dataset: str = ""
+) -> dict[str, int]:
+    keys = list(key_cols)
+    merged: dict[str, int] = {}
+    for year in partition_years(base_dir):
+        part_dir = partition_dir(base_dir, year)
+        legacy = base_dir / f"{year}.parquet"
+        with _partition_lock(part_dir):
+            bases, deltas = _scan_partition(part_dir)
+            current = max(bases) if bases else 0
+            stale = [p for seq, p in bases.items() if seq < current]
+            stale += [p for seq, p in deltas.items() if seq <= current]
+            if bases and legacy.exists():
+                stale.append(legacy)
+            for path in stale:
+                path.unlink(missing_ok=True)
+            drop_files(stale)
+            files = partition_snapshot(base_dir, year)
+            top = max([0, *bases, *deltas])
+        pending = [p for p in files if _DELTA_RE.match(p.name)]
+        if not pending and (bases or not legacy.exists()):
+            continue
+        data = _merge_frames([read_parquet_frame(p) for p in files], keys, dataset)
+        _write_atomic(data, part_dir / f"base-{top:010d}.parquet", dataset)
+        merged[year] = len(pending)
+    return merged
+
+
+class BufferedDatasetWriter:
+    def __init__(
+        self,
+        base_dir: Path,
+        date_col: str,
+        key_cols: Iterable[str],
+        max_rows: int,
+        max_bytes: int,
+        append_only: bool = False,
+        dataset: str = "",
+        replace_on: list[str] | None = None,
+    ) -> None:
+        self.base_dir = base_dir
+        self.replace_on = replace_on
+        self.dataset = dataset
+        self.append_only = append_only
+        self.date_col = date_col
+        self.key_cols = list(key_cols)
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self._frames: list[pd.DataFrame] = []
+        self._rows = 0
+        self._bytes = 0
+
+    @property
+    def pending_rows(self) -> int:
+        return self._rows
+
+    def add(self, df: pd.DataFrame) -> None:
+        if df is None or df.empty:
+            return
+        self._frames.append(df)
+        self._rows += len(df)
+        self._bytes += int(df.memory_usage(index=False, deep=True).sum())
+
+    def should_flush(self) -> bool:
+        return self._rows >= self.max_rows or self._bytes >= self.max_bytes
+
+    def flush(self) -> int:
+        if not self._frames:
+            return 0
+        data = pd.concat(self._frames, ignore_index=True)
+        if self.append_only:
+            append_delta_by_year(
+                data, self.base_dir, self.date_col, self.key_cols, self.dataset
+            )
         else:
-            combined = part
-        combined = combined.sort_values(list(key_cols))
-        combined.to_parquet(path, index=False)
+            upsert_parquet_by_year(
+                data,
+                self.base_dir,
+                self.date_col,
+                self.key_cols,
+                self.dataset,
+                replace_on=self.replace_on,
+            )
+        written = self._rows
+        self._frames = []
+        self._rows = 0
+        self._bytes = 0
+        return written
+
+    def close(self) -> int:
+        return self.flush()
+
+
+class ParquetStreamWriter:
+    def __init__(self, path: Path, dataset: str, schema: pa.Schema | None = None) -> None:
+        self.path = Path(path)
+        self.dataset = dataset
+        self.schema = schema
+        self.rows = 0
+        self._tmp = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+        self._writer: pq.ParquetWriter | None = None
+
+    def write(self, df: pd.DataFrame) -> int:
+        if df is None or df.empty:
+            return 0
+        with metrics.timer("parquet_write", dataset=self.dataset):
+            table = to_table(df, self.dataset)
+            if self._writer is None:
+                self.schema = self.schema or table.schema
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self._writer = pq.ParquetWriter(self._tmp, self.schema, **PARQUET_OPTIONS)
+            table = table.select(self.schema.names).cast(self.schema)
+            self._writer.write_table(table, row_group_size=row_group_rows(self.dataset))
+        self.rows += table.num_rows
+        metrics.inc("stream_rows_total", table.num_rows, dataset=self.dataset)
+        return table.num_rows
+
+    def close(self, metadata: dict[str, str] | None = None) -> int:
+        if self._writer is None:
+            if self.schema is None:
+                return 0
+            self._writer = pq.ParquetWriter(self._tmp, self.schema, **PARQUET_OPTIONS)
+        if metadata:
+            self._writer.add_key_value_metadata(metadata)
+        self._writer.close()
+        self._writer = None
+        os.replace(self._tmp, self.path)
+        return self.rows
+
+    def abort(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        self._tmp.unlink(missing_ok=True)